@@ -1,36 +1,89 @@
 from flask import Flask
 from flask_cors import CORS
 from .models import db
+from . import eventos, importacion, cache, metricas, migraciones, afiliaciones, estadisticas, bitacora, compresion, arranque, replicas, exportacion, limites
+from .cola_espera import cola, escuchar_otros_workers
 import os
-import time
-from sqlalchemy.exc import OperationalError 
+
+def opciones_pool(url):
+    # SQLite no usa QueuePool; en PostgreSQL el pool se ajusta con variables de entorno
+    if not url or url.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+    }
+
+def reiniciar_tras_fork(app):
+    # Cada worker abre sus propias conexiones e hilos; los del proceso padre no se comparten
+    with app.app_context():
+        db.engine.dispose(close=False)
+        replicas.enrutador.reiniciar()
+        metricas.reiniciar_tras_fork()
+        eventos.configurar(app, db)
+        bitacora.configurar(reiniciar=True)
+        if arranque.estado.listo:
+            entre_workers = isinstance(eventos.broker, eventos.BrokerPostgres)
+            cola.cargar(en_memoria=entre_workers)
+            if entre_workers:
+                escuchar_otros_workers(app, eventos.broker)
+            if not afiliaciones.indice.cargado:
+                # El hilo que lo cargaba en el proceso padre no existe en el worker
+                arranque.cargar_afiliaciones_en_segundo_plano(app)
+        else:
+            arranque.reintentar_en_segundo_plano(app)
 
 def create_app():
     app = Flask(__name__)
     
-    CORS(app, resources={r"/*": {"origins": "*"}})
+    # El front lee X-Leer-Primaria de las escrituras para repetirlo en sus GET (ver app/replicas.py)
+    # y el ETag con la versión del registro para mandarlo en If-Match
+    CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=[replicas.ENCABEZADO, 'ETag'])
     
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones_pool(app.config['SQLALCHEMY_DATABASE_URI'])
     
     db.init_app(app)
+    # Réplicas de solo lectura para los GET (DATABASE_REPLICA_URLS)
+    replicas.configurar(app, opciones_pool)
 
     with app.app_context():
-        retries = 10
-        while retries > 0:
-            try:
-                db.create_all()
-                print("¡Conexión a la base de datos establecida exitosamente!")
-                break
-            except (OperationalError, Exception) as e:
-                retries -= 1
-                print(f"Esperando a la base de datos... ({retries} reintentos restantes)")
-                time.sleep(3)
-        
-        if retries == 0:
-            print("Error crítico: No se pudo conectar a la base de datos después de varios intentos.")
+        # Caché de historiales clínicos (LRU local + Redis opcional)
+        cache.configurar()
+        # Límites por cliente y tope de peticiones costosas en curso (429/503)
+        limites.configurar()
+        afiliaciones.configurar()
+        # Contadores por hora/día que se actualizan con cada cambio de la lista de espera
+        estadisticas.configurar()
+        # Bitácora de transiciones de la lista de espera (escritura por lotes en segundo plano)
+        bitacora.configurar()
+        # Exportaciones de consultas en segundo plano (archivos y puntos de control)
+        exportacion.configurar(app)
+
+        # Canal de avisos de la lista de espera (local o Postgres LISTEN/NOTIFY)
+        eventos.configurar(app, db)
+
+        # Conexión con reintentos, migraciones pendientes, pool y cola de espera (ver app/arranque.py)
+        if not arranque.ejecutar(app):
+            print(f"Error crítico: {arranque.estado.error}. /readyz responde 503 mientras se reintenta.")
+            arranque.reintentar_en_segundo_plano(app)
+
+    # Latencias, SQL por petición y /metrics en formato Prometheus
+    metricas.configurar(app)
+    # /healthz y /readyz
+    arranque.configurar(app)
+    # gzip/brotli; se registra al final para correr antes que las métricas y que éstas midan lo enviado
+    compresion.configurar(app)
 
     from .routes import api_bp
     app.register_blueprint(api_bp)
+    importacion.registrar_cli(app)
+    migraciones.registrar_cli(app)
+    bitacora.registrar_cli(app)
+    exportacion.registrar_cli(app)
 
     return app
\ No newline at end of file
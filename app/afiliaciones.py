@@ -0,0 +1,202 @@
+"""
+Filtro de Bloom con todos los números de afiliación registrados.
+
+Casi todas las búsquedas de recepción (paciente_existe, paciente/<n> y el alta
+de paciente) son de afiliados nuevos. Si el filtro dice que un número no está,
+es seguro que no está y no se consulta la base; si dice que puede estar, la
+ruta hace una consulta de una sola columna.
+
+Las altas hechas por este proceso se agregan en el momento. Las de otros
+workers (o de `flask importar-pacientes`) se cargan cada
+AFILIACIONES_SINCRONIZACION segundos desde una marca de agua por id que solo
+avanza con lo que devuelve la base (ver app/marca_agua.py).
+
+Para no dar falsos negativos entre sincronizaciones, antes de responder "no
+está" se lee el contador 'pacientes' de versiones_tabla (una lectura por
+llave primaria, ver app/condicional.py): si cambió desde la última
+sincronización se sincroniza en ese momento y se vuelve a revisar el filtro.
+Un número cambiado o dado de baja no se puede quitar del filtro: cuando se
+mueve el contador 'pacientes:ediciones' (que también sube con cambios de
+nombre o datos clínicos) la sincronización arma uno nuevo con la tabla
+completa y lo cambia por el actual.
+Sin los triggers del contador (motores distintos de PostgreSQL y SQLite) un
+"no está" se confirma en la base mientras la sincronización va atrasada.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from . import condicional
+from .marca_agua import MarcaAgua
+from .models import db, Paciente
+
+# 10 bits por elemento con 7 funciones hash: ~1% de falsos positivos
+BITS_POR_ELEMENTO = 10
+FUNCIONES_HASH = 7
+CAPACIDAD_INICIAL = 1 << 16
+LOTE_CARGA = 10000
+
+
+class FiltroBloom:
+
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        self.bits = capacidad * BITS_POR_ELEMENTO
+        self.elementos = 0
+        self._arreglo = bytearray((self.bits + 7) // 8)
+
+    def _posiciones(self, valor):
+        # Doble hash (Kirsch-Mitzenmacher) a partir del hash de Python; cada proceso
+        # construye su propio filtro, así que no importa que hash() varíe entre procesos
+        h = hash(valor) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(FUNCIONES_HASH)]
+
+    def agregar(self, valor):
+        arreglo = self._arreglo
+        for p in self._posiciones(valor):
+            arreglo[p >> 3] |= 1 << (p & 7)
+        self.elementos += 1
+
+    def __contains__(self, valor):
+        h = hash(valor) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        bits, arreglo = self.bits, self._arreglo
+        for i in range(FUNCIONES_HASH):
+            p = (h1 + i * h2) % bits
+            if not arreglo[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    @property
+    def lleno(self):
+        return self.elementos >= self.capacidad
+
+    @property
+    def tamano_bytes(self):
+        return len(self._arreglo)
+
+
+class IndiceAfiliaciones:
+    """
+    Filtro escalable: al llenarse uno se agrega otro del doble de capacidad (sin
+    releer la base). La carga inicial dimensiona el primero con holgura para que
+    casi nunca crezca, porque cada filtro extra suma su tasa de falsos positivos.
+    """
+
+    def __init__(self, intervalo=5.0):
+        self.intervalo = intervalo
+        self.cargado = False
+        self.descartes = 0
+        self.posibles = 0
+        self._filtros = [FiltroBloom(CAPACIDAD_INICIAL)]
+        self._marca = MarcaAgua()
+        self._sincronizado = 0.0
+        # Contadores de versiones_tabla leídos al empezar la última sincronización
+        self._versiones = None
+        self._lock = threading.Lock()
+        self._lock_sincronizar = threading.Lock()
+
+    def agregar(self, numero_afiliacion):
+        with self._lock:
+            if self._filtros[-1].lleno:
+                self._filtros.append(FiltroBloom(self._filtros[-1].capacidad * 2))
+            self._filtros[-1].agregar(numero_afiliacion)
+
+    def cargar(self):
+        with db.engine.connect() as conn:
+            total = conn.execute(select(func.count()).select_from(Paciente)).scalar()
+        self.reiniciar(2 * total)
+        self.sincronizar()
+        self.cargado = True
+
+    def reiniciar(self, capacidad):
+        with self._lock:
+            self._filtros = [FiltroBloom(max(CAPACIDAD_INICIAL, capacidad))]
+            self._marca.reiniciar()
+
+    def vencido(self):
+        return time.monotonic() - self._sincronizado >= self.intervalo
+
+    def sincronizar(self):
+        """
+        Agrega los pacientes nuevos desde la marca de agua. Si otro hilo ya sincroniza,
+        no espera y regresa False.
+        """
+        if not self._lock_sincronizar.acquire(blocking=False):
+            return False
+        try:
+            inicio = time.monotonic()
+            consulta = select(Paciente.numero_afiliacion, Paciente.id)
+            with db.engine.connect() as conn:
+                # Los contadores se leen antes que las filas: lo confirmado después vuelve a moverlos
+                versiones = condicional.leer(conn, 'pacientes', condicional.CLAVE_EDICIONES)
+                if not self._editado(versiones):
+                    for numero_afiliacion, _ in self._marca.leer(conn, consulta, Paciente.id, LOTE_CARGA):
+                        self.agregar(numero_afiliacion)
+            if self._editado(versiones):
+                # La marca de agua solo trae ids nuevos y un filtro de Bloom no permite quitar
+                # un número: tras un cambio de afiliación (de cualquier worker) se arma otro
+                nuevo = IndiceAfiliaciones(self.intervalo)
+                nuevo.cargar()
+                with self._lock:
+                    self._filtros, self._marca, versiones = nuevo._filtros, nuevo._marca, nuevo._versiones
+            self._versiones = versiones
+            self._sincronizado = inicio
+            return True
+        finally:
+            self._lock_sincronizar.release()
+
+    def _editado(self, versiones):
+        """Cambió la época o el contador de ediciones desde la última sincronización."""
+        if versiones is None or self._versiones is None:
+            return False
+        return (versiones[0], versiones[2]) != (self._versiones[0], self._versiones[2])
+
+    def atrasado(self):
+        """Hubo altas o cambios en pacientes (de cualquier worker) después de la última sincronización."""
+        with db.engine.connect() as conn:
+            versiones = condicional.leer(conn, 'pacientes', condicional.CLAVE_EDICIONES)
+        if versiones is None:
+            return self.vencido()
+        return versiones != self._versiones
+
+    def puede_existir(self, numero_afiliacion, sincronizar=True):
+        """
+        False: seguro que no está registrado. True: hay que confirmarlo en la base.
+        Con sincronizar=False solo se consulta el filtro (sin leer la base), tal como está.
+        """
+        if not self.cargado or not isinstance(numero_afiliacion, str):
+            return True
+        if sincronizar and self.vencido():
+            self.sincronizar()
+        if any(numero_afiliacion in f for f in self._filtros):
+            self.posibles += 1
+            return True
+        if sincronizar and self.atrasado():
+            # Otro worker registró pacientes desde la última sincronización; si otro hilo
+            # ya está sincronizando no se espera y se confirma en la base
+            if not self.sincronizar() or any(numero_afiliacion in f for f in self._filtros):
+                self.posibles += 1
+                return True
+        self.descartes += 1
+        return False
+
+    def estadisticas(self):
+        return {
+            "elementos": sum(f.elementos for f in self._filtros),
+            "bytes": sum(f.tamano_bytes for f in self._filtros),
+            "filtros": len(self._filtros),
+            "descartes": self.descartes,
+            "posibles": self.posibles,
+        }
+
+
+indice = IndiceAfiliaciones()
+
+
+def configurar():
+    indice.intervalo = float(os.environ.get('AFILIACIONES_SINCRONIZACION', 5))
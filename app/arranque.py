@@ -0,0 +1,169 @@
+"""
+Arranque de la aplicación y sondas de salud.
+
+Pasos, en orden (cada uno se cronometra y aparece en /readyz):
+
+1. conexion     espera a la base con reintentos exponenciales; solo se
+                reintenta OperationalError (base caída o todavía arrancando),
+                cualquier otro error detiene el arranque
+2. migraciones  una lectura de esquema_version si ya está al día
+3. pool         abre de una vez las conexiones base del pool
+4. cola         carga la lista de espera en memoria (solo con
+                ESPERA_BROKER=postgres; sin él se lee de la tabla)
+5. busqueda     detecta los índices de PostgreSQL para la búsqueda
+
+El filtro de números de afiliación se carga después en un hilo: mientras no
+está listo deja pasar todas las consultas, así que no retrasa el arranque.
+
+Si la base no responde después de todos los intentos la aplicación arranca
+igual, /readyz responde 503 y un hilo sigue reintentando hasta completar
+los pasos pendientes.
+
+    /healthz  el proceso está vivo (no toca la base)
+    /readyz   el arranque terminó y la base responde (incluye el estado de
+              las réplicas de lectura, que no afecta el 200/503)
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import jsonify
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from .models import db
+from . import afiliaciones, busqueda, eventos, migraciones, replicas
+from .cola_espera import cola, escuchar_otros_workers
+
+
+class Arranque:
+
+    def __init__(self):
+        self.listo = False
+        self.error = None
+        self.pasos = {}
+        self.segundo_plano = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def paso(self, nombre):
+        inicio = time.perf_counter()
+        yield
+        self.pasos[nombre] = round(time.perf_counter() - inicio, 4)
+
+    def resumen(self):
+        resumen = {"listo": self.listo, "error": self.error, "pasos": dict(self.pasos),
+                   "total": round(sum(self.pasos.values()), 4), "segundo_plano": dict(self.segundo_plano)}
+        if replicas.enrutador.activo:
+            # Informativo: sin réplicas sanas las lecturas van a la primaria, la instancia sigue lista
+            resumen["replicas"] = replicas.enrutador.resumen()
+        return resumen
+
+
+estado = Arranque()
+
+
+def esperar_base(intentos=None, espera=None, espera_maxima=None):
+    """Primer SELECT 1 con reintentos exponenciales (0.25s, 0.5s, 1s... hasta espera_maxima)."""
+    intentos = intentos or int(os.environ.get('DB_ARRANQUE_INTENTOS', 10))
+    espera = espera or float(os.environ.get('DB_ARRANQUE_ESPERA', 0.25))
+    espera_maxima = espera_maxima or float(os.environ.get('DB_ARRANQUE_ESPERA_MAXIMA', 8))
+    for intento in range(1, intentos + 1):
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return
+        except OperationalError as e:
+            if intento == intentos:
+                raise
+            print(f"Esperando a la base de datos ({type(e.orig).__name__}); "
+                  f"intento {intento}/{intentos}, siguiente en {espera:.2f}s")
+            time.sleep(espera)
+            espera = min(espera * 2, espera_maxima)
+
+
+def calentar_pool():
+    """Abre las conexiones base del pool para que las primeras peticiones no paguen el connect."""
+    tamano = db.engine.pool.size() if hasattr(db.engine.pool, 'size') else 1
+    conexiones = []
+    try:
+        for _ in range(tamano):
+            conexiones.append(db.engine.connect())
+    finally:
+        for conn in conexiones:
+            conn.close()
+
+
+def cargar_afiliaciones_en_segundo_plano(app):
+    def cargar():
+        inicio = time.perf_counter()
+        try:
+            with app.app_context():
+                afiliaciones.indice.cargar()
+            estado.segundo_plano['afiliaciones'] = round(time.perf_counter() - inicio, 4)
+        except Exception as e:
+            print(f"No se pudo cargar el filtro de afiliaciones: {e}")
+
+    threading.Thread(target=cargar, daemon=True).start()
+
+
+def ejecutar(app, intentos=None):
+    """Corre los pasos de arranque dentro del contexto de `app`; regresa True si quedó lista."""
+    with estado._lock:
+        try:
+            with estado.paso('conexion'):
+                esperar_base(intentos)
+        except OperationalError as e:
+            estado.error = f"Base de datos no disponible: {e.orig}"
+            return False
+        with estado.paso('migraciones'):
+            migraciones.migrar()
+        with estado.paso('pool'):
+            calentar_pool()
+        entre_workers = isinstance(eventos.broker, eventos.BrokerPostgres)
+        with estado.paso('cola'):
+            cola.cargar(en_memoria=entre_workers)
+        with estado.paso('busqueda'):
+            busqueda.preparar()
+        if entre_workers:
+            escuchar_otros_workers(app, eventos.broker)
+        estado.error = None
+        estado.listo = True
+
+    cargar_afiliaciones_en_segundo_plano(app)
+    print(f"¡Conexión a la base de datos establecida exitosamente! "
+          f"(arranque en {sum(estado.pasos.values()):.2f}s)")
+    return True
+
+
+def reintentar_en_segundo_plano(app):
+    """Después de agotar los intentos iniciales: sigue intentando hasta completar el arranque."""
+    def bucle():
+        with app.app_context():
+            while not ejecutar(app):
+                time.sleep(float(os.environ.get('DB_ARRANQUE_ESPERA_MAXIMA', 8)))
+
+    threading.Thread(target=bucle, daemon=True).start()
+
+
+# --- sondas ---
+
+def healthz():
+    return jsonify({"estado": "ok"})
+
+
+def readyz():
+    if not estado.listo:
+        return jsonify(estado.resumen()), 503
+    try:
+        with db.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except OperationalError as e:
+        return jsonify(dict(estado.resumen(), listo=False, error=f"Base de datos no disponible: {e.orig}")), 503
+    return jsonify(estado.resumen())
+
+
+def configurar(app):
+    app.add_url_rule('/healthz', 'healthz', healthz)
+    app.add_url_rule('/readyz', 'readyz', readyz)
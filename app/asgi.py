@@ -0,0 +1,242 @@
+"""
+Modo de servicio asíncrono (ASGI).
+
+    uvicorn app.asgi:aplicacion --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker app.asgi:aplicacion
+
+Las consultas de solo lectura que pasan casi todo su tiempo esperando a la
+base (existencia de paciente, paciente por afiliación, historial y detalle de
+consultas) se atienden con un engine asíncrono (asyncpg) y su propio pool de
+conexiones; el resto de las rutas se delega a la aplicación Flask de siempre.
+Ambos caminos usan los mismos modelos de app/models.py y los mismos
+serializadores, y las peticiones asíncronas se cuentan en /metrics con la
+regla de la ruta Flask equivalente. Ninguna de estas rutas está marcada como
+costosa en routes.py, así que tampoco pasan por app/limites.py.
+"""
+import asyncio
+import contextvars
+import os
+import re
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.http import parse_etags
+
+from . import create_app, afiliaciones, cache, compresion, condicional, exportacion, metricas, opciones_pool, serializacion
+from .models import Paciente, Consulta
+
+DRIVERS_ASINCRONOS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def url_asincrona(url):
+    url = make_url(url)
+    return url.set(drivername=DRIVERS_ASINCRONOS.get(url.drivername, url.drivername))
+
+
+flask_app = create_app()
+engine = create_async_engine(url_asincrona(os.environ['DATABASE_URL']),
+                             **opciones_pool(os.environ['DATABASE_URL']))
+
+
+# Sentencias SQL y tiempo de serialización de la petición asíncrona en curso (como g.metricas en Flask)
+_medicion = contextvars.ContextVar('medicion', default=None)
+
+
+@event.listens_for(engine.sync_engine, 'before_cursor_execute')
+def _antes_de_sql(conn, cursor, sentencia, parametros, contexto, executemany):
+    conn.info.setdefault('inicio_sql_asgi', []).append(time.perf_counter())
+
+
+@event.listens_for(engine.sync_engine, 'after_cursor_execute')
+def _despues_de_sql(conn, cursor, sentencia, parametros, contexto, executemany):
+    duracion = time.perf_counter() - conn.info['inicio_sql_asgi'].pop()
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion['sql_n'] += 1
+        medicion['sql_t'] += duracion
+
+
+def a_json(obj):
+    # Mismo proveedor (y mismos bytes) que jsonify en las rutas Flask
+    inicio = time.perf_counter()
+    cuerpo = flask_app.json.dumps_bytes(obj) + b"\n"
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion['serializacion'] += time.perf_counter() - inicio
+    return cuerpo
+
+
+async def en_cache(funcion, *args):
+    # redis-py es síncrono: con caché compartida la llamada se hace fuera del event loop
+    if cache.respuestas.compartido is None:
+        return funcion(*args)
+    return await asyncio.to_thread(funcion, *args)
+
+
+def _puede_existir(numero_afiliacion):
+    with flask_app.app_context():
+        return afiliaciones.indice.puede_existir(numero_afiliacion)
+
+
+async def puede_existir(numero_afiliacion):
+    # Antes de descartar, el filtro lee el contador de pacientes con el engine síncrono:
+    # se consulta fuera del event loop
+    return await asyncio.to_thread(_puede_existir, numero_afiliacion)
+
+
+# --- vistas asíncronas (mismas respuestas que sus equivalentes en routes.py) ---
+# Regresan (estado, cuerpo[, encabezados]) o None para que la petición la atienda Flask.
+
+async def paciente_existe(numero_afiliacion, encabezados):
+    if not await puede_existir(numero_afiliacion):
+        return 200, {"existe": False}
+    async with engine.connect() as conn:
+        nombre = (await conn.execute(
+            select(Paciente.nombre).where(Paciente.numero_afiliacion == numero_afiliacion)
+        )).scalar()
+    if nombre is None:
+        return 200, {"existe": False}
+    return 200, {"existe": True, "nombre": nombre}
+
+
+async def obtener_paciente_por_afiliacion(numero_afiliacion, encabezados):
+    if not await puede_existir(numero_afiliacion):
+        return 404, {"error": "Paciente no encontrado"}
+    async with engine.connect() as conn:
+        paciente = (await conn.execute(
+            select(Paciente.id, Paciente.nombre, Paciente.numero_afiliacion)
+            .where(Paciente.numero_afiliacion == numero_afiliacion)
+        )).first()
+    if paciente is None:
+        return 404, {"error": "Paciente no encontrado"}
+    return 200, {"paciente_id": paciente.id, "nombre": paciente.nombre,
+                 "numero_afiliacion": paciente.numero_afiliacion}
+
+
+async def consultas_por_paciente(paciente_id, encabezados):
+    version = None
+    if engine.dialect.name in condicional.DIALECTOS:
+        claves = (condicional.clave_historial(int(paciente_id)),)
+        async with engine.connect() as conn:
+            filas = (await conn.execute(condicional.consulta_versiones(claves))).all()
+        version = condicional.formar_etag(filas, claves)
+        enviada = condicional.coincide(version, parse_etags(encabezados.get(b'if-none-match', b'').decode()))
+        if enviada is not None:
+            return 304, b'', [(b'etag', f'"{enviada}"'.encode())]
+
+    # Comparte la caché (y sus invalidaciones) con las rutas Flask del mismo proceso
+    clave = cache.clave_consultas(int(paciente_id))
+    entrada = await en_cache(cache.respuestas.obtener, clave)
+    if entrada is None or (version is not None and entrada[1] != version):
+        generacion = cache.respuestas.generacion(clave)
+        s = serializacion.CONSULTA_HISTORIAL
+        async with engine.connect() as conn:
+            filas = (await conn.execute(
+                select(*s.columnas)
+                .join(Paciente, Consulta.paciente_id == Paciente.id)
+                .where(Consulta.paciente_id == int(paciente_id))
+                .order_by(Consulta.fecha_consulta.desc())
+            )).all()
+        if not filas:
+            return 404, {"message": "No se encontraron consultas para este paciente"}
+        entrada = await en_cache(cache.respuestas.guardar, clave, a_json(s.filas(filas)), generacion, version)
+
+    cuerpo, etag = entrada
+    if version is None and encabezados.get(b'if-none-match', b'').decode().strip('"') == etag:
+        return 304, b''
+    return 200, cuerpo, [(b'etag', f'"{etag}"'.encode())]
+
+
+async def obtener_consulta(consulta_id, encabezados):
+    s = serializacion.CONSULTA
+    async with engine.connect() as conn:
+        consulta = (await conn.execute(select(*s.columnas).where(Consulta.id == int(consulta_id)))).first()
+    if consulta is None:
+        return None  # la página 404 de Flask
+    datos = s.fila(consulta)
+    return 200, datos, [(b'etag', f'"{datos["version"]}"'.encode())]
+
+
+# (patrón, vista, regla de la ruta Flask equivalente para las métricas)
+RUTAS = [
+    (re.compile(r'^/paciente_existe/(?P<numero_afiliacion>[^/]+)$'), paciente_existe,
+     '/paciente_existe/<string:numero_afiliacion>'),
+    (re.compile(r'^/paciente/(?P<numero_afiliacion>[^/]+)$'), obtener_paciente_por_afiliacion,
+     '/paciente/<numero_afiliacion>'),
+    (re.compile(r'^/consultas/paciente/(?P<paciente_id>\d+)$'), consultas_por_paciente,
+     '/consultas/paciente/<int:paciente_id>'),
+    (re.compile(r'^/consultas/(?P<consulta_id>\d+)$'), obtener_consulta, '/consultas/<int:consulta_id>'),
+]
+
+
+# --- aplicación ASGI ---
+
+flask_asgi = WsgiToAsgi(flask_app)
+
+
+async def _responder(send, estado, cuerpo, extra=(), accept_encoding=None):
+    if not isinstance(cuerpo, bytes):
+        cuerpo = a_json(cuerpo)
+    extra = list(extra)
+    if estado != 304:
+        extra.append((b'vary', b'Accept-Encoding'))
+    # Misma negociación que compresion._despues_de_peticion para las rutas Flask
+    codificacion = compresion.elegir(accept_encoding) if estado == 200 and compresion.activa else None
+    if codificacion and len(cuerpo) >= compresion.umbral:
+        cuerpo = await asyncio.to_thread(compresion.comprimir, cuerpo, codificacion)
+        extra = [(n, f'{v.decode()[:-1]}-{codificacion}"'.encode()) if n == b'etag' else (n, v)
+                 for n, v in extra]
+        extra.append((b'content-encoding', codificacion.encode()))
+    encabezados = [(b'content-type', b'application/json'),
+                   (b'content-length', str(len(cuerpo)).encode()),
+                   (b'access-control-allow-origin', b'*'), (b'access-control-expose-headers', b'ETag'), *extra]
+    await send({'type': 'http.response.start', 'status': estado, 'headers': encabezados})
+    await send({'type': 'http.response.body', 'body': cuerpo})
+    return estado, len(cuerpo)
+
+
+async def _ciclo_de_vida(receive, send):
+    while True:
+        mensaje = await receive()
+        if mensaje['type'] == 'lifespan.startup':
+            # Exportaciones que quedaron a medias en un proceso anterior (ver app/exportacion.py)
+            exportacion.reanudar_huerfanas(flask_app)
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensaje['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def aplicacion(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _ciclo_de_vida(receive, send)
+
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        for patron, vista, regla in RUTAS:
+            coincidencia = patron.match(scope['path'])
+            if coincidencia:
+                encabezados = dict(scope['headers'])
+                medicion = {'sql_n': 0, 'sql_t': 0.0, 'serializacion': 0.0}
+                _medicion.set(medicion)
+                inicio = time.perf_counter()
+                resultado = await vista(**coincidencia.groupdict(), encabezados=encabezados)
+                if resultado is not None:
+                    estado, tamano = await _responder(
+                        send, *resultado, accept_encoding=encabezados.get(b'accept-encoding', b'').decode())
+                    metricas.registro.registrar(regla, 'GET', estado, time.perf_counter() - inicio,
+                                                medicion['sql_n'], medicion['sql_t'],
+                                                medicion['serializacion'], tamano)
+                    return
+                _medicion.set(None)
+                break
+
+    # Todo lo demás (escrituras, SSE, búsquedas, métricas...) lo atiende Flask en un hilo
+    await flask_asgi(scope, receive, send)
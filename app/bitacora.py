@@ -0,0 +1,236 @@
+"""
+Bitácora de la lista de espera: una fila por transición en eventos_espera.
+
+    llegada   ingreso a la espera (nuevo o reingreso), estado -> 1
+    llamado   pasa a atención, 1 -> 2
+    atendido  sale después de ser atendido, 2 -> 3
+    retirado  sale sin ser atendido, 1 -> 3
+
+La tabla solo recibe INSERT. Las rutas no escriben en ella: cada cambio
+confirmado se encola y un hilo lo guarda por lotes (hasta TAMANO_LOTE filas
+o cada INTERVALO_LOTE segundos) en una sola transacción. Si la base no
+responde, el lote se reintenta; si la cola se llena, los eventos se descartan
+y se cuentan en `descartados`.
+
+`flask reproducir-espera` recorre la bitácora para reconstruir el estado
+actual de la cola o calcular percentiles del tiempo de espera.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import insert, select
+
+from .models import db, EventoEspera
+from .cola_espera import cola
+
+TAMANO_LOTE = 500
+INTERVALO_LOTE = 0.2
+MAXIMO_PENDIENTES = 100000
+LOTE_LECTURA = 20000
+
+tabla = EventoEspera.__table__
+
+
+def tipo_evento(anterior, estado):
+    """Tipo de evento de una transición, o None si no cambia nada (p. ej. 3 -> 3)."""
+    if estado == '1':
+        return 'llegada'
+    if estado == '2' and anterior == '1':
+        return 'llamado'
+    if estado == '3' and anterior == '2':
+        return 'atendido'
+    if estado == '3' and anterior == '1':
+        return 'retirado'
+    return None
+
+
+class Escritor:
+
+    def __init__(self, engine, tamano_lote=TAMANO_LOTE, intervalo=INTERVALO_LOTE):
+        self.engine = engine
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.escritos = 0
+        self.lotes = 0
+        self.descartados = 0
+        self._cola = queue.Queue(maxsize=MAXIMO_PENDIENTES)
+        self._hilo = threading.Thread(target=self._escribir, daemon=True)
+        self._hilo.start()
+
+    def encolar(self, evento):
+        try:
+            self._cola.put_nowait(evento)
+        except queue.Full:
+            self.descartados += 1
+
+    def pendientes(self):
+        return self._cola.qsize()
+
+    def vaciar(self, limite=5.0):
+        """Espera a que se escriba lo pendiente (al terminar el proceso o en pruebas)."""
+        fin = time.monotonic() + limite
+        while self._cola.unfinished_tasks and time.monotonic() < fin:
+            time.sleep(0.01)
+
+    def _escribir(self):
+        while True:
+            lote = [self._cola.get()]
+            fin = time.monotonic() + self.intervalo
+            while len(lote) < self.tamano_lote:
+                restante = fin - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            self._guardar(lote)
+            for _ in lote:
+                self._cola.task_done()
+
+    def _guardar(self, lote):
+        espera = 0.5
+        while True:
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(insert(tabla), lote)
+                self.escritos += len(lote)
+                self.lotes += 1
+                return
+            except Exception as e:
+                print(f"No se pudo escribir la bitácora de espera ({len(lote)} eventos): {e}")
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+
+    def estadisticas(self):
+        return {"escritos": self.escritos, "lotes": self.lotes,
+                "pendientes": self.pendientes(), "descartados": self.descartados}
+
+
+escritor = None
+
+
+def registrar(anterior, entrada):
+    """Función de cola.confirmados: encola el evento de la transición ya confirmada."""
+    tipo = tipo_evento(anterior, entrada.estado)
+    if tipo is None or escritor is None:
+        return
+    escritor.encolar({
+        "espera_id": entrada.id, "numero_afiliacion": entrada.numero_afiliacion, "tipo": tipo,
+        "area": entrada.area, "momento": entrada.cambio or datetime.now(),
+    })
+
+
+# --- reproducción ---
+
+def leer_eventos(conn, desde=None, hasta=None):
+    """
+    Eventos (espera_id, numero_afiliacion, tipo, area, momento) en el orden en que ocurrieron.
+    El id es el orden de escritura, que entre workers no coincide: solo desempata.
+    """
+    consulta = select(tabla.c.espera_id, tabla.c.numero_afiliacion, tabla.c.tipo,
+                      tabla.c.area, tabla.c.momento).order_by(tabla.c.momento, tabla.c.id)
+    if desde is not None:
+        consulta = consulta.where(tabla.c.momento >= desde)
+    if hasta is not None:
+        consulta = consulta.where(tabla.c.momento < hasta)
+    return conn.execution_options(yield_per=LOTE_LECTURA).execute(consulta)
+
+
+def reconstruir_estado(eventos):
+    """{espera_id: (estado, area, numero_afiliacion, llegada)} de los pacientes activos al final."""
+    estado = {}
+    for espera_id, numero_afiliacion, tipo, area, momento in eventos:
+        if tipo == 'llegada':
+            previo = estado.get(espera_id)
+            llegada = previo[3] if previo else momento  # un reingreso estando activo conserva la llegada
+            estado[espera_id] = ('1', area, numero_afiliacion, llegada)
+        elif tipo == 'llamado' and espera_id in estado:
+            _, _, _, llegada = estado[espera_id]
+            estado[espera_id] = ('2', area, numero_afiliacion, llegada)
+        else:
+            estado.pop(espera_id, None)
+    return estado
+
+
+def tiempos_de_espera(eventos):
+    """{area: array de minutos entre la llegada y el llamado}."""
+    llegadas = {}
+    tiempos = defaultdict(lambda: array('d'))
+    for espera_id, _, tipo, area, momento in eventos:
+        if tipo == 'llegada':
+            llegadas.setdefault(espera_id, momento)
+        elif tipo == 'llamado':
+            llegada = llegadas.pop(espera_id, None)
+            if llegada is not None:
+                tiempos[area or ''].append((momento - llegada).total_seconds() / 60)
+        else:
+            llegadas.pop(espera_id, None)
+    return tiempos
+
+
+def percentiles(valores, puntos=(50, 90, 95, 99)):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return {}
+    return {f"p{p}": round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))], 1)
+            for p in puntos}
+
+
+def _vaciar_al_salir():
+    if escritor is not None:
+        escritor.vaciar()
+
+
+atexit.register(_vaciar_al_salir)
+
+
+def configurar(reiniciar=False):
+    """reiniciar=True después de un fork: el hilo escritor del proceso padre no existe en el hijo."""
+    global escritor
+    if escritor is None or reiniciar:
+        escritor = Escritor(db.engine, tamano_lote=int(os.environ.get('BITACORA_LOTE', TAMANO_LOTE)),
+                            intervalo=float(os.environ.get('BITACORA_INTERVALO', INTERVALO_LOTE)))
+    if registrar not in cola.confirmados:
+        cola.confirmados.append(registrar)
+
+
+def registrar_cli(app):
+    @app.cli.command('reproducir-espera')
+    @click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), default=None)
+    @click.option('--hasta', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Día final (incluido).')
+    @click.option('--estado', 'ver_estado', is_flag=True,
+                  help='Reconstruye la cola actual y la compara con lista_espera.')
+    def reproducir_espera(desde, hasta, ver_estado):
+        """Recorre la bitácora de espera: percentiles de espera por área o estado actual."""
+        inicio = time.perf_counter()
+        with db.engine.connect() as conn:
+            if ver_estado:
+                estado = reconstruir_estado(leer_eventos(conn))
+                en_tabla = {e.id: e.estado for e in cola.activos()}
+                diferencias = {id for id in set(estado) | set(en_tabla)
+                               if estado.get(id, (None,))[0] != en_tabla.get(id)}
+                for id, (estado_id, area, afiliacion, llegada) in sorted(estado.items()):
+                    click.echo(f"{id}\t{afiliacion}\t{area}\testado {estado_id}\tdesde {llegada:%Y-%m-%d %H:%M}")
+                click.echo(f"{len(estado)} activos según la bitácora; "
+                           f"{len(diferencias)} diferencias con lista_espera" +
+                           (f" (ids: {', '.join(map(str, sorted(diferencias)[:20]))}"
+                            f"{'...' if len(diferencias) > 20 else ''})" if diferencias else ""))
+            else:
+                fin = hasta + timedelta(days=1) if hasta else None
+                tiempos = tiempos_de_espera(leer_eventos(conn, desde, fin))
+                for area, valores in sorted(tiempos.items()):
+                    resumen = ' '.join(f"{k}={v}min" for k, v in percentiles(valores).items())
+                    click.echo(f"{area or '(sin área)'}\t{len(valores)} atendidos\t{resumen}")
+                todos = [v for valores in tiempos.values() for v in valores]
+                resumen = ' '.join(f"{k}={v}min" for k, v in percentiles(todos).items())
+                click.echo(f"total\t{len(todos)} atendidos\t{resumen}")
+        click.echo(f"({time.perf_counter() - inicio:.2f}s)")
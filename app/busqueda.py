@@ -0,0 +1,258 @@
+"""
+Búsqueda de pacientes por nombre, número de afiliación y (opcionalmente)
+texto clínico, sin distinguir acentos y tolerando errores de escritura.
+
+En PostgreSQL se usan índices GIN de pg_trgm (nombre y afiliación) y un
+tsvector sobre enfermedades/alergias, creados por la migración 3. En otras bases (SQLite en pruebas) se
+usa un índice de trigramas en memoria con el mismo criterio de relevancia.
+
+El índice en memoria recoge las altas de cualquier worker con una marca de
+agua por id; los cambios de nombre, afiliación o datos clínicos y las bajas
+mueven el contador 'pacientes:ediciones' (app/condicional.py) y el índice se
+vuelve a armar completo en la siguiente búsqueda.
+"""
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from sqlalchemy import select, text
+
+from . import condicional
+from .marca_agua import MarcaAgua
+from .models import db, Paciente, PacienteEspera
+
+# Fracción mínima de trigramas de la búsqueda que debe tener un nombre
+UMBRAL_SIMILITUD = 0.3
+LOTE_CARGA = 5000
+
+SQL_PREPARAR_POSTGRES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() no es IMMUTABLE y no se puede indexar directamente
+    """CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS
+       $$ SELECT public.unaccent('public.unaccent', $1) $$
+       LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT""",
+    """CREATE INDEX IF NOT EXISTS ix_pacientes_nombre_trgm
+       ON pacientes USING gin (f_unaccent(lower(nombre)) gin_trgm_ops)""",
+    """CREATE INDEX IF NOT EXISTS ix_pacientes_afiliacion_trgm
+       ON pacientes USING gin (numero_afiliacion gin_trgm_ops)""",
+    """CREATE INDEX IF NOT EXISTS ix_pacientes_clinico_fts
+       ON pacientes USING gin (to_tsvector('simple',
+          f_unaccent(lower(coalesce(enfermedades, '') || ' ' || coalesce(alergias, '')))))""",
+]
+
+SQL_BUSCAR_POSTGRES = """
+    SELECT id, nombre, numero_afiliacion,
+           GREATEST(
+               word_similarity(f_unaccent(lower(:q)), f_unaccent(lower(nombre))),
+               CASE WHEN numero_afiliacion LIKE :contiene THEN 1.0
+                    ELSE similarity(numero_afiliacion, :q) END
+               {rango_clinico}
+           ) AS relevancia
+    FROM pacientes
+    WHERE (f_unaccent(lower(:q)) <% f_unaccent(lower(nombre))
+       OR numero_afiliacion % :q
+       OR numero_afiliacion LIKE :contiene
+       {filtro_clinico})
+       {filtro_atendidos}
+    ORDER BY relevancia DESC, id
+    LIMIT :limite OFFSET :desplazamiento
+"""
+SQL_ATENDIDOS = "AND numero_afiliacion IN (SELECT numero_afiliacion FROM lista_espera WHERE estado = '3')"
+SQL_CLINICO = "to_tsvector('simple', f_unaccent(lower(coalesce(enfermedades, '') || ' ' || coalesce(alergias, ''))))"
+
+
+def normalizar(texto):
+    """Minúsculas, sin acentos y solo letras/números separados por un espacio."""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return ' '.join(re.findall(r'[a-z0-9ñ]+', texto))
+
+
+def trigramas(texto):
+    """Trigramas al estilo pg_trgm: cada palabra se rellena con dos espacios al inicio y uno al final."""
+    resultado = set()
+    for palabra in texto.split():
+        palabra = f"  {palabra} "
+        resultado.update(palabra[i:i + 3] for i in range(len(palabra) - 2))
+    return resultado
+
+
+class IndiceTrigramas:
+    """Índice invertido en memoria para cuando la base no es PostgreSQL."""
+
+    # Lo que se reemplaza al rehacer el índice (los candados se conservan)
+    _DATOS = ('_trigramas', '_palabras_clinicas', '_trigramas_afiliacion', '_afiliaciones',
+              '_nombres', '_clinicas', '_marca', '_ediciones')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trigramas = {}
+        self._palabras_clinicas = {}
+        self._trigramas_afiliacion = {}
+        self._afiliaciones = {}
+        self._nombres = {}
+        # Palabras clínicas de cada id, para quitarlo sin recorrer todo el vocabulario
+        self._clinicas = {}
+        self._marca = MarcaAgua()
+        # (época, contador de ediciones) de la última sincronización
+        self._ediciones = None
+        self._lock_sincronizar = threading.Lock()
+
+    def agregar(self, id, nombre, numero_afiliacion, enfermedades=None, alergias=None):
+        nombre_norm = normalizar(nombre)
+        with self._lock:
+            if id in self._nombres:
+                self._quitar(id)
+            tn = frozenset(trigramas(nombre_norm))
+            self._nombres[id] = (nombre, nombre_norm, tn)
+            self._afiliaciones[id] = numero_afiliacion
+            for t in tn:
+                self._trigramas.setdefault(t, set()).add(id)
+            for t in _subcadenas(numero_afiliacion):
+                self._trigramas_afiliacion.setdefault(t, set()).add(id)
+            palabras = frozenset(normalizar(f"{enfermedades or ''} {alergias or ''}").split())
+            self._clinicas[id] = palabras
+            for palabra in palabras:
+                self._palabras_clinicas.setdefault(palabra, set()).add(id)
+
+    def actualizar(self, id, nombre, numero_afiliacion, enfermedades=None, alergias=None):
+        """Reindexa un paciente editado; los que aún no se cargan los traerá sincronizar()."""
+        with self._lock:
+            if id not in self._nombres:
+                return
+        self.agregar(id, nombre, numero_afiliacion, enfermedades, alergias)
+
+    def _quitar(self, id):
+        _, _, tn = self._nombres.pop(id)
+        for t in tn:
+            self._trigramas[t].discard(id)
+        for t in _subcadenas(self._afiliaciones.pop(id)):
+            self._trigramas_afiliacion[t].discard(id)
+        for palabra in self._clinicas.pop(id):
+            self._palabras_clinicas[palabra].discard(id)
+
+    def sincronizar(self):
+        """
+        Agrega los pacientes nuevos (de este u otro worker) desde la marca de agua, o
+        rehace todo el índice si desde la última vez se editaron o borraron pacientes.
+        """
+        consulta = select(Paciente.id, Paciente.nombre, Paciente.numero_afiliacion,
+                          Paciente.enfermedades, Paciente.alergias)
+        with self._lock_sincronizar:
+            with db.engine.connect() as conn:
+                ediciones = condicional.leer(conn, condicional.CLAVE_EDICIONES)
+                if ediciones == self._ediciones or self._ediciones is None:
+                    for fila in self._marca.leer(conn, consulta, Paciente.id, LOTE_CARGA):
+                        self.agregar(*fila)
+                    self._ediciones = ediciones
+                    return
+            # La marca de agua solo trae ids nuevos: se arma otro índice y se cambia por éste
+            nuevo = IndiceTrigramas()
+            nuevo.sincronizar()
+            with self._lock:
+                for atributo in self._DATOS:
+                    setattr(self, atributo, getattr(nuevo, atributo))
+
+    def buscar(self, q, clinico=False, afiliaciones=None):
+        """
+        Regresa [(relevancia, id, nombre, numero_afiliacion)] ordenado por relevancia.
+        Con `afiliaciones` (un conjunto) solo se consideran esos números.
+        """
+        self.sincronizar()
+        q_norm = normalizar(q)
+        q_afiliacion = q.strip()
+        puntajes = Counter()
+
+        with self._lock:
+            tq = trigramas(q_norm)
+            if tq:
+                # Un nombre con al menos `minimo` trigramas en común contiene forzosamente
+                # alguno de los (len(tq) - minimo + 1) trigramas menos frecuentes
+                minimo = max(1, math.ceil(UMBRAL_SIMILITUD * len(tq)))
+                por_frecuencia = sorted(tq, key=lambda t: len(self._trigramas.get(t, ())))
+                candidatos = set()
+                for t in por_frecuencia[:len(tq) - minimo + 1]:
+                    candidatos.update(self._trigramas.get(t, ()))
+                for id in candidatos:
+                    comunes = len(tq & self._nombres[id][2])
+                    if comunes >= minimo:
+                        puntajes[id] = comunes / len(tq)
+
+            if q_afiliacion:
+                # Los números de afiliación se buscan como subcadena (LIKE '%q%'); con 3 o más
+                # caracteres los candidatos salen de sus subcadenas de 3 y se confirman
+                tq_afiliacion = _subcadenas(q_afiliacion)
+                if tq_afiliacion:
+                    candidatos = set.intersection(*(self._trigramas_afiliacion.get(t, set())
+                                                    for t in tq_afiliacion))
+                else:
+                    candidatos = self._afiliaciones
+                for id in candidatos:
+                    if q_afiliacion in self._afiliaciones[id]:
+                        puntajes[id] = 1.0
+
+            if clinico and q_norm:
+                conjuntos = [self._palabras_clinicas.get(p, set()) for p in q_norm.split()]
+                for id in set.intersection(*conjuntos):
+                    puntajes[id] = max(puntajes[id], 0.4)
+
+            resultado = [(p, id, self._nombres[id][0], self._afiliaciones[id])
+                         for id, p in puntajes.items()
+                         if afiliaciones is None or self._afiliaciones[id] in afiliaciones]
+        resultado.sort(key=lambda r: (-r[0], r[1]))
+        return resultado
+
+
+def _subcadenas(afiliacion):
+    return {afiliacion[i:i + 3] for i in range(len(afiliacion) - 2)}
+
+
+indice = IndiceTrigramas()
+usar_postgres = False
+
+
+def preparar():
+    """Usa los índices de PostgreSQL si la migración pudo crearlos; si no, el índice en memoria."""
+    global usar_postgres
+    if db.engine.dialect.name != 'postgresql':
+        return
+    with db.engine.connect() as conn:
+        usar_postgres = conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'f_unaccent') "
+            "AND EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"
+        )).scalar()
+
+
+def buscar_pacientes(q, clinico=False, limite=20, desplazamiento=0, atendidos=False):
+    """
+    Resultados [{id, nombre, numero_afiliacion, relevancia}] ordenados por relevancia.
+    Con atendidos=True solo entran los pacientes con registro en estado 3 en la lista de espera.
+    """
+    if usar_postgres:
+        sql = SQL_BUSCAR_POSTGRES.format(
+            rango_clinico=f", CASE WHEN {SQL_CLINICO} @@ plainto_tsquery('simple', f_unaccent(lower(:q))) THEN 0.4 ELSE 0 END" if clinico else "",
+            filtro_clinico=f"OR {SQL_CLINICO} @@ plainto_tsquery('simple', f_unaccent(lower(:q)))" if clinico else "",
+            filtro_atendidos=SQL_ATENDIDOS if atendidos else "",
+        )
+        # Umbral del operador <% igual al del índice en memoria (el valor por omisión es 0.6).
+        # Las dos sentencias se marcan como lectura para que en un GET vayan juntas a la réplica
+        db.session.execute(text(f"SET LOCAL pg_trgm.word_similarity_threshold = {UMBRAL_SIMILITUD}")
+                           .execution_options(lectura=True))
+        filas = db.session.execute(text(sql).execution_options(lectura=True), {
+            "q": q, "contiene": f"%{q.strip()}%", "limite": limite, "desplazamiento": desplazamiento,
+        }).all()
+    else:
+        afiliaciones = None
+        if atendidos:
+            afiliaciones = set(db.session.scalars(
+                select(PacienteEspera.numero_afiliacion).where(PacienteEspera.estado == '3')))
+        filas = [(id, nombre, afiliacion, relevancia) for relevancia, id, nombre, afiliacion
+                 in indice.buscar(q, clinico, afiliaciones)[desplazamiento:desplazamiento + limite]]
+    return [
+        {"id": id, "nombre": nombre, "numero_afiliacion": afiliacion,
+         "relevancia": round(float(relevancia), 3)}
+        for id, nombre, afiliacion, relevancia in filas
+    ]
@@ -0,0 +1,191 @@
+"""
+Caché de respuestas ya serializadas (historial clínico por paciente).
+
+Nivel 1: LRU con TTL dentro de cada proceso.
+Nivel 2 (opcional, REDIS_URL): Redis o cualquier servidor compatible, compartido
+entre workers. Las invalidaciones se publican por Redis para que los demás
+workers también borren su copia local.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CANAL_INVALIDACION = 'cache:invalidar'
+
+
+class CacheLRU:
+
+    def __init__(self, maximo=512, ttl=300):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._generaciones = {}
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or entrada[0] < time.monotonic():
+                if entrada is not None:
+                    del self._datos[clave]
+                    self.expulsiones += 1
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def generacion(self, clave):
+        with self._lock:
+            return self._generaciones.get(clave, 0)
+
+    def guardar(self, clave, valor, generacion=None):
+        """Guarda el valor, salvo que la clave se haya invalidado desde `generacion`."""
+        with self._lock:
+            if generacion is not None and self._generaciones.get(clave, 0) != generacion:
+                return
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+                self.expulsiones += 1
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._generaciones[clave] = self._generaciones.get(clave, 0) + 1
+            if self._datos.pop(clave, None) is not None:
+                self.invalidaciones += 1
+
+    def estadisticas(self):
+        with self._lock:
+            return {"entradas": len(self._datos), "aciertos": self.aciertos, "fallos": self.fallos,
+                    "expulsiones": self.expulsiones, "invalidaciones": self.invalidaciones}
+
+
+class CacheRedis:
+
+    def __init__(self, url, ttl=300, prefijo='cddia:'):
+        import redis
+
+        self.ttl = ttl
+        self.prefijo = prefijo
+        self._cliente = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.aciertos = 0
+        self.fallos = 0
+        self.errores = 0
+
+    def obtener(self, clave):
+        try:
+            valor = self._cliente.get(self.prefijo + clave)
+        except Exception:
+            # Si Redis no responde seguimos sin el nivel compartido
+            self.errores += 1
+            return None
+        if valor is None:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        return valor
+
+    def guardar(self, clave, valor):
+        try:
+            self._cliente.set(self.prefijo + clave, valor, ex=self.ttl)
+        except Exception:
+            self.errores += 1
+
+    def invalidar(self, clave):
+        try:
+            self._cliente.delete(self.prefijo + clave)
+            self._cliente.publish(self.prefijo + CANAL_INVALIDACION, clave)
+        except Exception:
+            self.errores += 1
+
+    def escuchar_invalidaciones(self, al_invalidar):
+        def bucle():
+            while True:
+                try:
+                    suscripcion = self._cliente.pubsub()
+                    suscripcion.subscribe(self.prefijo + CANAL_INVALIDACION)
+                    for mensaje in suscripcion.listen():
+                        if mensaje['type'] == 'message':
+                            al_invalidar(mensaje['data'].decode())
+                except Exception as e:
+                    print(f"Suscripción de invalidaciones perdida ({e}), reintentando...")
+                    time.sleep(3)
+
+        threading.Thread(target=bucle, daemon=True).start()
+
+    def estadisticas(self):
+        return {"aciertos": self.aciertos, "fallos": self.fallos, "errores": self.errores}
+
+
+class CacheRespuestas:
+    """
+    Guarda el cuerpo de la respuesta por clave en los dos niveles; regresa (cuerpo, etag).
+    El etag es el que da la ruta (p. ej. de condicional.etag) o, si no da ninguno, el
+    SHA-1 del cuerpo. En Redis se guarda como "etag\n" antes del cuerpo.
+    """
+
+    def __init__(self, local, compartido=None):
+        self.local = local
+        self.compartido = compartido
+        if compartido is not None:
+            compartido.escuchar_invalidaciones(local.invalidar)
+
+    def obtener(self, clave):
+        entrada = self.local.obtener(clave)
+        if entrada is None and self.compartido is not None:
+            guardado = self.compartido.obtener(clave)
+            if guardado is not None:
+                etiqueta, _, cuerpo = guardado.partition(b'\n')
+                entrada = (cuerpo, etiqueta.decode())
+                self.local.guardar(clave, entrada)
+        return entrada
+
+    def generacion(self, clave):
+        return self.local.generacion(clave)
+
+    def guardar(self, clave, cuerpo, generacion=None, etiqueta=None):
+        entrada = (cuerpo, etiqueta or etag(cuerpo))
+        self.local.guardar(clave, entrada, generacion)
+        if self.compartido is not None and generacion in (None, self.local.generacion(clave)):
+            self.compartido.guardar(clave, entrada[1].encode() + b'\n' + cuerpo)
+        return entrada
+
+    def invalidar(self, clave):
+        self.local.invalidar(clave)
+        if self.compartido is not None:
+            self.compartido.invalidar(clave)
+
+    def estadisticas(self):
+        resultado = {"local": self.local.estadisticas()}
+        if self.compartido is not None:
+            resultado["compartido"] = self.compartido.estadisticas()
+        return resultado
+
+
+def etag(cuerpo):
+    return hashlib.sha1(cuerpo).hexdigest()
+
+
+def clave_consultas(paciente_id):
+    return f"consultas:paciente:{paciente_id}"
+
+
+respuestas = CacheRespuestas(CacheLRU())
+
+
+def configurar():
+    global respuestas
+    local = CacheLRU(maximo=int(os.environ.get('CACHE_MAXIMO', 512)),
+                     ttl=int(os.environ.get('CACHE_TTL', 300)))
+    compartido = None
+    if os.environ.get('REDIS_URL'):
+        compartido = CacheRedis(os.environ['REDIS_URL'], ttl=int(os.environ.get('CACHE_TTL', 300)))
+    respuestas = CacheRespuestas(local, compartido)
@@ -0,0 +1,310 @@
+"""
+Cola de espera en memoria con escritura inmediata a la tabla lista_espera.
+
+Los pacientes activos (estado 1 y 2) viven en memoria agrupados por área y
+ordenados por hora de llegada, con búsqueda directa por id y por número de
+afiliación. Cada cambio de estado se valida en memoria, se escribe en la base
+con un UPDATE condicionado al estado anterior y solo entonces se aplica en
+memoria, así ambas copias nunca se separan.
+
+La copia en memoria solo se usa si otro canal la mantiene al día con los
+cambios de los demás workers (ESPERA_BROKER=postgres, ver app/eventos.py).
+Sin él, cada worker tendría su propia versión de la lista, así que las
+lecturas van a la tabla y las transiciones se validan contra lo que hay en
+la base.
+"""
+import bisect
+import hashlib
+import heapq
+import threading
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, PacienteEspera
+
+ESTADOS_ACTIVOS = ('1', '2')
+tabla = PacienteEspera.__table__
+
+
+class TransicionInvalida(Exception):
+    def __init__(self, entrada):
+        super().__init__(f"El paciente {entrada.id} está en estado {entrada.estado}")
+        self.entrada = entrada
+
+
+class Entrada:
+    __slots__ = ('id', 'nombre', 'numero_afiliacion', 'creado', 'area', 'estado', 'ingreso', 'cambio')
+
+    def __init__(self, id, nombre, numero_afiliacion, creado, area, estado, ingreso=None):
+        self.id = id
+        self.nombre = nombre
+        self.numero_afiliacion = numero_afiliacion
+        self.creado = creado
+        self.area = area
+        self.estado = estado
+        # Registros anteriores a la columna `ingreso` usan la fecha de creación
+        self.ingreso = ingreso or creado
+        # Hora de la transición que produjo esta entrada, tomada dentro de su transacción:
+        # el siguiente cambio del mismo registro espera al commit, así que siempre es posterior
+        self.cambio = None
+
+    @property
+    def orden(self):
+        return (self.creado, self.id)
+
+
+class ColaEspera:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._por_id = {}
+        self._por_afiliacion = {}
+        self._por_area = {}
+        # XOR de un hash por paciente activo: cambia con cualquier alta, baja o cambio
+        # y es igual en todos los workers con la misma cola (ETag de la lista)
+        self._huella = 0
+        # False: sin memoria, todas las lecturas van a la tabla (ver docstring del módulo)
+        self.en_memoria = False
+        # Funciones f(conn, estado_anterior, entrada) que se ejecutan dentro de la
+        # misma transacción de cada cambio (p. ej. estadísticas)
+        self.suscriptores = []
+        # Funciones f(estado_anterior, entrada) que se ejecutan después del commit
+        # (p. ej. encolar el evento en la bitácora sin alargar la transacción)
+        self.confirmados = []
+
+    # --- carga y consulta ---
+
+    def cargar(self, en_memoria=None):
+        """Reconstruye la cola desde la tabla (al arrancar la aplicación)."""
+        if en_memoria is not None:
+            self.en_memoria = en_memoria
+        entradas = self._leer_activos() if self.en_memoria else []
+        with self._lock:
+            self._por_id.clear()
+            self._por_afiliacion.clear()
+            self._por_area.clear()
+            self._huella = 0
+            for entrada in entradas:
+                self._agregar(entrada)
+
+    def activos(self):
+        """Pacientes en estado 1 y 2 de todas las áreas, por hora de llegada."""
+        if not self.en_memoria:
+            return self._leer_activos()
+        with self._lock:
+            grupos = [list(ids) for ids in self._por_area.values()]
+            por_id = dict(self._por_id)
+        return [por_id[orden[1]] for orden in heapq.merge(*grupos)]
+
+    def huella(self):
+        if not self.en_memoria:
+            return self.foto()[1]
+        with self._lock:
+            return f"{self._huella:016x}-{len(self._por_id)}"
+
+    def foto(self):
+        """(activos, huella) de un mismo momento, para responder la lista con su ETag."""
+        if not self.en_memoria:
+            entradas = self._leer_activos()
+            huella = 0
+            for entrada in entradas:
+                huella ^= _hash_entrada(entrada)
+            return entradas, f"{huella:016x}-{len(entradas)}"
+        with self._lock:
+            return self.activos(), self.huella()
+
+    def total_en_espera(self):
+        if not self.en_memoria:
+            return sum(1 for e in self._leer_activos() if e.estado == '1')
+        with self._lock:
+            return sum(1 for e in self._por_id.values() if e.estado == '1')
+
+    def diferencias(self):
+        """Compara la memoria contra la tabla; una lista vacía significa que coinciden."""
+        if not self.en_memoria:
+            return []
+        with db.engine.connect() as conn:
+            filas = conn.execute(
+                select(tabla.c.id, tabla.c.estado, tabla.c.area)
+                .where(tabla.c.estado.in_(ESTADOS_ACTIVOS))
+            ).all()
+        en_base = {f.id: (f.estado, f.area) for f in filas}
+        with self._lock:
+            en_memoria = {e.id: (e.estado, e.area) for e in self._por_id.values()}
+        return [
+            {"id": id, "base": en_base.get(id), "memoria": en_memoria.get(id)}
+            for id in sorted(set(en_base) | set(en_memoria))
+            if en_base.get(id) != en_memoria.get(id)
+        ]
+
+    # --- transiciones ---
+
+    def ingresar(self, numero_afiliacion, nombre=None, area=None):
+        """Agrega un paciente a la espera o reactiva su registro. Regresa (entrada, es_nuevo)."""
+        with self._lock:
+            for _ in range(2):
+                try:
+                    with db.engine.begin() as conn:
+                        existente = self._leer(conn, numero_afiliacion=numero_afiliacion)
+                        if existente:
+                            anterior = existente.estado
+                            # Solo un paciente que ya había salido cuenta como nueva llegada
+                            ingreso = existente.ingreso if anterior in ESTADOS_ACTIVOS else datetime.now()
+                            nueva = Entrada(existente.id, nombre or existente.nombre, numero_afiliacion,
+                                            existente.creado, area or existente.area, '1', ingreso)
+                            conn.execute(update(tabla).where(tabla.c.id == nueva.id)
+                                         .values(estado='1', nombre=nueva.nombre, area=nueva.area, ingreso=ingreso))
+                        else:
+                            if not nombre or not area:
+                                raise ValueError("Los campos 'nombre' y 'area' son obligatorios")
+                            anterior = None
+                            creado = datetime.now()
+                            resultado = conn.execute(insert(tabla).values(
+                                nombre=nombre, numero_afiliacion=numero_afiliacion,
+                                creado=creado, area=area, estado='1', ingreso=creado))
+                            nueva = Entrada(resultado.inserted_primary_key[0], nombre,
+                                            numero_afiliacion, creado, area, '1', creado)
+                        nueva.cambio = datetime.now()
+                        self._notificar(conn, anterior, nueva)
+                except IntegrityError:
+                    # Otro proceso insertó el mismo número de afiliación: se reintenta como reingreso
+                    continue
+                self._reemplazar(nueva)
+                self._confirmar(anterior, nueva)
+                return nueva, anterior is None
+            raise RuntimeError(f"No se pudo ingresar al paciente {numero_afiliacion}")
+
+    def cambiar_estado(self, hacia, desde, id=None, numero_afiliacion=None):
+        """
+        Cambia el estado de un paciente buscado por id o número de afiliación.
+        Regresa None si no existe y lanza TransicionInvalida si su estado no está en `desde`.
+        """
+        with self._lock:
+            for _ in range(2):
+                entrada = self._buscar(id, numero_afiliacion)
+                with db.engine.begin() as conn:
+                    if entrada is None:
+                        # Puede ser un registro inactivo o creado por otro worker
+                        entrada = self._leer(conn, id=id, numero_afiliacion=numero_afiliacion)
+                        if entrada is None:
+                            return None
+                    if entrada.estado not in desde:
+                        raise TransicionInvalida(entrada)
+                    resultado = conn.execute(
+                        update(tabla)
+                        .where(tabla.c.id == entrada.id, tabla.c.estado == entrada.estado)
+                        .values(estado=hacia)
+                    )
+                    if resultado.rowcount == 1:
+                        nueva = Entrada(entrada.id, entrada.nombre, entrada.numero_afiliacion,
+                                        entrada.creado, entrada.area, hacia, entrada.ingreso)
+                        nueva.cambio = datetime.now()
+                        self._notificar(conn, entrada.estado, nueva)
+                    else:
+                        nueva = None
+                if nueva is not None:
+                    self._reemplazar(nueva)
+                    self._confirmar(entrada.estado, nueva)
+                    return nueva
+                # Otro worker cambió el registro: refrescamos desde la base y validamos de nuevo
+                self.refrescar(entrada.id)
+            raise RuntimeError(f"No se pudo cambiar el estado del paciente {entrada.id}")
+
+    def refrescar(self, id):
+        """Vuelve a leer un registro de la tabla (p. ej. al enterarnos de un cambio de otro worker)."""
+        with db.engine.connect() as conn:
+            entrada = self._leer(conn, id=id)
+        with self._lock:
+            if entrada is None:
+                self._quitar(id)
+            else:
+                self._reemplazar(entrada)
+
+    # --- auxiliares (se llaman con el lock tomado) ---
+
+    def _leer_activos(self):
+        with db.engine.connect() as conn:
+            filas = conn.execute(
+                select(tabla.c.id, tabla.c.nombre, tabla.c.numero_afiliacion,
+                       tabla.c.creado, tabla.c.area, tabla.c.estado, tabla.c.ingreso)
+                .where(tabla.c.estado.in_(ESTADOS_ACTIVOS))
+                .order_by(tabla.c.creado, tabla.c.id)
+            ).all()
+        return [Entrada(*fila) for fila in filas]
+
+    def _leer(self, conn, id=None, numero_afiliacion=None):
+        consulta = select(tabla.c.id, tabla.c.nombre, tabla.c.numero_afiliacion,
+                          tabla.c.creado, tabla.c.area, tabla.c.estado, tabla.c.ingreso)
+        if id is not None:
+            consulta = consulta.where(tabla.c.id == id)
+        else:
+            consulta = consulta.where(tabla.c.numero_afiliacion == numero_afiliacion)
+        fila = conn.execute(consulta).first()
+        return Entrada(*fila) if fila else None
+
+    def _buscar(self, id, numero_afiliacion):
+        if id is not None:
+            return self._por_id.get(id)
+        return self._por_id.get(self._por_afiliacion.get(numero_afiliacion))
+
+    def _notificar(self, conn, anterior, entrada):
+        for suscriptor in self.suscriptores:
+            suscriptor(conn, anterior, entrada)
+
+    def _confirmar(self, anterior, entrada):
+        for funcion in self.confirmados:
+            funcion(anterior, entrada)
+
+    def _reemplazar(self, entrada):
+        if not self.en_memoria:
+            return
+        self._quitar(entrada.id)
+        if entrada.estado in ESTADOS_ACTIVOS:
+            self._agregar(entrada)
+
+    def _agregar(self, entrada):
+        self._huella ^= _hash_entrada(entrada)
+        self._por_id[entrada.id] = entrada
+        self._por_afiliacion[entrada.numero_afiliacion] = entrada.id
+        bisect.insort(self._por_area.setdefault(entrada.area, []), entrada.orden)
+
+    def _quitar(self, id):
+        entrada = self._por_id.pop(id, None)
+        if entrada is None:
+            return
+        self._huella ^= _hash_entrada(entrada)
+        if self._por_afiliacion.get(entrada.numero_afiliacion) == id:
+            del self._por_afiliacion[entrada.numero_afiliacion]
+        grupo = self._por_area[entrada.area]
+        del grupo[bisect.bisect_left(grupo, entrada.orden)]
+        if not grupo:
+            del self._por_area[entrada.area]
+
+
+def _hash_entrada(entrada):
+    datos = repr((entrada.id, entrada.nombre, entrada.numero_afiliacion, entrada.creado, entrada.area, entrada.estado))
+    return int.from_bytes(hashlib.blake2b(datos.encode(), digest_size=8).digest(), 'big')
+
+
+cola = ColaEspera()
+
+
+def escuchar_otros_workers(app, broker):
+    """Con varios workers, refresca los pacientes que cambiaron en otros procesos."""
+    suscripcion = broker.suscribir()
+
+    def bucle():
+        while True:
+            evento = suscripcion.get()
+            try:
+                with app.app_context():
+                    if evento["tipo"] == "resync":
+                        cola.cargar()
+                    else:
+                        cola.refrescar(evento["paciente"]["id"])
+            except Exception as e:
+                print(f"No se pudo sincronizar la cola de espera: {e}")
+
+    threading.Thread(target=bucle, daemon=True).start()
@@ -0,0 +1,102 @@
+"""
+Compresión de respuestas negociada con Accept-Encoding (brotli o gzip).
+
+- Respuestas normales: se comprimen si pasan de COMPRESION_UMBRAL bytes.
+- Respuestas en streaming (NDJSON): se comprimen por partes conforme se generan.
+- Server-Sent Events y tipos ya comprimidos no se tocan.
+
+brotli es opcional: si no está instalado solo se ofrece gzip. El ETag de una
+respuesta comprimida lleva el sufijo de la codificación ("...-gzip") para que
+sea distinto al de la versión sin comprimir; condicional.coincide lo reconoce
+en If-None-Match.
+"""
+import gzip
+import os
+import zlib
+
+from flask import request
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TIPOS = frozenset(('application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html'))
+
+activa = True
+umbral = 1024
+nivel_gzip = 6
+calidad_brotli = 4  # calidades altas de brotli son demasiado lentas para respuestas dinámicas
+
+
+def elegir(accept_encoding):
+    """'br', 'gzip' o None según el encabezado Accept-Encoding del cliente."""
+    if not accept_encoding:
+        return None
+    aceptadas = parse_accept_header(accept_encoding)
+    opciones = [c for c in (('br',) if brotli else ()) + ('gzip',) if aceptadas.quality(c) > 0]
+    if not opciones:
+        return None
+    # Con la misma calidad se prefiere brotli (comprime más a velocidad parecida)
+    return max(opciones, key=lambda c: aceptadas.quality(c))
+
+
+def comprimir(datos, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=calidad_brotli)
+    return gzip.compress(datos, compresslevel=nivel_gzip, mtime=0)
+
+
+def comprimir_flujo(partes, codificacion):
+    """Comprime un iterable de bytes/str; solo emite cuando el compresor tiene datos listos."""
+    if codificacion == 'br':
+        compresor = brotli.Compressor(quality=calidad_brotli)
+        agregar, terminar = compresor.process, compresor.finish
+    else:
+        compresor = zlib.compressobj(nivel_gzip, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        agregar, terminar = compresor.compress, compresor.flush
+    try:
+        for parte in partes:
+            salida = agregar(parte.encode() if isinstance(parte, str) else parte)
+            if salida:
+                yield salida
+        yield terminar()
+    finally:
+        if hasattr(partes, 'close'):
+            partes.close()
+
+
+def comprimible(mimetype, encabezados):
+    return mimetype in TIPOS and 'Content-Encoding' not in encabezados
+
+
+def _despues_de_peticion(respuesta):
+    if not comprimible(respuesta.mimetype, respuesta.headers) or respuesta.status_code in (204, 206, 304):
+        return respuesta
+    respuesta.vary.add('Accept-Encoding')
+    codificacion = elegir(request.headers.get('Accept-Encoding'))
+    if codificacion is None:
+        return respuesta
+
+    if respuesta.is_streamed:
+        respuesta.response = comprimir_flujo(respuesta.response, codificacion)
+        respuesta.headers.pop('Content-Length', None)
+    else:
+        datos = respuesta.get_data()
+        if len(datos) < umbral:
+            return respuesta
+        respuesta.set_data(comprimir(datos, codificacion))
+    respuesta.headers['Content-Encoding'] = codificacion
+    etiqueta, debil = respuesta.get_etag()
+    if etiqueta and not debil:
+        respuesta.set_etag(f"{etiqueta}-{codificacion}")
+    return respuesta
+
+
+def configurar(app):
+    global activa, umbral
+    umbral = int(os.environ.get('COMPRESION_UMBRAL', umbral))
+    activa = os.environ.get('COMPRESION', '1') == '1'
+    if activa:
+        app.after_request(_despues_de_peticion)
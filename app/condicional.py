@@ -0,0 +1,206 @@
+"""
+ETags fuertes que se calculan sin ejecutar la consulta de la respuesta.
+
+Triggers en pacientes y consultas incrementan contadores en versiones_tabla:
+
+    pacientes                cualquier alta, cambio o baja de pacientes
+    pacientes:ediciones      cambios de nombre, afiliación, enfermedades o alergias
+                             y bajas de pacientes (índices en memoria de cada worker)
+    consultas:<paciente_id>  cambios en las consultas del paciente o en su nombre
+    epoca                    valor fijo de la base (se crea en la migración)
+
+El ETag de /lista_pacientes o de un historial es la época más el contador,
+así que un GET con If-None-Match cuesta una lectura por llave primaria y
+puede responder 304 sin leer las tablas. La época evita que un contador
+reiniciado (base restaurada o nueva) repita un ETag que un cliente ya tiene.
+
+Solo PostgreSQL y SQLite tienen los triggers; con otros motores `etag`
+regresa None y las rutas responden como antes.
+"""
+import time
+
+from flask import Response, request
+from sqlalchemy import select
+
+from .models import db, VersionTabla
+
+CLAVE_EPOCA = 'epoca'
+CLAVE_EDICIONES = 'pacientes:ediciones'
+CODIFICACIONES = ('gzip', 'br')
+DIALECTOS = ('postgresql', 'sqlite')
+
+
+def clave_historial(paciente_id):
+    return f"consultas:{paciente_id}"
+
+
+def disponible():
+    return db.engine.dialect.name in DIALECTOS
+
+
+def consulta_versiones(claves):
+    return select(VersionTabla.clave, VersionTabla.version)\
+        .where(VersionTabla.clave.in_((CLAVE_EPOCA, *claves)))
+
+
+def formar_etag(filas, claves, variante=None):
+    versiones = dict(filas)
+    if CLAVE_EPOCA not in versiones:
+        return None  # base sin la migración de versiones
+    etiqueta = '.'.join([f"{versiones[CLAVE_EPOCA]:x}", *(str(versiones.get(c, 0)) for c in claves)])
+    return f"{etiqueta}-{variante}" if variante else etiqueta
+
+
+def leer(conn, *claves):
+    """(época, *contadores) leídos con `conn`, o None si el motor no tiene los triggers."""
+    if conn.dialect.name not in DIALECTOS:
+        return None
+    versiones = dict(conn.execute(consulta_versiones(claves)).all())
+    return tuple(versiones.get(c, 0) for c in (CLAVE_EPOCA, *claves))
+
+
+def etag(*claves, variante=None):
+    """ETag de una respuesta que depende de los contadores `claves`, o None si no se puede calcular."""
+    if not disponible():
+        return None
+    return formar_etag(db.session.execute(consulta_versiones(claves)).all(), claves, variante)
+
+
+def coincide(etiqueta, if_none_match):
+    """
+    Etiqueta del If-None-Match que corresponde a `etiqueta` (tal como la tiene el
+    cliente, con el sufijo de compresión si lo lleva) o None.
+    `if_none_match`: objeto ETags de werkzeug.
+    """
+    if etiqueta is None or not if_none_match:
+        return None
+    if if_none_match.star_tag:
+        return etiqueta
+    for candidata in (etiqueta, *(f"{etiqueta}-{c}" for c in CODIFICACIONES)):
+        if if_none_match.contains(candidata):
+            return candidata
+    return None
+
+
+def no_modificado(etiqueta):
+    """304 para la petición actual si el cliente ya tiene `etiqueta`; si no, None."""
+    enviada = coincide(etiqueta, request.if_none_match)
+    if enviada is None:
+        return None
+    respuesta = Response(status=304)
+    respuesta.set_etag(enviada)
+    return respuesta
+
+
+# --- triggers (migración 7) ---
+
+def _sube_sqlite(clave, condicion='1'):
+    return (f"INSERT INTO versiones_tabla (clave, version) SELECT {clave}, 1 WHERE {condicion} "
+            "ON CONFLICT (clave) DO UPDATE SET version = version + 1;")
+
+
+def _sql_sqlite():
+    # SQLite solo tiene triggers por fila
+    sube = _sube_sqlite
+    pacientes = sube("'pacientes'")
+    sentencias = []
+    for nombre, evento, cuerpo in (
+        ('pacientes_ins', 'INSERT ON pacientes', pacientes),
+        ('pacientes_upd', 'UPDATE ON pacientes', pacientes),
+        ('pacientes_del', 'DELETE ON pacientes', pacientes + sube("'consultas:' || OLD.id")),
+        # El historial incluye el nombre del paciente
+        ('historial_nombre', 'UPDATE OF nombre ON pacientes', sube("'consultas:' || OLD.id")),
+        ('consultas_ins', 'INSERT ON consultas', sube("'consultas:' || NEW.paciente_id")),
+        ('consultas_upd', 'UPDATE ON consultas', sube("'consultas:' || NEW.paciente_id") +
+         sube("'consultas:' || OLD.paciente_id", 'OLD.paciente_id <> NEW.paciente_id')),
+        ('consultas_del', 'DELETE ON consultas', sube("'consultas:' || OLD.paciente_id")),
+    ):
+        sentencias.append(f"CREATE TRIGGER IF NOT EXISTS tr_version_{nombre} AFTER {evento} "
+                          f"FOR EACH ROW BEGIN {cuerpo} END")
+    return sentencias
+
+
+SQL_TRIGGERS_POSTGRES = [
+    """CREATE OR REPLACE FUNCTION versiones_subir(clave_version text) RETURNS void AS $$
+       INSERT INTO versiones_tabla (clave, version) VALUES (clave_version, 1)
+       ON CONFLICT (clave) DO UPDATE SET version = versiones_tabla.version + 1
+       $$ LANGUAGE sql""",
+    # Un incremento por sentencia: las importaciones masivas no pagan uno por fila
+    """CREATE OR REPLACE FUNCTION versiones_pacientes() RETURNS trigger AS $$
+       BEGIN PERFORM versiones_subir('pacientes'); RETURN NULL; END
+       $$ LANGUAGE plpgsql""",
+    """CREATE OR REPLACE FUNCTION versiones_historial_paciente() RETURNS trigger AS $$
+       BEGIN PERFORM versiones_subir('consultas:' || OLD.id); RETURN NULL; END
+       $$ LANGUAGE plpgsql""",
+    """CREATE OR REPLACE FUNCTION versiones_historial_consultas() RETURNS trigger AS $$
+       BEGIN
+         IF TG_OP <> 'DELETE' THEN
+           PERFORM versiones_subir('consultas:' || NEW.paciente_id);
+         END IF;
+         IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.paciente_id <> NEW.paciente_id) THEN
+           PERFORM versiones_subir('consultas:' || OLD.paciente_id);
+         END IF;
+         RETURN NULL;
+       END
+       $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS tr_version_pacientes ON pacientes",
+    """CREATE TRIGGER tr_version_pacientes AFTER INSERT OR UPDATE OR DELETE ON pacientes
+       FOR EACH STATEMENT EXECUTE FUNCTION versiones_pacientes()""",
+    "DROP TRIGGER IF EXISTS tr_version_historial_paciente ON pacientes",
+    # El historial incluye el nombre del paciente
+    """CREATE TRIGGER tr_version_historial_paciente AFTER UPDATE OF nombre OR DELETE ON pacientes
+       FOR EACH ROW EXECUTE FUNCTION versiones_historial_paciente()""",
+    "DROP TRIGGER IF EXISTS tr_version_consultas ON consultas",
+    """CREATE TRIGGER tr_version_consultas AFTER INSERT OR UPDATE OR DELETE ON consultas
+       FOR EACH ROW EXECUTE FUNCTION versiones_historial_consultas()""",
+]
+
+
+def preparar(conn):
+    """Crea versiones_tabla, la época y los triggers (idempotente)."""
+    VersionTabla.__table__.create(conn, checkfirst=True)
+    if conn.dialect.name == 'postgresql':
+        sentencias = SQL_TRIGGERS_POSTGRES
+    elif conn.dialect.name == 'sqlite':
+        sentencias = _sql_sqlite()
+    else:
+        return
+    for sentencia in sentencias:
+        conn.exec_driver_sql(sentencia)
+    if conn.execute(select(VersionTabla.version).where(VersionTabla.clave == CLAVE_EPOCA)).first() is None:
+        conn.execute(VersionTabla.__table__.insert().values(clave=CLAVE_EPOCA, version=int(time.time())))
+
+
+# --- ediciones de pacientes (migración 9) ---
+# Las altas las recogen los índices en memoria con su marca de agua; un cambio en
+# las columnas que indexan (o una baja) los obliga a rehacerse
+
+SQL_EDICIONES_SQLITE = [
+    "CREATE TRIGGER IF NOT EXISTS tr_version_pacientes_ediciones AFTER UPDATE OF "
+    "nombre, numero_afiliacion, enfermedades, alergias ON pacientes FOR EACH ROW BEGIN "
+    f"{_sube_sqlite(repr(CLAVE_EDICIONES))} END",
+    "CREATE TRIGGER IF NOT EXISTS tr_version_pacientes_bajas AFTER DELETE ON pacientes FOR EACH ROW BEGIN "
+    f"{_sube_sqlite(repr(CLAVE_EDICIONES))} END",
+]
+
+SQL_EDICIONES_POSTGRES = [
+    f"""CREATE OR REPLACE FUNCTION versiones_ediciones_pacientes() RETURNS trigger AS $$
+       BEGIN PERFORM versiones_subir('{CLAVE_EDICIONES}'); RETURN NULL; END
+       $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS tr_version_pacientes_ediciones ON pacientes",
+    """CREATE TRIGGER tr_version_pacientes_ediciones
+       AFTER UPDATE OF nombre, numero_afiliacion, enfermedades, alergias OR DELETE ON pacientes
+       FOR EACH STATEMENT EXECUTE FUNCTION versiones_ediciones_pacientes()""",
+]
+
+
+def preparar_ediciones(conn):
+    """Trigger del contador de ediciones de pacientes (idempotente)."""
+    if conn.dialect.name == 'postgresql':
+        sentencias = SQL_EDICIONES_POSTGRES
+    elif conn.dialect.name == 'sqlite':
+        sentencias = SQL_EDICIONES_SQLITE
+    else:
+        return
+    for sentencia in sentencias:
+        conn.exec_driver_sql(sentencia)
@@ -0,0 +1,166 @@
+"""
+Estadísticas de carga de la clínica a partir de tablas pre-agregadas.
+
+- estadistica_espera_hora: llegadas, atendidos, abandonos y espera acumulada
+  por área y hora. Se actualiza desde las transiciones de la cola de espera.
+- estadistica_consultas_dia: consultas por día y diagnóstico. Se actualiza al
+  crear, editar o eliminar una consulta.
+
+Cada incremento es un UPSERT dentro de la misma transacción del cambio, así
+que los contadores nunca se separan de las tablas de origen. Las rutas
+/estadisticas/... solo leen estas tablas: su costo depende del rango pedido y
+no del tamaño del historial.
+"""
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import func, select, update
+
+from .models import db, EsperaPorHora, ConsultasPorDia, Consulta
+from .cola_espera import cola
+
+LARGO_DIAGNOSTICO = ConsultasPorDia.diagnostico.type.length
+LOTE_CARGA = 10000
+
+
+def _hora(momento):
+    return momento.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def normalizar_diagnostico(diagnostico):
+    """Agrupa sin distinguir mayúsculas ni espacios extra; sin diagnóstico queda como ''."""
+    return ' '.join((diagnostico or '').lower().split())[:LARGO_DIAGNOSTICO]
+
+
+def _sumar(conn, modelo, claves, incrementos):
+    """UPSERT de contadores: inserta la fila o le suma los incrementos. conn puede ser la sesión."""
+    tabla = modelo.__table__
+    dialecto = db.engine.dialect.name
+    if dialecto in ('postgresql', 'sqlite'):
+        if dialecto == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as insert_dialecto
+        else:
+            from sqlalchemy.dialects.sqlite import insert as insert_dialecto
+        sentencia = insert_dialecto(tabla).values(**claves, **incrementos)
+        conn.execute(sentencia.on_conflict_do_update(
+            index_elements=list(claves),
+            set_={c: tabla.c[c] + sentencia.excluded[c] for c in incrementos},
+        ))
+        return
+    resultado = conn.execute(
+        update(tabla).where(*(tabla.c[c] == v for c, v in claves.items()))
+        .values({c: tabla.c[c] + v for c, v in incrementos.items()})
+    )
+    if resultado.rowcount == 0:
+        conn.execute(tabla.insert().values(**claves, **incrementos))
+
+
+# --- actualización incremental ---
+
+def registrar_transicion(conn, anterior, entrada):
+    """Suscriptor de la cola de espera: f(conn, estado_anterior, entrada)."""
+    ahora = datetime.now()
+    area = entrada.area or ''
+    if entrada.estado == '1' and anterior in (None, '3'):
+        _sumar(conn, EsperaPorHora, {'hora': _hora(entrada.ingreso), 'area': area}, {'llegadas': 1})
+    elif entrada.estado == '2' and anterior == '1':
+        espera = max((ahora - entrada.ingreso).total_seconds(), 0)
+        _sumar(conn, EsperaPorHora, {'hora': _hora(ahora), 'area': area},
+               {'atendidos': 1, 'espera_segundos': espera})
+    elif entrada.estado == '3' and anterior == '1':
+        _sumar(conn, EsperaPorHora, {'hora': _hora(ahora), 'area': area}, {'abandonos': 1})
+
+
+def registrar_consulta(conn, fecha_consulta, diagnostico, cambio=1):
+    """cambio=1 al crear, -1 al eliminar; al editar se resta la versión anterior y se suma la nueva."""
+    _sumar(conn, ConsultasPorDia,
+           {'dia': fecha_consulta.date(), 'diagnostico': normalizar_diagnostico(diagnostico)},
+           {'consultas': cambio})
+
+
+def reconstruir_consultas(conn):
+    """Recalcula estadistica_consultas_dia desde cero (migración inicial)."""
+    conteos = defaultdict(int)
+    consulta = select(Consulta.fecha_consulta, Consulta.diagnostico)
+    for fecha_consulta, diagnostico in conn.execution_options(yield_per=LOTE_CARGA).execute(consulta):
+        conteos[(fecha_consulta.date(), normalizar_diagnostico(diagnostico))] += 1
+    conn.execute(ConsultasPorDia.__table__.delete())
+    if conteos:
+        conn.execute(ConsultasPorDia.__table__.insert(), [
+            {'dia': dia, 'diagnostico': diagnostico, 'consultas': n}
+            for (dia, diagnostico), n in conteos.items()
+        ])
+
+
+# --- lectura ---
+
+def _rango(desde, hasta):
+    hasta = hasta or date.today()
+    desde = desde or hasta
+    if desde > hasta:
+        raise ValueError("'desde' debe ser anterior o igual a 'hasta'")
+    return desde, hasta
+
+
+def espera(desde=None, hasta=None, area=None):
+    """Filas por hora y área más el total por área, para el rango de días [desde, hasta]."""
+    desde, hasta = _rango(desde, hasta)
+    t = EsperaPorHora
+    consulta = select(t.hora, t.area, t.llegadas, t.atendidos, t.abandonos, t.espera_segundos)\
+        .where(t.hora >= datetime.combine(desde, time()),
+               t.hora < datetime.combine(hasta + timedelta(days=1), time()))\
+        .order_by(t.hora, t.area)
+    if area is not None:
+        consulta = consulta.where(t.area == area)
+
+    por_hora = []
+    totales = defaultdict(lambda: {'llegadas': 0, 'atendidos': 0, 'abandonos': 0, 'espera_segundos': 0.0})
+    for hora, area_fila, llegadas, atendidos, abandonos, espera_segundos in db.session.execute(consulta):
+        por_hora.append({
+            'hora': hora.isoformat(), 'area': area_fila, 'llegadas': llegadas,
+            'atendidos': atendidos, 'abandonos': abandonos,
+            'espera_promedio_min': _promedio_minutos(espera_segundos, atendidos),
+        })
+        total = totales[area_fila]
+        total['llegadas'] += llegadas
+        total['atendidos'] += atendidos
+        total['abandonos'] += abandonos
+        total['espera_segundos'] += espera_segundos
+
+    return {
+        'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'por_hora': por_hora,
+        'por_area': [
+            {'area': a, 'llegadas': t['llegadas'], 'atendidos': t['atendidos'], 'abandonos': t['abandonos'],
+             'espera_promedio_min': _promedio_minutos(t['espera_segundos'], t['atendidos'])}
+            for a, t in sorted(totales.items())
+        ],
+    }
+
+
+def consultas(desde=None, hasta=None, limite=20):
+    """Consultas por día y los `limite` diagnósticos más frecuentes del rango [desde, hasta]."""
+    desde, hasta = _rango(desde, hasta)
+    t = ConsultasPorDia
+    en_rango = (t.dia >= desde, t.dia <= hasta)
+    por_dia = db.session.execute(
+        select(t.dia, func.sum(t.consultas)).where(*en_rango).group_by(t.dia).order_by(t.dia)
+    ).all()
+    total = func.sum(t.consultas).label('total')
+    por_diagnostico = db.session.execute(
+        select(t.diagnostico, total).where(*en_rango).group_by(t.diagnostico)
+        .having(total > 0).order_by(total.desc(), t.diagnostico).limit(limite)
+    ).all()
+    return {
+        'desde': desde.isoformat(), 'hasta': hasta.isoformat(),
+        'por_dia': [{'dia': dia.isoformat(), 'consultas': int(n)} for dia, n in por_dia if n],
+        'por_diagnostico': [{'diagnostico': d or None, 'consultas': int(n)} for d, n in por_diagnostico],
+    }
+
+
+def _promedio_minutos(segundos, atendidos):
+    return round(segundos / atendidos / 60, 1) if atendidos else None
+
+
+def configurar():
+    if registrar_transicion not in cola.suscriptores:
+        cola.suscriptores.append(registrar_transicion)
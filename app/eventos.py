@@ -0,0 +1,114 @@
+"""
+Difusión de cambios de la lista de espera a las pantallas conectadas (SSE).
+
+Las rutas publican un evento cada vez que cambia PacienteEspera.estado y cada
+pantalla suscrita lo recibe por su propia cola. Con un solo proceso basta el
+BrokerLocal; con varios workers se usa BrokerPostgres, que reparte los eventos
+entre procesos con LISTEN/NOTIFY (ESPERA_BROKER=postgres).
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time
+
+from sqlalchemy import text
+
+CANAL_POSTGRES = 'lista_espera'
+TAMANO_COLA = 100
+
+
+def formato_sse(evento, datos):
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+class BrokerLocal:
+    """Reparte los eventos entre los suscriptores del proceso actual."""
+
+    def __init__(self):
+        self._suscriptores = set()
+        self._lock = threading.Lock()
+
+    def suscribir(self):
+        cola = queue.Queue(maxsize=TAMANO_COLA)
+        with self._lock:
+            self._suscriptores.add(cola)
+        return cola
+
+    def desuscribir(self, cola):
+        with self._lock:
+            self._suscriptores.discard(cola)
+
+    def publicar(self, evento):
+        self._repartir(evento)
+
+    def _repartir(self, evento):
+        with self._lock:
+            suscriptores = list(self._suscriptores)
+        for cola in suscriptores:
+            try:
+                cola.put_nowait(evento)
+            except queue.Full:
+                # Pantalla lenta: descartamos lo pendiente y le pedimos una foto nueva
+                with cola.mutex:
+                    cola.queue.clear()
+                cola.put_nowait({"tipo": "resync"})
+
+
+class BrokerPostgres(BrokerLocal):
+    """Publica con NOTIFY y escucha con LISTEN para enterarse de otros workers."""
+
+    def __init__(self, engine, url):
+        super().__init__()
+        self._engine = engine
+        self._url = url
+        self._hilo = threading.Thread(target=self._escuchar, daemon=True)
+        self._hilo.start()
+
+    def publicar(self, evento):
+        # El evento vuelve a este mismo proceso por LISTEN, no se reparte aquí
+        with self._engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:canal, :datos)"),
+                         {"canal": CANAL_POSTGRES, "datos": json.dumps(evento, ensure_ascii=False)})
+
+    def _escuchar(self):
+        import psycopg2
+
+        while True:
+            try:
+                conn = psycopg2.connect(self._url)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CANAL_POSTGRES};")
+                # Tras reconectar pudimos perder eventos: que las pantallas se resincronicen
+                self._repartir({"tipo": "resync"})
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        aviso = conn.notifies.pop(0)
+                        self._repartir(json.loads(aviso.payload))
+            except Exception as e:
+                print(f"Conexión LISTEN perdida ({e}), reintentando...")
+                time.sleep(3)
+
+
+broker = BrokerLocal()
+
+
+def configurar(app, db):
+    global broker
+    if os.environ.get('ESPERA_BROKER', 'local') == 'postgres' and db.engine.dialect.name != 'postgresql':
+        print(f"ESPERA_BROKER=postgres requiere PostgreSQL ({db.engine.dialect.name}); se usa el broker local")
+        broker = BrokerLocal()
+    elif os.environ.get('ESPERA_BROKER', 'local') == 'postgres':
+        url = db.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        broker = BrokerPostgres(db.engine, url)
+    else:
+        broker = BrokerLocal()
+
+
+def publicar_cambio(paciente_json):
+    broker.publicar({"tipo": "cambio", "paciente": paciente_json})
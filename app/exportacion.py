@@ -0,0 +1,393 @@
+"""
+Exportación masiva de consultas con los datos del paciente (Consulta ⋈ Paciente)
+a CSV, NDJSON o Parquet, filtrada por rango de fechas y/o área de la lista de espera.
+
+Las filas se leen por bloques con keyset sobre consultas.id (LOTE_EXPORTACION
+filas por bloque, cada uno con cursor del lado del servidor vía yield_per) y
+se escriben al archivo conforme llegan: el resultado nunca está completo en
+memoria y cada bloque es una transacción corta. Si hay réplicas de lectura
+los bloques se leen de ellas.
+
+Cada exportación tiene un id y sus archivos en EXPORTACION_DIR:
+
+    <id>.json                 estado y punto de control (último id, filas, bytes)
+    <id>.csv|ndjson|parquet   el resultado
+    <id>.lock                 tomado mientras corre (en cualquier proceso)
+
+El punto de control se guarda después de cada bloque, con el archivo ya en
+disco. Al reanudar el archivo se recorta a los bytes del último punto de
+control y se sigue desde el último id: una exportación interrumpida (reinicio,
+base caída) no repite ni pierde filas. Parquet escribe un archivo por bloque
+en <id>.partes/ y los junta al terminar.
+
+Corre en hilos del proceso (EXPORTACION_HILOS a la vez, 1 por omisión) para
+no ocupar a los workers; el progreso se lee del .json, así que cualquier
+worker lo responde. Si el worker termina a la mitad (recarga, max_requests)
+la exportación queda en_curso sin nadie que tenga su candado: cada worker, al
+arrancar, reanuda las que encuentra así (reanudar_huerfanas, llamada desde
+gunicorn.conf.py, run.py y el arranque ASGI) y el candado deja que solo un
+proceso tome cada una. También desde la terminal, sin el servidor:
+
+    flask exportar-consultas --desde 2024-01-01 --hasta 2024-06-30 --formato csv
+    flask exportar-consultas --reanudar <id>
+
+Parquet requiere pyarrow (opcional, no está en requirements.txt).
+"""
+import csv
+import fcntl
+import io
+import json
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import click
+from sqlalchemy import func, select
+
+from .models import db, Consulta, Paciente, PacienteEspera
+from . import replicas, serializacion
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+LOTE_EXPORTACION = 5000
+FILAS_POR_LECTURA = 1000
+FORMATOS = ('csv', 'ndjson', 'parquet')
+TIPOS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'parquet': 'application/vnd.apache.parquet'}
+ID_VALIDO = re.compile(r'^[0-9a-f]{16}$')
+
+SERIALIZADOR = serializacion.CONSULTA_EXPORTACION
+# Columnas de salida: los signos ya como texto, en el lugar de sus columnas numéricas
+COLUMNAS = tuple('presion' if n == 'presion_sistolica' else n for n in SERIALIZADOR.nombres
+                 if n not in ('presion_diastolica', 'signos_originales'))
+ENTERAS = frozenset(('id', 'paciente_id', 'version'))
+
+directorio = None
+_hilos = threading.BoundedSemaphore(1)
+
+
+class EnCurso(Exception):
+    """La exportación ya corre en este u otro proceso."""
+
+
+# --- consulta ---
+
+def condiciones(filtros):
+    resultado = []
+    if filtros.get('desde'):
+        resultado.append(Consulta.fecha_consulta >= datetime.combine(date.fromisoformat(filtros['desde']),
+                                                                     datetime.min.time()))
+    if filtros.get('hasta'):
+        resultado.append(Consulta.fecha_consulta < datetime.combine(
+            date.fromisoformat(filtros['hasta']) + timedelta(days=1), datetime.min.time()))
+    if filtros.get('area'):
+        resultado.append(PacienteEspera.area == filtros['area'])
+    return resultado
+
+
+def _unir(consulta):
+    # numero_afiliacion es único en lista_espera: a lo más un área por paciente
+    return consulta.join(Paciente, Consulta.paciente_id == Paciente.id)\
+        .outerjoin(PacienteEspera, PacienteEspera.numero_afiliacion == Paciente.numero_afiliacion)
+
+
+def contar(conn, filtros):
+    return conn.execute(_unir(select(func.count()).select_from(Consulta)).where(*condiciones(filtros))).scalar()
+
+
+def leer_bloque(engine, filtros, despues_de, lote):
+    """Siguientes `lote` filas con id mayor a `despues_de`, ya serializadas."""
+    consulta = _unir(select(*SERIALIZADOR.columnas)).where(Consulta.id > despues_de, *condiciones(filtros))\
+        .order_by(Consulta.id).limit(lote)
+    with engine.connect() as conn:
+        for fila in conn.execution_options(yield_per=FILAS_POR_LECTURA).execute(consulta):
+            yield SERIALIZADOR.fila(fila)
+
+
+def _engine_lectura():
+    replica = replicas.enrutador.elegir()
+    return replica.engine if replica is not None else db.engine
+
+
+# --- escritores ---
+
+class EscritorTexto:
+    """CSV o NDJSON en un solo archivo; `punto` es {"bytes": n} del último punto de control."""
+
+    def __init__(self, ruta, formato, punto):
+        self.formato = formato
+        self.archivo = open(ruta, 'r+b' if os.path.exists(ruta) else 'w+b')
+        self.archivo.truncate(punto.get('bytes', 0))
+        self.archivo.seek(0, os.SEEK_END)
+        if formato == 'csv' and self.archivo.tell() == 0:
+            # BOM: Excel abre bien los acentos
+            self.archivo.write('\ufeff'.encode())
+            self._csv([COLUMNAS])
+
+    def _csv(self, filas):
+        texto = io.StringIO()
+        csv.writer(texto).writerows(filas)
+        self.archivo.write(texto.getvalue().encode())
+
+    def escribir(self, filas):
+        if self.formato == 'csv':
+            self._csv([fila[c] for c in COLUMNAS] for fila in filas)
+        else:
+            self.archivo.writelines(_json(fila) + b'\n' for fila in filas)
+
+    def guardar(self):
+        self.archivo.flush()
+        os.fsync(self.archivo.fileno())
+        return {"bytes": self.archivo.tell()}
+
+    def terminar(self):
+        self.archivo.close()
+
+    def cerrar(self):
+        self.archivo.close()
+
+
+class EscritorParquet:
+    """Un archivo Parquet por bloque en <ruta>.partes/; `punto` es {"partes": n}."""
+
+    def __init__(self, ruta, formato, punto):
+        self.ruta = ruta
+        self.partes_dir = ruta + '.partes'
+        self.partes = punto.get('partes', 0)
+        self.esquema = pyarrow.schema([(c, pyarrow.int64() if c in ENTERAS else pyarrow.string()) for c in COLUMNAS])
+        os.makedirs(self.partes_dir, exist_ok=True)
+        # Partes escritas después del último punto de control
+        for nombre in os.listdir(self.partes_dir):
+            if not nombre.endswith('.parquet') or int(nombre.split('.')[0]) >= self.partes:
+                os.remove(os.path.join(self.partes_dir, nombre))
+
+    def _parte(self, numero):
+        return os.path.join(self.partes_dir, f"{numero:06d}.parquet")
+
+    def escribir(self, filas):
+        filas = [{c: fila[c] if c in ENTERAS or fila[c] is None else str(fila[c]) for c in COLUMNAS} for fila in filas]
+        if filas:
+            pyarrow.parquet.write_table(pyarrow.Table.from_pylist(filas, schema=self.esquema),
+                                        self._parte(self.partes))
+            self.partes += 1
+
+    def guardar(self):
+        return {"partes": self.partes}
+
+    def terminar(self):
+        with pyarrow.parquet.ParquetWriter(self.ruta, self.esquema) as escritor:
+            for numero in range(self.partes):
+                escritor.write_table(pyarrow.parquet.read_table(self._parte(numero)))
+        shutil.rmtree(self.partes_dir)
+
+    def cerrar(self):
+        pass
+
+
+def _json(fila):
+    if serializacion.orjson is not None:
+        return serializacion.orjson.dumps(fila)
+    return json.dumps(fila, ensure_ascii=False).encode()
+
+
+ESCRITORES = {'csv': EscritorTexto, 'ndjson': EscritorTexto, 'parquet': EscritorParquet}
+
+
+# --- estado y punto de control ---
+
+def ruta(id, extension):
+    return os.path.join(directorio, f"{id}.{extension}")
+
+
+def leer_estado(id):
+    if not ID_VALIDO.match(id or '') or not os.path.exists(ruta(id, 'json')):
+        return None
+    with open(ruta(id, 'json')) as f:
+        return json.load(f)
+
+
+def _guardar_estado(estado):
+    estado['actualizada'] = datetime.now().isoformat(timespec='seconds')
+    temporal = ruta(estado['id'], 'json.tmp')
+    with open(temporal, 'w') as f:
+        json.dump(estado, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta(estado['id'], 'json'))
+
+
+def progreso(estado):
+    """Estado para la API: agrega el porcentaje."""
+    total = estado.get('total')
+    return dict(estado, porcentaje=round(100 * estado['filas'] / total, 1) if total else
+                (100.0 if estado['estado'] == 'terminada' else 0.0))
+
+
+def crear(formato, filtros):
+    """Registra una exportación pendiente; ValueError si los parámetros no son válidos."""
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato} (opciones: {', '.join(FORMATOS)})")
+    if formato == 'parquet' and pyarrow is None:
+        raise ValueError("El formato parquet requiere pyarrow instalado en el servidor")
+    filtros = {k: filtros.get(k) or None for k in ('desde', 'hasta', 'area')}
+    try:
+        desde, hasta = (date.fromisoformat(filtros[k]) if filtros[k] else None for k in ('desde', 'hasta'))
+    except (TypeError, ValueError):
+        raise ValueError("Las fechas deben tener el formato AAAA-MM-DD")
+    if desde and hasta and desde > hasta:
+        raise ValueError("'desde' es posterior a 'hasta'")
+
+    estado = {"id": secrets.token_hex(8), "formato": formato, "filtros": filtros, "estado": "pendiente",
+              "filas": 0, "total": None, "ultimo_id": 0, "punto": {}, "error": None,
+              "creada": datetime.now().isoformat(timespec='seconds')}
+    _guardar_estado(estado)
+    return estado
+
+
+def en_curso(id):
+    """True si algún proceso tiene tomado el candado de la exportación."""
+    with open(ruta(id, 'lock'), 'a') as candado:
+        try:
+            fcntl.flock(candado, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(candado, fcntl.LOCK_UN)
+        return False
+
+
+def ejecutar(id, lote=LOTE_EXPORTACION, al_avanzar=None):
+    """
+    Corre o reanuda la exportación `id` hasta terminar (requiere contexto de aplicación).
+    Regresa el estado final; los errores quedan en estado['error'] para reanudar después.
+    Lanza EnCurso si otro hilo o proceso ya la está corriendo.
+    """
+    with open(ruta(id, 'lock'), 'a') as candado:
+        try:
+            fcntl.flock(candado, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise EnCurso(id)
+        # Se lee con el candado tomado: otro proceso pudo avanzarla o terminarla
+        estado = leer_estado(id)
+        if estado['estado'] == 'terminada':
+            return estado
+        escritor = None
+        try:
+            escritor = ESCRITORES[estado['formato']](ruta(id, estado['formato']), estado['formato'], estado['punto'])
+            estado.update(estado='en_curso', error=None)
+            if estado['total'] is None:
+                with _engine_lectura().connect() as conn:
+                    estado['total'] = contar(conn, estado['filtros'])
+            _guardar_estado(estado)
+            while True:
+                leidas = []
+
+                def bloque():
+                    for fila in leer_bloque(_engine_lectura(), estado['filtros'], estado['ultimo_id'], lote):
+                        leidas.append(fila['id'])
+                        yield fila
+
+                escritor.escribir(bloque())
+                if not leidas:
+                    break
+                estado['ultimo_id'] = leidas[-1]
+                estado['filas'] += len(leidas)
+                estado['punto'] = escritor.guardar()
+                _guardar_estado(estado)
+                if al_avanzar:
+                    al_avanzar(estado)
+                if len(leidas) < lote:
+                    break
+            escritor.terminar()
+            estado.update(estado='terminada', bytes=os.path.getsize(ruta(id, estado['formato'])))
+        except Exception as e:
+            if escritor is not None:
+                escritor.cerrar()
+            estado.update(estado='error', error=f"{type(e).__name__}: {e}")
+        _guardar_estado(estado)
+        return estado
+
+
+def iniciar(app, id):
+    """
+    Corre la exportación en un hilo (espera turno si ya hay EXPORTACION_HILOS corriendo).
+    Regresa el hilo.
+    """
+    def correr():
+        with _hilos, app.app_context():
+            try:
+                estado = ejecutar(id)
+            except EnCurso:
+                return
+            if estado['error']:
+                print(f"Exportación {id} interrumpida: {estado['error']}")
+
+    hilo = threading.Thread(target=correr, daemon=True, name=f'exportacion-{id}')
+    hilo.start()
+    return hilo
+
+
+def reanudar_huerfanas(app):
+    """
+    Lanza en hilos las exportaciones pendientes o en_curso cuyo candado no tiene nadie
+    (su proceso terminó). Si dos procesos lanzan la misma, ejecutar() deja correr solo a uno.
+    """
+    reanudadas = []
+    for nombre in sorted(os.listdir(directorio)):
+        id, _, extension = nombre.partition('.')
+        if extension != 'json':
+            continue
+        estado = leer_estado(id)
+        if estado is not None and estado['estado'] in ('pendiente', 'en_curso') and not en_curso(id):
+            iniciar(app, id)
+            reanudadas.append(id)
+    if reanudadas:
+        print(f"Exportaciones interrumpidas reanudadas: {', '.join(reanudadas)}")
+    return reanudadas
+
+
+def configurar(app):
+    global directorio, _hilos
+    directorio = os.environ.get('EXPORTACION_DIR') or os.path.join(app.instance_path, 'exportaciones')
+    os.makedirs(directorio, exist_ok=True)
+    _hilos = threading.BoundedSemaphore(int(os.environ.get('EXPORTACION_HILOS', 1)))
+
+
+def registrar_cli(app):
+    @app.cli.command('exportar-consultas')
+    @click.option('--desde', default=None, help='Día inicial (AAAA-MM-DD).')
+    @click.option('--hasta', default=None, help='Día final, incluido (AAAA-MM-DD).')
+    @click.option('--area', default=None, help='Área de la lista de espera del paciente.')
+    @click.option('--formato', type=click.Choice(FORMATOS), default='csv')
+    @click.option('--reanudar', 'id', default=None, help='Id de una exportación interrumpida.')
+    @click.option('--lote', type=int, default=LOTE_EXPORTACION)
+    def exportar_consultas(desde, hasta, area, formato, id, lote):
+        """Exporta consultas con los datos del paciente, en primer plano y con progreso."""
+        if id is None:
+            try:
+                id = crear(formato, {'desde': desde, 'hasta': hasta, 'area': area})['id']
+            except ValueError as e:
+                raise click.UsageError(str(e))
+        elif leer_estado(id) is None:
+            raise click.UsageError(f"No existe la exportación {id}")
+        inicio = time.perf_counter()
+
+        def avance(estado):
+            p = progreso(estado)
+            click.echo(f"\r{p['filas']}/{p['total']} filas ({p['porcentaje']}%)", nl=False, err=True)
+
+        try:
+            estado = ejecutar(id, lote, avance)
+        except EnCurso:
+            raise click.ClickException(f"La exportación {id} ya está corriendo en otro proceso")
+        click.echo('', err=True)
+        if estado['error']:
+            raise click.ClickException(f"{estado['error']} (reanudar con --reanudar {id})")
+        click.echo(json.dumps({"id": id, "archivo": ruta(id, estado['formato']), "filas": estado['filas'],
+                               "bytes": estado['bytes'], "segundos": round(time.perf_counter() - inicio, 2)}))
@@ -0,0 +1,299 @@
+"""
+Alta masiva de pacientes desde JSON (arreglo), NDJSON o CSV.
+
+Las filas se leen en streaming, se validan y se insertan por lotes: una sola
+sentencia INSERT ... ON CONFLICT DO NOTHING por lote (o una consulta de
+duplicados por lote en bases sin ON CONFLICT). Cada fila recibe su propio
+resultado; una fila mala (incluso una línea que no es JSON válido o que trae
+bytes que no son UTF-8) no detiene el resto de la importación.
+"""
+import csv
+import io
+import json
+import re
+from datetime import date, datetime
+
+import click
+from sqlalchemy import insert, select
+
+from .models import db, Paciente
+from . import afiliaciones
+
+TAMANO_LOTE = 1000
+OBLIGATORIOS = ('nombre', 'numero_afiliacion', 'fecha_nacimiento', 'sexo', 'tipo_sangre',
+                'recibe_donaciones', 'direccion', 'celular')
+OPCIONALES = ('contacto_emergencia', 'enfermedades', 'alergias', 'cirugias_previas',
+              'medicamentos_actuales')
+CLAVES_RESUMEN = {"creado": "creados", "duplicado": "duplicados", "error": "errores"}
+VERDADEROS = {'1', 'true', 'si', 'sí', 't', 'yes'}
+FALSOS = {'0', 'false', 'no', 'f', ''}
+
+
+# --- lectura ---
+
+class FilaIlegible(ValueError):
+    """Lo que entregan los lectores en lugar de una fila que no se pudo decodificar."""
+
+
+# Con errors='surrogateescape' cada byte que no es UTF-8 queda como un carácter U+DC80-U+DCFF:
+# la lectura no se corta a la mitad y la fila que lo trae se reporta como ilegible
+NO_UTF8 = re.compile('[\udc80-\udcff]')
+MENSAJE_NO_UTF8 = "La fila no es UTF-8 válido"
+
+
+def _texto(stream, encoding='utf-8', **opciones):
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding, errors='surrogateescape', **opciones)
+
+
+def leer_json(stream, tamano_bloque=65536):
+    """Recorre un arreglo JSON objeto por objeto sin cargarlo completo."""
+    decodificador = json.JSONDecoder()
+    lector = _texto(stream)
+    buffer = lector.read(tamano_bloque).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("Se esperaba un arreglo JSON")
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            objeto, fin = decodificador.raw_decode(buffer)
+        except json.JSONDecodeError as e:
+            # Solo se revisa dónde acaba el elemento cuando falla: o falta leer el resto o está mal escrito
+            fin = _fin_elemento(buffer)
+            if fin is None:
+                bloque = lector.read(tamano_bloque)
+                if not bloque:
+                    yield FilaIlegible("Arreglo JSON incompleto")
+                    return
+                buffer += bloque
+                continue
+            yield FilaIlegible(f"JSON inválido: {e.msg}")
+        else:
+            yield FilaIlegible(MENSAJE_NO_UTF8) if NO_UTF8.search(buffer, 0, fin) else objeto
+        buffer = buffer[fin:]
+
+
+def _fin_elemento(buffer):
+    """Posición de la coma o del corchete que cierra el elemento al inicio de `buffer`; None si falta texto."""
+    profundidad, en_cadena, escape = 0, False, False
+    for i, c in enumerate(buffer):
+        if en_cadena:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                en_cadena = False
+        elif c == '"':
+            en_cadena = True
+        elif c in '{[':
+            profundidad += 1
+        elif c in '}]':
+            if profundidad == 0:
+                return i
+            profundidad -= 1
+        elif c == ',' and profundidad == 0:
+            return i
+    return None
+
+
+def leer_ndjson(stream):
+    # Cada línea se decodifica por separado: una línea ilegible es un error de esa fila
+    for linea in stream:
+        try:
+            texto = linea.decode('utf-8') if isinstance(linea, bytes) else linea
+            if texto.strip():
+                yield json.loads(texto)
+        except UnicodeDecodeError:
+            yield FilaIlegible(MENSAJE_NO_UTF8)
+        except json.JSONDecodeError as e:
+            yield FilaIlegible(f"JSON inválido: {e.msg} (columna {e.colno})")
+
+
+def leer_csv(stream):
+    for fila in csv.DictReader(_texto(stream, encoding='utf-8-sig', newline='')):
+        if any(NO_UTF8.search(valor) for valor in fila.values() if isinstance(valor, str)):
+            yield FilaIlegible(MENSAJE_NO_UTF8)
+        else:
+            yield fila
+
+
+LECTORES = {'json': leer_json, 'ndjson': leer_ndjson, 'csv': leer_csv}
+
+
+def formato_por_tipo(content_type):
+    if 'csv' in content_type:
+        return 'csv'
+    if 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    return 'json'
+
+
+# --- validación ---
+
+def validar_campos(data):
+    """
+    Convierte los campos de Paciente presentes en `data` (los demás se ignoran).
+    Regresa (valores, errores) con errores = {campo: mensaje}; lo usan la importación
+    y la edición parcial de pacientes.
+    """
+    valores, errores = {}, {}
+    for campo in OBLIGATORIOS + OPCIONALES:
+        if campo not in data:
+            continue
+        valor = data[campo]
+        if valor in (None, ''):
+            if campo in OBLIGATORIOS:
+                errores[campo] = "es obligatorio"
+            else:
+                valores[campo] = None
+            continue
+        if isinstance(valor, (dict, list)):
+            errores[campo] = "debe ser un valor simple, no un objeto o lista"
+            continue
+
+        if campo == 'fecha_nacimiento':
+            if not isinstance(valor, date):
+                try:
+                    valor = datetime.strptime(str(valor), '%Y-%m-%d').date()
+                except ValueError:
+                    errores[campo] = "debe tener formato AAAA-MM-DD"
+                    continue
+        elif campo == 'recibe_donaciones':
+            if not isinstance(valor, bool):
+                texto = str(valor).strip().lower()
+                if texto not in VERDADEROS | FALSOS:
+                    errores[campo] = "debe ser verdadero o falso"
+                    continue
+                valor = texto in VERDADEROS
+        else:
+            valor = str(valor).strip() if campo in OBLIGATORIOS else str(valor)
+            largo = getattr(Paciente.__table__.c[campo].type, 'length', None)
+            if largo and len(valor) > largo:
+                errores[campo] = f"excede {largo} caracteres"
+                continue
+        valores[campo] = valor
+    return valores, errores
+
+
+def validar(data):
+    """Convierte una fila en los valores de un Paciente o lanza ValueError."""
+    if isinstance(data, FilaIlegible):
+        raise data
+    if not isinstance(data, dict):
+        raise ValueError("La fila debe ser un objeto")
+    faltantes = [c for c in OBLIGATORIOS if data.get(c) in (None, '')]
+    if faltantes:
+        raise ValueError(f"Campos obligatorios faltantes: {', '.join(faltantes)}")
+
+    valores, errores = validar_campos(data)
+    if errores:
+        raise ValueError('; '.join(f"{campo} {mensaje}" for campo, mensaje in errores.items()))
+    return dict({c: None for c in OPCIONALES}, **valores)
+
+
+# --- inserción ---
+
+def _insertar_lote(lote):
+    """lote: [(numero_fila, valores)] sin afiliaciones repetidas. Regresa {afiliacion: id} de los insertados."""
+    filas = [valores for _, valores in lote]
+    dialecto = db.engine.dialect.name
+    if dialecto in ('postgresql', 'sqlite'):
+        if dialecto == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as insert_dialecto
+        else:
+            from sqlalchemy.dialects.sqlite import insert as insert_dialecto
+        sentencia = insert_dialecto(Paciente).on_conflict_do_nothing(index_elements=['numero_afiliacion'])\
+            .returning(Paciente.numero_afiliacion, Paciente.id)
+        insertados = dict(db.session.execute(sentencia, filas).all())
+    else:
+        numeros = [v['numero_afiliacion'] for v in filas]
+        existentes = set(db.session.scalars(
+            select(Paciente.numero_afiliacion).where(Paciente.numero_afiliacion.in_(numeros))))
+        nuevas = [v for v in filas if v['numero_afiliacion'] not in existentes]
+        if nuevas:
+            db.session.execute(insert(Paciente), nuevas)
+        insertados = dict(db.session.execute(
+            select(Paciente.numero_afiliacion, Paciente.id)
+            .where(Paciente.numero_afiliacion.in_([v['numero_afiliacion'] for v in nuevas]))).all())
+    db.session.commit()
+    for numero_afiliacion in insertados:
+        afiliaciones.indice.agregar(numero_afiliacion)
+    return insertados
+
+
+def importar(filas, tamano_lote=TAMANO_LOTE):
+    """Genera un resultado por fila: {"fila", "resultado": creado|duplicado|error, "id"|"detalle"}."""
+    lote = []
+    en_lote = set()
+    resultados = []
+
+    def procesar():
+        try:
+            insertados = _insertar_lote(lote) if lote else {}
+        except Exception as e:
+            db.session.rollback()
+            resultados.extend({"fila": numero, "resultado": "error", "detalle": f"Error de base de datos: {e}"}
+                              for numero, _ in lote)
+        else:
+            for numero, valores in lote:
+                id = insertados.get(valores['numero_afiliacion'])
+                if id is None:
+                    resultados.append({"fila": numero, "resultado": "duplicado",
+                                       "numero_afiliacion": valores['numero_afiliacion']})
+                else:
+                    resultados.append({"fila": numero, "resultado": "creado", "id": id})
+        return sorted(resultados, key=lambda r: r['fila'])
+
+    for numero, data in enumerate(filas, start=1):
+        try:
+            valores = validar(data)
+        except ValueError as e:
+            resultados.append({"fila": numero, "resultado": "error", "detalle": str(e)})
+            continue
+        if valores['numero_afiliacion'] in en_lote:
+            resultados.append({"fila": numero, "resultado": "duplicado",
+                               "numero_afiliacion": valores['numero_afiliacion']})
+            continue
+        lote.append((numero, valores))
+        en_lote.add(valores['numero_afiliacion'])
+        if len(lote) >= tamano_lote:
+            yield from procesar()
+            lote, resultados = [], []
+            en_lote.clear()
+    yield from procesar()
+
+
+def resumir(resultados):
+    """Cuenta los resultados por tipo sin guardarlos en memoria."""
+    resumen = {"creados": 0, "duplicados": 0, "errores": 0}
+    for r in resultados:
+        resumen[CLAVES_RESUMEN[r['resultado']]] += 1
+    return resumen
+
+
+def registrar_cli(app):
+    @app.cli.command('importar-pacientes')
+    @click.argument('archivo', type=click.File('rb'))
+    @click.option('--formato', type=click.Choice(list(LECTORES)), default=None,
+                  help='Por omisión se deduce de la extensión del archivo.')
+    @click.option('--reporte', type=click.File('w'), default=None,
+                  help='Archivo NDJSON con el resultado de cada fila.')
+    @click.option('--lote', type=int, default=TAMANO_LOTE)
+    def importar_pacientes(archivo, formato, reporte, lote):
+        """Importa pacientes desde un archivo JSON, NDJSON o CSV."""
+        formato = formato or formato_por_tipo(archivo.name.rsplit('.', 1)[-1])
+
+        def reportar(resultados):
+            for resultado in resultados:
+                if reporte:
+                    reporte.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+                elif resultado['resultado'] == 'error':
+                    click.echo(f"Fila {resultado['fila']}: {resultado['detalle']}", err=True)
+                yield resultado
+
+        click.echo(json.dumps(resumir(reportar(importar(LECTORES[formato](archivo), lote)))))
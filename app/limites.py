@@ -0,0 +1,303 @@
+"""
+Límites de peticiones y control de admisión para las rutas costosas.
+
+Las rutas marcadas con `@limites.costosa(nombre, tasa, rafaga)` pasan por dos
+filtros antes de tocar la base:
+
+1. Cubeta de fichas por cliente y por ruta: `rafaga` peticiones seguidas y
+   después `tasa` por segundo. Sin fichas responde 429 con Retry-After (los
+   segundos que faltan para la siguiente).
+2. Tope de peticiones costosas en curso en el proceso (LIMITES_CONCURRENCIA).
+   Por omisión es min(DB_POOL_SIZE, GUNICORN_THREADS - 1 - LIMITES_SSE): un
+   worker atiende a lo más GUNICORN_THREADS peticiones a la vez y parte de los
+   hilos pueden estar ocupados por pantallas en vivo, así que un tope mayor
+   nunca se alcanzaría; así las costosas no ocupan más conexiones que la base
+   del pool y siempre queda un hilo para las rutas baratas. Si no hay lugar en
+   LIMITES_ESPERA_MS milisegundos responde 503 con Retry-After en vez de
+   formarse a esperar conexión. Las respuestas en streaming ocupan su lugar
+   hasta que terminan de enviarse.
+
+Las conexiones en vivo (`@limites.en_vivo(nombre)`, el canal SSE de la lista
+de espera) ocupan un hilo del worker todo el tiempo que la pantalla está
+abierta. Se aceptan a lo más LIMITES_SSE por proceso (por omisión la mitad de
+GUNICORN_THREADS); la siguiente recibe 503 con Retry-After de inmediato y el
+front debe reconectar pasado ese tiempo (EventSource no reintenta solo ante
+un 503).
+
+El cliente es la IP; detrás de un proxy de confianza, LIMITES_PROXY=1 usa el
+primer X-Forwarded-For.
+
+Cubetas:
+- en memoria (por omisión): cada worker lleva su propia cuenta, así que el
+  límite efectivo se multiplica por el número de workers
+- compartidas en Redis (REDIS_URL, salvo LIMITES_COMPARTIDOS=0): un script
+  atómico por petición; si Redis no responde se deja pasar, como la caché
+- cualquier objeto con `tomar(clave, tasa, rafaga) -> (permitido, espera)`
+  pasado a configurar()
+
+Ajustes por ruta: LIMITE_<NOMBRE>=tasa/rafaga (p. ej. LIMITE_LISTA_PACIENTES=1/5),
+o 0 para quitarle el límite de tasa. LIMITES=0 apaga todo.
+"""
+import functools
+import math
+import os
+import threading
+import time
+
+from flask import jsonify, make_response, request
+
+activos = True
+confiar_proxy = False
+
+
+class CubetasMemoria:
+
+    def __init__(self, maximo=100000):
+        self.maximo = maximo
+        # clave -> (fichas, última actualización, momento en que estará llena)
+        self._cubetas = {}
+        self._lock = threading.Lock()
+
+    def tomar(self, clave, tasa, rafaga):
+        ahora = time.monotonic()
+        with self._lock:
+            fichas, ultimo, _ = self._cubetas.get(clave, (rafaga, ahora, ahora))
+            fichas = min(rafaga, fichas + (ahora - ultimo) * tasa)
+            permitido = fichas >= 1
+            if permitido:
+                fichas -= 1
+            self._cubetas[clave] = (fichas, ahora, ahora + (rafaga - fichas) / tasa)
+            if len(self._cubetas) > self.maximo:
+                self._purgar(ahora)
+        return permitido, 0.0 if permitido else (1 - fichas) / tasa
+
+    def _purgar(self, ahora):
+        # Una cubeta llena es igual a una que no existe
+        for clave in [c for c, (_, _, llena) in self._cubetas.items() if llena <= ahora]:
+            del self._cubetas[clave]
+
+    def estadisticas(self):
+        return {"cubetas": len(self._cubetas)}
+
+
+# Fichas y última actualización en un hash; el reloj es el de Redis para que todos los workers coincidan
+SCRIPT_REDIS = """
+local tasa = tonumber(ARGV[1])
+local rafaga = tonumber(ARGV[2])
+local reloj = redis.call('TIME')
+local ahora = tonumber(reloj[1]) + tonumber(reloj[2]) / 1000000
+local guardado = redis.call('HMGET', KEYS[1], 'fichas', 'ultimo')
+local fichas = tonumber(guardado[1]) or rafaga
+local ultimo = tonumber(guardado[2]) or ahora
+fichas = math.min(rafaga, fichas + math.max(0, ahora - ultimo) * tasa)
+local permitido = 0
+local espera = 0
+if fichas >= 1 then
+  fichas = fichas - 1
+  permitido = 1
+else
+  espera = (1 - fichas) / tasa
+end
+redis.call('HSET', KEYS[1], 'fichas', tostring(fichas), 'ultimo', tostring(ahora))
+redis.call('PEXPIRE', KEYS[1], math.ceil((rafaga - fichas) / tasa * 1000) + 1000)
+return {permitido, tostring(espera)}
+"""
+
+
+class CubetasRedis:
+
+    def __init__(self, url, prefijo='cddia:limite:'):
+        import redis
+
+        self.prefijo = prefijo
+        self._cliente = redis.Redis.from_url(url, socket_timeout=0.2)
+        self._script = self._cliente.register_script(SCRIPT_REDIS)
+        self.errores = 0
+
+    def tomar(self, clave, tasa, rafaga):
+        try:
+            permitido, espera = self._script(keys=[self.prefijo + clave], args=[tasa, rafaga])
+        except Exception:
+            # Sin Redis no se limita: mejor atender de más que rechazar a todos
+            self.errores += 1
+            return True, 0.0
+        return bool(permitido), float(espera)
+
+    def estadisticas(self):
+        return {"errores": self.errores}
+
+
+class Admision:
+    """Tope de peticiones costosas simultáneas en el proceso."""
+
+    def __init__(self, maximo, espera):
+        self.maximo = maximo
+        self.espera = espera
+        self._lugares = threading.BoundedSemaphore(maximo)
+
+    def entrar(self):
+        return self._lugares.acquire(timeout=self.espera) if self.espera else self._lugares.acquire(blocking=False)
+
+    def salir(self):
+        self._lugares.release()
+
+
+cubetas = CubetasMemoria()
+admision = Admision(5, 0.05)
+en_vivo_abiertas = Admision(4, 0)
+ESPERA_EN_VIVO = 5
+_limites = {}
+_contadores = {}
+_lock_contadores = threading.Lock()
+
+
+def cliente():
+    if confiar_proxy:
+        reenviado = request.headers.get('X-Forwarded-For')
+        if reenviado:
+            return reenviado.split(',')[0].strip()
+    return request.remote_addr or 'desconocido'
+
+
+def limite(nombre, tasa, rafaga):
+    """(tasa, rafaga) de la ruta con el ajuste de LIMITE_<NOMBRE>, o None si no tiene límite de tasa."""
+    tasa, rafaga = _limites.get(nombre.upper(), (tasa, rafaga))
+    return (float(tasa), float(rafaga)) if tasa > 0 else None
+
+
+def leer_ajuste(variable, valor):
+    """'tasa/rafaga' o 'tasa' -> (tasa, rafaga). ValueError con el nombre de la variable si no se entiende."""
+    tasa, _, rafaga = valor.partition('/')
+    try:
+        tasa = float(tasa)
+        rafaga = float(rafaga) if rafaga else max(1.0, tasa)
+    except ValueError:
+        raise ValueError(f"{variable}={valor!r}: se esperaba tasa/rafaga, p. ej. 1/5, o 0") from None
+    if tasa < 0 or (tasa > 0 and rafaga < 1):
+        raise ValueError(f"{variable}={valor!r}: la tasa no puede ser negativa y la ráfaga debe ser al menos 1")
+    return tasa, rafaga
+
+
+def _contar(nombre, resultado):
+    with _lock_contadores:
+        contadores = _contadores.setdefault(nombre, {"atendidas": 0, "limitadas": 0, "rechazadas": 0})
+        contadores[resultado] += 1
+
+
+def _rechazo(estado, espera, mensaje):
+    respuesta = jsonify({"error": "Too Many Requests" if estado == 429 else "Service Unavailable",
+                         "mensaje": mensaje})
+    respuesta.status_code = estado
+    respuesta.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+    return respuesta
+
+
+def costosa(nombre, tasa, rafaga, concurrencia=True):
+    """
+    Aplica la cubeta de fichas de `nombre` por cliente y, con concurrencia=True,
+    el tope de peticiones costosas en curso.
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(*args, **kwargs):
+            if not activos:
+                return vista(*args, **kwargs)
+            tasa_rafaga = limite(nombre, tasa, rafaga)
+            if tasa_rafaga is not None:
+                permitido, espera = cubetas.tomar(f"{nombre}:{cliente()}", *tasa_rafaga)
+                if not permitido:
+                    _contar(nombre, "limitadas")
+                    return _rechazo(429, espera, f"Demasiadas peticiones a {nombre}; "
+                                                 f"reintenta en {max(1, math.ceil(espera))} s.")
+            if not concurrencia:
+                _contar(nombre, "atendidas")
+                return vista(*args, **kwargs)
+            if not admision.entrar():
+                _contar(nombre, "rechazadas")
+                return _rechazo(503, 1, "El servidor está ocupado con otras consultas pesadas; reintenta en un momento.")
+            try:
+                respuesta = make_response(vista(*args, **kwargs))
+            except BaseException:
+                admision.salir()
+                raise
+            _contar(nombre, "atendidas")
+            if respuesta.is_streamed:
+                respuesta.call_on_close(admision.salir)
+            else:
+                admision.salir()
+            return respuesta
+
+        return envoltura
+
+    return decorador
+
+
+def en_vivo(nombre):
+    """Tope de conexiones en vivo (SSE) abiertas en el proceso; cada una ocupa un hilo hasta que se cierra."""
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(*args, **kwargs):
+            if not activos:
+                return vista(*args, **kwargs)
+            if not en_vivo_abiertas.entrar():
+                _contar(nombre, "rechazadas")
+                return _rechazo(503, ESPERA_EN_VIVO, "Hay demasiadas pantallas conectadas a este servidor; "
+                                                     f"reintenta en {ESPERA_EN_VIVO} s.")
+            try:
+                respuesta = make_response(vista(*args, **kwargs))
+            except BaseException:
+                en_vivo_abiertas.salir()
+                raise
+            _contar(nombre, "atendidas")
+            respuesta.call_on_close(en_vivo_abiertas.salir)
+            return respuesta
+
+        return envoltura
+
+    return decorador
+
+
+def estadisticas():
+    with _lock_contadores:
+        rutas = {nombre: dict(contadores) for nombre, contadores in _contadores.items()}
+    detalle = cubetas.estadisticas() if hasattr(cubetas, 'estadisticas') else {}
+    return {"activos": activos, "concurrencia_maxima": admision.maximo,
+            "en_vivo_maximas": en_vivo_abiertas.maximo, "rutas": rutas,
+            "cubetas": dict(detalle, tipo=type(cubetas).__name__)}
+
+
+def _hilos():
+    # Mismo valor por omisión que gunicorn.conf.py
+    return int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def en_vivo_por_omision():
+    return max(1, _hilos() // 2)
+
+
+def concurrencia_por_omision(en_vivo=None):
+    # Mismo valor por omisión que opciones_pool (app/__init__.py)
+    pool = int(os.environ.get('DB_POOL_SIZE', 5))
+    en_vivo = en_vivo_por_omision() if en_vivo is None else en_vivo
+    return max(1, min(pool, _hilos() - 1 - en_vivo))
+
+
+def configurar(backend=None):
+    global activos, confiar_proxy, cubetas, admision, en_vivo_abiertas
+    activos = os.environ.get('LIMITES', '1') == '1'
+    confiar_proxy = os.environ.get('LIMITES_PROXY', '0') == '1'
+    if backend is not None:
+        cubetas = backend
+    elif os.environ.get('REDIS_URL') and os.environ.get('LIMITES_COMPARTIDOS', '1') == '1':
+        cubetas = CubetasRedis(os.environ['REDIS_URL'])
+    else:
+        cubetas = CubetasMemoria()
+    maximo_en_vivo = int(os.environ.get('LIMITES_SSE', en_vivo_por_omision()))
+    en_vivo_abiertas = Admision(maximo_en_vivo, 0)
+    admision = Admision(int(os.environ.get('LIMITES_CONCURRENCIA', concurrencia_por_omision(maximo_en_vivo))),
+                        float(os.environ.get('LIMITES_ESPERA_MS', 50)) / 1000)
+    # Los ajustes por ruta se validan al arrancar: uno mal escrito no debe convertir cada petición en un 500
+    _limites.clear()
+    for variable, valor in os.environ.items():
+        if variable.startswith('LIMITE_'):
+            _limites[variable[len('LIMITE_'):]] = leer_ajuste(variable, valor)
@@ -0,0 +1,59 @@
+"""
+Marca de agua por id para las cargas incrementales de pacientes (índice de
+búsqueda en memoria y filtro de afiliaciones).
+
+El id se asigna al insertar pero la fila solo se ve después del commit, así
+que otro worker puede confirmar un id menor al último que ya leímos. Por eso
+la marca solo avanza con lo que devuelve la base, y cada id que falta entre
+los leídos queda como hueco: se vuelve a pedir en las sincronizaciones
+siguientes hasta que aparece o pasan SEGUNDOS_HUECO (transacción revertida o
+fila borrada).
+"""
+import time
+
+from sqlalchemy import or_
+
+SEGUNDOS_HUECO = 600
+# Solo se vigilan los huecos más recientes; los viejos casi siempre son filas borradas
+MAXIMO_HUECOS = 1000
+
+
+class MarcaAgua:
+
+    def __init__(self):
+        self.ultimo_id = 0
+        self._huecos = {}
+
+    def condicion(self, columna_id):
+        """WHERE de las filas por leer: las nuevas y las de los huecos pendientes."""
+        if not self._huecos:
+            return columna_id > self.ultimo_id
+        return or_(columna_id > self.ultimo_id, columna_id.in_(sorted(self._huecos)))
+
+    def leer(self, conn, consulta, columna_id, lote):
+        """Ejecuta `consulta` con la condición y va registrando los ids; las filas salen en orden de id."""
+        ahora = time.monotonic()
+        filas = conn.execution_options(yield_per=lote).execute(
+            consulta.where(self.condicion(columna_id)).order_by(columna_id))
+        for fila in filas:
+            self._visto(getattr(fila, columna_id.key), ahora)
+            yield fila
+        self._depurar(ahora)
+
+    def reiniciar(self):
+        self.ultimo_id = 0
+        self._huecos = {}
+
+    def _visto(self, id, ahora):
+        if id > self.ultimo_id:
+            for hueco in range(max(self.ultimo_id + 1, id - MAXIMO_HUECOS), id):
+                self._huecos[hueco] = ahora
+            self.ultimo_id = id
+        else:
+            self._huecos.pop(id, None)
+
+    def _depurar(self, ahora):
+        vigentes = {id: t for id, t in self._huecos.items() if ahora - t < SEGUNDOS_HUECO}
+        if len(vigentes) > MAXIMO_HUECOS:
+            vigentes = dict(sorted(vigentes.items())[-MAXIMO_HUECOS:])
+        self._huecos = vigentes
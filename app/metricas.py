@@ -0,0 +1,417 @@
+"""
+Métricas por ruta en formato Prometheus (/metrics).
+
+Por cada petición se mide la latencia, cuántas sentencias SQL se ejecutaron y
+cuánto tardaron, el tiempo de serialización JSON y el tamaño de la respuesta.
+Las sentencias lentas y las repetidas muchas veces en una misma petición
+(patrón N+1) se registran en el log. Con METRICAS_PERFILADOR=1, una petición
+con el encabezado X-Perfilar: 1 se muestrea y su perfil se guarda en formato
+de pilas colapsadas (listo para flamegraph.pl o speedscope).
+
+Cada proceso lleva sus propios contadores. Con varios workers (gunicorn)
+cada uno guarda una copia en METRICAS_DIR cada METRICAS_INTERVALO segundos
+(2 por omisión) y /metrics, lo atienda el worker que lo atienda, responde la
+suma de todas: los contadores no retroceden al cambiar de worker. Las copias
+de workers que ya terminaron se siguen sumando (se juntan en muertos.json)
+para que un reciclaje tampoco los haga retroceder; el directorio se vacía
+solo al reiniciar el servicio completo (gunicorn.conf.py crea uno nuevo por
+arranque). Lo que no es un contador de peticiones (caché, filtro de
+afiliaciones, bitácora) se expone por proceso vivo con la etiqueta
+`proceso`. Sin METRICAS_DIR (servidor de desarrollo, pruebas) /metrics
+muestra solo el proceso que responde.
+"""
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import afiliaciones, bitacora, cache
+from .serializacion import ProveedorJSONRapido
+
+CUBETAS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CUBETAS_SQL = (0, 1, 2, 5, 10, 25, 50, 100)
+CUBETAS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histograma:
+
+    def __init__(self, cubetas):
+        self.cubetas = cubetas
+        self.conteos = [0] * len(cubetas)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.cubetas):
+            if valor <= limite:
+                self.conteos[i] += 1
+                break
+        self.suma += valor
+        self.total += 1
+
+    def lineas(self, nombre, etiquetas):
+        acumulado = 0
+        for limite, conteo in zip(self.cubetas, self.conteos):
+            acumulado += conteo
+            yield f'{nombre}_bucket{{{etiquetas},le="{limite}"}} {acumulado}'
+        yield f'{nombre}_bucket{{{etiquetas},le="+Inf"}} {self.total}'
+        yield f'{nombre}_sum{{{etiquetas}}} {self.suma}'
+        yield f'{nombre}_count{{{etiquetas}}} {self.total}'
+
+
+class Registro:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencia = defaultdict(lambda: Histograma(CUBETAS_LATENCIA))
+        self.sentencias = defaultdict(lambda: Histograma(CUBETAS_SQL))
+        self.bytes = defaultdict(lambda: Histograma(CUBETAS_BYTES))
+        self.sql_segundos = Counter()
+        self.serializacion_segundos = Counter()
+        self.peticiones = Counter()
+        self.sql_lentas = 0
+        self.n_mas_1 = 0
+
+    def registrar(self, ruta, metodo, estado, duracion, sql_n, sql_t, serializacion_t, tamano):
+        clave = (ruta, metodo)
+        with self._lock:
+            self.latencia[clave].observar(duracion)
+            self.sentencias[clave].observar(sql_n)
+            if tamano is not None:
+                self.bytes[clave].observar(tamano)
+            self.sql_segundos[clave] += sql_t
+            self.serializacion_segundos[clave] += serializacion_t
+            self.peticiones[(ruta, metodo, estado)] += 1
+
+    def volcar(self):
+        """Copia de los contadores que se puede guardar en JSON y sumar con sumar()."""
+        with self._lock:
+            return {
+                'histogramas': {nombre: [[list(clave), h.conteos, h.suma, h.total] for clave, h in datos.items()]
+                                for nombre, datos in self._histogramas()},
+                'contadores': {nombre: [[list(clave), valor] for clave, valor in datos.items()]
+                               for nombre, datos in self._contadores()},
+                'sql_lentas': self.sql_lentas,
+                'n_mas_1': self.n_mas_1,
+            }
+
+    def sumar(self, copia):
+        with self._lock:
+            for nombre, datos in self._histogramas():
+                for clave, conteos, suma, total in copia['histogramas'].get(nombre, ()):
+                    histograma = datos[tuple(clave)]
+                    histograma.conteos = [a + b for a, b in zip(histograma.conteos, conteos)]
+                    histograma.suma += suma
+                    histograma.total += total
+            for nombre, datos in self._contadores():
+                for clave, valor in copia['contadores'].get(nombre, ()):
+                    datos[tuple(clave)] += valor
+            self.sql_lentas += copia['sql_lentas']
+            self.n_mas_1 += copia['n_mas_1']
+
+    def _histogramas(self):
+        return (('latencia', self.latencia), ('sentencias', self.sentencias), ('bytes', self.bytes))
+
+    def _contadores(self):
+        return (('sql_segundos', self.sql_segundos), ('serializacion_segundos', self.serializacion_segundos),
+                ('peticiones', self.peticiones))
+
+    def texto(self):
+        lineas = []
+
+        def etiquetas(ruta, metodo):
+            return f'ruta="{ruta}",metodo="{metodo}"'
+
+        with self._lock:
+            for nombre, ayuda, datos in (
+                ('api_peticion_duracion_segundos', 'Latencia de la petición', self.latencia),
+                ('api_sql_sentencias', 'Sentencias SQL por petición', self.sentencias),
+                ('api_respuesta_bytes', 'Tamaño del cuerpo de la respuesta', self.bytes),
+            ):
+                lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} histogram']
+                for clave, histograma in sorted(datos.items()):
+                    lineas += histograma.lineas(nombre, etiquetas(*clave))
+            for nombre, ayuda, datos in (
+                ('api_sql_duracion_segundos_total', 'Tiempo total en SQL', self.sql_segundos),
+                ('api_serializacion_segundos_total', 'Tiempo total serializando JSON', self.serializacion_segundos),
+            ):
+                lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} counter']
+                lineas += [f'{nombre}{{{etiquetas(*clave)}}} {valor}' for clave, valor in sorted(datos.items())]
+            lineas += ['# HELP api_peticiones_total Peticiones atendidas', '# TYPE api_peticiones_total counter']
+            lineas += [f'api_peticiones_total{{{etiquetas(ruta, metodo)},estado="{estado}"}} {n}'
+                       for (ruta, metodo, estado), n in sorted(self.peticiones.items())]
+            lineas += ['# TYPE api_sql_lentas_total counter', f'api_sql_lentas_total {self.sql_lentas}',
+                       '# TYPE api_n_mas_1_total counter', f'api_n_mas_1_total {self.n_mas_1}']
+        return lineas
+
+
+def estadisticas_proceso():
+    """[(nombre, {etiqueta: valor}, valor)] del proceso: caché, filtro de afiliaciones y bitácora."""
+    resultado = []
+    for nivel, valores in cache.respuestas.estadisticas().items():
+        resultado += [(f'api_cache_{nombre}', {'nivel': nivel}, valor) for nombre, valor in valores.items()]
+    resultado += [(f'api_filtro_afiliaciones_{nombre}', {}, valor)
+                  for nombre, valor in afiliaciones.indice.estadisticas().items()]
+    if bitacora.escritor is not None:
+        resultado += [(f'api_bitacora_espera_{nombre}', {}, valor)
+                      for nombre, valor in bitacora.escritor.estadisticas().items()]
+    return resultado
+
+
+def _lineas_proceso(estadisticas, **extra):
+    lineas = []
+    for nombre, etiquetas, valor in estadisticas:
+        etiquetas = dict(etiquetas, **extra)
+        texto = ','.join(f'{k}="{v}"' for k, v in etiquetas.items())
+        lineas.append(f'{nombre}{{{texto}}} {valor}' if texto else f'{nombre} {valor}')
+    return lineas
+
+
+class Compartido:
+    """Copias de los registros de cada proceso en un directorio, para sumarlas en /metrics."""
+
+    MUERTOS = 'muertos.json'
+
+    def __init__(self, directorio, intervalo):
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self._detener = None
+        os.makedirs(directorio, exist_ok=True)
+
+    def iniciar(self):
+        """Hilo que guarda la copia de este proceso (uno por proceso; se vuelve a llamar tras un fork)."""
+        if self._detener is not None:
+            self._detener.set()
+        detener = self._detener = threading.Event()
+
+        def bucle():
+            while not detener.wait(self.intervalo):
+                self.guardar()
+
+        threading.Thread(target=bucle, daemon=True, name='metricas-copia').start()
+
+    def guardar(self):
+        # Un proceso que no ha atendido peticiones (el master con preload_app) no deja copia
+        if not registro.peticiones:
+            return
+        copia = {'registro': registro.volcar(), 'proceso': estadisticas_proceso()}
+        self._escribir(f"{os.getpid()}.json", copia)
+
+    def _escribir(self, nombre, copia):
+        ruta = os.path.join(self.directorio, nombre)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'w') as archivo:
+            json.dump(copia, archivo)
+        os.replace(temporal, ruta)
+
+    def _leer(self, nombre):
+        try:
+            with open(os.path.join(self.directorio, nombre)) as archivo:
+                return json.load(archivo)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def texto(self):
+        """Líneas de /metrics: la suma de las copias de todos los procesos, vivos y terminados."""
+        self.guardar()
+        total, muertos = Registro(), Registro()
+        proceso, terminados = [], []
+        with open(os.path.join(self.directorio, '.candado'), 'a') as candado:
+            fcntl.flock(candado, fcntl.LOCK_EX)
+            anteriores = self._leer(self.MUERTOS)
+            if anteriores is not None:
+                muertos.sumar(anteriores['registro'])
+            for nombre in sorted(os.listdir(self.directorio)):
+                pid, _, extension = nombre.partition('.')
+                copia = self._leer(nombre) if extension == 'json' and pid.isdigit() else None
+                if copia is None:
+                    continue
+                if _vivo(int(pid)):
+                    total.sumar(copia['registro'])
+                    proceso += _lineas_proceso(copia['proceso'], proceso=pid)
+                else:
+                    muertos.sumar(copia['registro'])
+                    terminados.append(nombre)
+            if terminados:
+                # Los procesos terminados se juntan en un solo archivo para que el directorio no crezca
+                self._escribir(self.MUERTOS, {'registro': muertos.volcar()})
+                for nombre in terminados:
+                    os.remove(os.path.join(self.directorio, nombre))
+        total.sumar(muertos.volcar())
+        return total.texto() + proceso
+
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+registro = Registro()
+compartido = None
+
+
+def _sumar_serializacion(inicio):
+    if has_request_context() and 'metricas' in g:
+        g.metricas['serializacion'] += time.perf_counter() - inicio
+
+
+class ProveedorJSONMedido(ProveedorJSONRapido):
+    """Proveedor JSON de Flask que suma el tiempo de serialización a la petición actual."""
+
+    def dumps(self, obj, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            _sumar_serializacion(inicio)
+
+    def dumps_bytes(self, obj):
+        inicio = time.perf_counter()
+        try:
+            return super().dumps_bytes(obj)
+        finally:
+            _sumar_serializacion(inicio)
+
+
+# --- SQL ---
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_de_sql(conn, cursor, sentencia, parametros, contexto, executemany):
+    conn.info.setdefault('inicio_sql', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _despues_de_sql(conn, cursor, sentencia, parametros, contexto, executemany):
+    duracion = time.perf_counter() - conn.info['inicio_sql'].pop()
+    if not has_request_context() or 'metricas' not in g:
+        return
+    metricas = g.metricas
+    metricas['sql_n'] += 1
+    metricas['sql_t'] += duracion
+    metricas['sentencias'][sentencia] += 1
+    if duracion * 1000 >= current_app.config['METRICAS_SQL_LENTA_MS']:
+        registro.sql_lentas += 1
+        current_app.logger.warning("SQL lenta (%.1f ms) en %s: %s", duracion * 1000, request.path, sentencia)
+
+
+# --- perfilador por muestreo ---
+
+class Perfilador:
+    """Toma muestras de la pila del hilo de la petición y las acumula como pilas colapsadas."""
+
+    def __init__(self, hilo_id, intervalo):
+        self.hilo_id = hilo_id
+        self.intervalo = intervalo
+        self.pilas = Counter()
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._hilo.join()
+
+    def _muestrear(self):
+        while not self._detener.wait(self.intervalo):
+            marco = sys._current_frames().get(self.hilo_id)
+            pila = []
+            while marco is not None:
+                codigo = marco.f_code
+                pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{marco.f_lineno})")
+                marco = marco.f_back
+            if pila:
+                self.pilas[';'.join(reversed(pila))] += 1
+
+    def guardar(self, directorio, nombre):
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, nombre)
+        with open(ruta, 'w') as archivo:
+            for pila, muestras in self.pilas.items():
+                archivo.write(f"{pila} {muestras}\n")
+        return ruta
+
+
+# --- integración con Flask ---
+
+def _antes_de_peticion():
+    g.metricas = {'inicio': time.perf_counter(), 'sql_n': 0, 'sql_t': 0.0,
+                  'serializacion': 0.0, 'sentencias': Counter()}
+    if current_app.config['METRICAS_PERFILADOR'] and request.headers.get('X-Perfilar') == '1':
+        g.perfilador = Perfilador(threading.get_ident(), current_app.config['METRICAS_INTERVALO_PERFIL'])
+        g.perfilador.iniciar()
+
+
+def _despues_de_peticion(respuesta):
+    metricas = g.pop('metricas', None)
+    if metricas is None:
+        return respuesta
+    duracion = time.perf_counter() - metricas['inicio']
+    ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+
+    repetidas = [(s, n) for s, n in metricas['sentencias'].items()
+                 if n >= current_app.config['METRICAS_N_MAS_1']]
+    for sentencia, veces in repetidas:
+        registro.n_mas_1 += 1
+        current_app.logger.warning("Posible N+1 en %s: %d ejecuciones de %s", ruta, veces, sentencia)
+
+    perfilador = g.pop('perfilador', None)
+    if perfilador is not None:
+        perfilador.detener()
+        nombre = f"{int(time.time() * 1000)}-{request.endpoint or 'sin_ruta'}.folded"
+        archivo = perfilador.guardar(current_app.config['METRICAS_DIR_PERFILES'], nombre)
+        respuesta.headers['X-Perfil'] = archivo
+
+    tamano = None if respuesta.is_streamed else respuesta.calculate_content_length()
+    registro.registrar(ruta, request.method, respuesta.status_code, duracion, metricas['sql_n'],
+                       metricas['sql_t'], metricas['serializacion'], tamano)
+    respuesta.headers['Server-Timing'] = (f"sql;dur={metricas['sql_t'] * 1000:.1f}, "
+                                          f"json;dur={metricas['serializacion'] * 1000:.1f}, "
+                                          f"total;dur={duracion * 1000:.1f}")
+    return respuesta
+
+
+def exportar():
+    if compartido is not None:
+        lineas = compartido.texto()
+    else:
+        lineas = registro.texto() + _lineas_proceso(estadisticas_proceso())
+    return Response('\n'.join(lineas) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def reiniciar_tras_fork():
+    """El hilo que guarda la copia no pasa al worker: se vuelve a lanzar."""
+    if compartido is not None:
+        compartido.iniciar()
+
+
+def configurar(app):
+    global compartido
+    app.config.setdefault('METRICAS_SQL_LENTA_MS', float(os.environ.get('METRICAS_SQL_LENTA_MS', 200)))
+    app.config.setdefault('METRICAS_N_MAS_1', int(os.environ.get('METRICAS_N_MAS_1', 10)))
+    app.config.setdefault('METRICAS_PERFILADOR', os.environ.get('METRICAS_PERFILADOR', '0') == '1')
+    app.config.setdefault('METRICAS_INTERVALO_PERFIL', float(os.environ.get('METRICAS_INTERVALO_PERFIL', 0.001)))
+    app.config.setdefault('METRICAS_DIR_PERFILES', os.environ.get('METRICAS_DIR_PERFILES', 'perfiles'))
+
+    directorio = os.environ.get('METRICAS_DIR')
+    compartido = Compartido(directorio, float(os.environ.get('METRICAS_INTERVALO', 2))) if directorio else None
+    if compartido is not None:
+        compartido.iniciar()
+
+    app.json = ProveedorJSONMedido(app)
+    app.before_request(_antes_de_peticion)
+    app.after_request(_despues_de_peticion)
+    app.add_url_rule('/metrics', 'metrics', exportar)
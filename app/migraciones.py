@@ -0,0 +1,187 @@
+"""
+Migraciones versionadas del esquema.
+
+La versión aplicada se guarda en la tabla esquema_version. Las migraciones
+pendientes corren juntas en una transacción y cada una debe ser idempotente:
+en una base nueva la migración 1 crea las tablas ya con la forma actual de los
+modelos y las siguientes solo confirman que no hay nada que hacer.
+"""
+from datetime import datetime
+
+import click
+from sqlalchemy import Integer, Text, bindparam, column, func, inspect, select, table, text, update
+
+from .models import db, Consulta, PacienteEspera, EsperaPorHora, ConsultasPorDia, EventoEspera
+from . import busqueda, estadisticas, signos, condicional
+
+# Número arbitrario para el candado de PostgreSQL (evita que dos workers migren a la vez)
+CANDADO_MIGRACIONES = 482015
+LOTE_SIGNOS = 5000
+
+
+def _esquema_inicial(conn):
+    db.metadata.create_all(bind=conn)
+
+
+def _indices_consultas_y_espera(conn):
+    for indice in (*Consulta.__table__.indexes, *PacienteEspera.__table__.indexes):
+        if indice.name in ('ix_consultas_paciente_fecha', 'ix_lista_espera_activos_creado'):
+            indice.create(conn, checkfirst=True)
+
+
+def _indices_busqueda(conn):
+    if conn.dialect.name != 'postgresql':
+        return
+    # Las extensiones pueden requerir permisos de superusuario: si fallan, la búsqueda
+    # usa el índice en memoria y la migración se da por aplicada
+    punto = conn.begin_nested()
+    try:
+        for sentencia in busqueda.SQL_PREPARAR_POSTGRES:
+            conn.execute(text(sentencia))
+        punto.commit()
+    except Exception as e:
+        punto.rollback()
+        print(f"No se pudieron crear los índices de búsqueda: {e}")
+
+
+def _estadisticas_preagregadas(conn):
+    columnas = {c['name'] for c in inspect(conn).get_columns('lista_espera')}
+    if 'ingreso' not in columnas:
+        tipo = PacienteEspera.__table__.c.ingreso.type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE lista_espera ADD COLUMN ingreso {tipo}"))
+    for modelo in (EsperaPorHora, ConsultasPorDia):
+        modelo.__table__.create(conn, checkfirst=True)
+    # El historial de espera anterior no se puede reconstruir (solo se guarda el estado actual);
+    # el de consultas sí
+    if not conn.execute(text("SELECT 1 FROM estadistica_consultas_dia LIMIT 1")).first():
+        estadisticas.reconstruir_consultas(conn)
+
+
+def _bitacora_espera(conn):
+    EventoEspera.__table__.create(conn, checkfirst=True)
+    if conn.execute(text("SELECT 1 FROM eventos_espera LIMIT 1")).first():
+        return
+    # Punto de partida de la bitácora: los pacientes que ya están en la cola
+    espera = PacienteEspera.__table__
+    activos = conn.execute(
+        select(espera.c.id, espera.c.numero_afiliacion, espera.c.area, espera.c.estado,
+               func.coalesce(espera.c.ingreso, espera.c.creado))
+        .where(espera.c.estado.in_(('1', '2'))).order_by(espera.c.id)
+    ).all()
+    eventos = []
+    for id, numero_afiliacion, area, estado, llegada in activos:
+        eventos.append({"espera_id": id, "numero_afiliacion": numero_afiliacion, "tipo": "llegada",
+                        "area": area, "momento": llegada})
+        if estado == '2':
+            # No se sabe cuándo se llamó: se registra en el momento de la migración
+            eventos.append({"espera_id": id, "numero_afiliacion": numero_afiliacion, "tipo": "llamado",
+                            "area": area, "momento": datetime.now()})
+    if eventos:
+        conn.execute(EventoEspera.__table__.insert(), eventos)
+
+
+def _signos_numericos(conn):
+    columnas = {c['name'] for c in inspect(conn).get_columns('consultas')}
+    if 'presion' not in columnas:
+        return  # base nueva: la migración 1 ya creó las columnas numéricas
+    modelo = Consulta.__table__.c
+    # Columnas nuevas con sufijo _num donde el nombre se conserva; al final se renombran
+    nuevas = {c: c if c.startswith('presion_') or c == 'signos_originales' else f'{c}_num'
+              for c in signos.COLUMNAS}
+    for nombre, temporal in nuevas.items():
+        if temporal not in columnas:
+            tipo = modelo[nombre].type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE consultas ADD COLUMN {temporal} {tipo}"))
+
+    anterior = table('consultas', column('id', Integer), *(column(c, Text) for c in signos.CAMPOS))
+    destino = table('consultas', column('id', Integer),
+                    *(column(t, modelo[n].type) for n, t in nuevas.items()))
+    actualizar = update(destino).where(destino.c.id == bindparam('_id'))\
+        .values({t: bindparam(f'_{n}') for n, t in nuevas.items()})
+    ultimo, total = 0, 0
+    while True:
+        filas = conn.execute(
+            select(anterior).where(anterior.c.id > ultimo).order_by(anterior.c.id).limit(LOTE_SIGNOS)
+        ).all()
+        if not filas:
+            break
+        parametros = []
+        for fila in filas:
+            texto = {c: fila._mapping[c] for c in signos.CAMPOS}
+            convertidas = signos.a_columnas(texto)
+            # La conversión debe regresar exactamente el texto guardado
+            if signos.a_texto(dict(convertidas)) != texto:
+                raise RuntimeError(f"Signos de la consulta {fila.id} no convertibles sin pérdida: {texto}")
+            parametros.append({'_id': fila.id, **{f'_{n}': v for n, v in convertidas.items()}})
+        conn.execute(actualizar, parametros)
+        ultimo = filas[-1].id
+        total += len(filas)
+    print(f"Signos vitales convertidos en {total} consultas")
+
+    for campo in signos.CAMPOS:
+        conn.execute(text(f"ALTER TABLE consultas DROP COLUMN {campo}"))
+    for nombre, temporal in nuevas.items():
+        if temporal != nombre:
+            conn.execute(text(f"ALTER TABLE consultas RENAME COLUMN {temporal} TO {nombre}"))
+
+
+def _columnas_version(conn):
+    for tabla in ('pacientes', 'consultas'):
+        if 'version' not in {c['name'] for c in inspect(conn).get_columns(tabla)}:
+            conn.execute(text(f"ALTER TABLE {tabla} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+
+MIGRACIONES = [
+    (1, "Esquema inicial", _esquema_inicial),
+    (2, "Índices de historial por paciente y de lista de espera activa", _indices_consultas_y_espera),
+    (3, "Índices pg_trgm/tsvector para la búsqueda de pacientes", _indices_busqueda),
+    (4, "Tablas de estadísticas por hora (espera) y por día (consultas)", _estadisticas_preagregadas),
+    (5, "Bitácora de transiciones de la lista de espera", _bitacora_espera),
+    (6, "Signos vitales de las consultas en columnas numéricas", _signos_numericos),
+    (7, "Contadores de cambios (versiones_tabla) y sus triggers para los ETags", condicional.preparar),
+    (8, "Columna version en pacientes y consultas (ediciones concurrentes)", _columnas_version),
+    (9, "Contador de ediciones de pacientes para los índices en memoria", condicional.preparar_ediciones),
+]
+VERSION_ACTUAL = MIGRACIONES[-1][0]
+
+
+def version_aplicada(conn):
+    if not inspect(conn).has_table('esquema_version'):
+        return 0
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM esquema_version")).scalar()
+
+
+def migrar():
+    """Aplica las migraciones pendientes. Regresa la lista de versiones aplicadas."""
+    with db.engine.connect() as conn:
+        if version_aplicada(conn) == VERSION_ACTUAL:
+            return []
+
+    aplicadas = []
+    with db.engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": CANDADO_MIGRACIONES})
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS esquema_version ("
+            "version INTEGER PRIMARY KEY, descripcion VARCHAR(200) NOT NULL, aplicada TIMESTAMP NOT NULL)"
+        ))
+        # Se vuelve a leer con el candado tomado: otro worker pudo haber migrado mientras esperábamos
+        actual = version_aplicada(conn)
+        for version, descripcion, funcion in MIGRACIONES:
+            if version <= actual:
+                continue
+            funcion(conn)
+            conn.execute(text("INSERT INTO esquema_version (version, descripcion, aplicada) "
+                              "VALUES (:v, :d, :a)"), {"v": version, "d": descripcion, "a": datetime.now()})
+            print(f"Migración {version} aplicada: {descripcion}")
+            aplicadas.append(version)
+    return aplicadas
+
+
+def registrar_cli(app):
+    @app.cli.command('migrar')
+    def migrar_comando():
+        """Aplica las migraciones pendientes del esquema."""
+        aplicadas = migrar()
+        click.echo(f"Esquema en la versión {VERSION_ACTUAL}" +
+                   (f" (aplicadas: {', '.join(map(str, aplicadas))})" if aplicadas else " (sin cambios)"))
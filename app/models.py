@@ -1,7 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from .replicas import SesionEnrutada
 
-db = SQLAlchemy()
+# La sesión manda las lecturas de los GET a las réplicas si hay (ver app/replicas.py)
+db = SQLAlchemy(session_options={'class_': SesionEnrutada})
 
 class Paciente(db.Model):
     __tablename__ = 'pacientes'
@@ -19,30 +21,94 @@ class Paciente(db.Model):
     alergias = db.Column(db.Text, nullable=True)
     cirugias_previas = db.Column(db.Text, nullable=True)
     medicamentos_actuales = db.Column(db.Text, nullable=True)
+    # Control de concurrencia optimista: cada UPDATE la incrementa y exige la anterior
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
 class Consulta(db.Model):
     __tablename__ = 'consultas'
+    __table_args__ = (
+        # Historial de un paciente ordenado por fecha
+        db.Index('ix_consultas_paciente_fecha', 'paciente_id', 'fecha_consulta'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id'), nullable=False)
     fecha_consulta = db.Column(db.DateTime, nullable=False)
     motivo = db.Column(db.Text, nullable=False)
     sintomas = db.Column(db.Text, nullable=True)
     tiempo_enfermedad = db.Column(db.Text, nullable=True)
-    presion = db.Column(db.String(20), nullable=True)
-    frecuencia_cardiaca = db.Column(db.String(20), nullable=True)
-    frecuencia_respiratoria = db.Column(db.String(20), nullable=True)
-    temperatura = db.Column(db.String(20), nullable=True)
-    peso = db.Column(db.String(20), nullable=True)
-    talla = db.Column(db.String(20), nullable=True)
+    # Signos vitales en columnas numéricas; la API los maneja como texto (ver app/signos.py)
+    presion_sistolica = db.Column(db.SmallInteger, nullable=True)
+    presion_diastolica = db.Column(db.SmallInteger, nullable=True)
+    frecuencia_cardiaca = db.Column(db.SmallInteger, nullable=True)
+    frecuencia_respiratoria = db.Column(db.SmallInteger, nullable=True)
+    temperatura = db.Column(db.Numeric(4, 1), nullable=True)
+    peso = db.Column(db.Numeric(5, 2), nullable=True)
+    talla = db.Column(db.Numeric(5, 2), nullable=True)
+    # Texto recibido que no se reconstruye desde los números: JSON {campo: texto}
+    signos_originales = db.Column(db.Text, nullable=True)
     diagnostico = db.Column(db.Text, nullable=True)
     medicamentos_recetados = db.Column(db.Text, nullable=True)
     observaciones = db.Column(db.Text, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
 class PacienteEspera(db.Model):
     __tablename__ = 'lista_espera'
+    __table_args__ = (
+        # Solo los pacientes activos (en espera o en atención), ordenados por llegada
+        db.Index('ix_lista_espera_activos_creado', 'creado',
+                 postgresql_where=db.text("estado IN ('1', '2')"),
+                 sqlite_where=db.text("estado IN ('1', '2')")),
+    )
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(60), nullable=False)
     numero_afiliacion = db.Column(db.String(8), unique=True, nullable=False)
     creado = db.Column(db.DateTime, nullable=False, default=datetime.now)
     area = db.Column(db.String(15), nullable=True)
-    estado = db.Column(db.String(1), nullable=False)
\ No newline at end of file
+    estado = db.Column(db.String(1), nullable=False)
+    # Hora del último ingreso a la espera (creado se conserva al reingresar)
+    ingreso = db.Column(db.DateTime, nullable=True)
+
+# --- Estadísticas pre-agregadas (se actualizan en la misma transacción que los cambios) ---
+
+class EsperaPorHora(db.Model):
+    __tablename__ = 'estadistica_espera_hora'
+    hora = db.Column(db.DateTime, primary_key=True)
+    area = db.Column(db.String(15), primary_key=True)
+    llegadas = db.Column(db.Integer, nullable=False, default=0)
+    atendidos = db.Column(db.Integer, nullable=False, default=0)
+    abandonos = db.Column(db.Integer, nullable=False, default=0)
+    # Suma de las esperas (llegada -> atención) de los atendidos en esa hora
+    espera_segundos = db.Column(db.Float, nullable=False, default=0)
+
+class ConsultasPorDia(db.Model):
+    __tablename__ = 'estadistica_consultas_dia'
+    dia = db.Column(db.Date, primary_key=True)
+    diagnostico = db.Column(db.String(120), primary_key=True)
+    consultas = db.Column(db.Integer, nullable=False, default=0)
+
+# --- Bitácora de la lista de espera (solo inserciones) ---
+
+class EventoEspera(db.Model):
+    __tablename__ = 'eventos_espera'
+    __table_args__ = (
+        db.Index('ix_eventos_espera_momento', 'momento'),
+    )
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    # Sin llave foránea: la bitácora no debe bloquear ni depender de lista_espera
+    espera_id = db.Column(db.Integer, nullable=False)
+    numero_afiliacion = db.Column(db.String(8), nullable=False)
+    tipo = db.Column(db.String(10), nullable=False)  # llegada, llamado, atendido, retirado
+    area = db.Column(db.String(15), nullable=True)
+    momento = db.Column(db.DateTime, nullable=False)
+
+# --- Contadores de cambios para ETags (los incrementan triggers, ver app/condicional.py) ---
+
+class VersionTabla(db.Model):
+    __tablename__ = 'versiones_tabla'
+    # 'pacientes', 'consultas:<paciente_id>' o 'epoca'
+    clave = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
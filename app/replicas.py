@@ -0,0 +1,223 @@
+"""
+Lecturas en réplicas de la base de datos.
+
+Con DATABASE_REPLICA_URLS (URLs separadas por coma) los SELECT que hace
+db.session durante una petición GET/HEAD se mandan a una réplica; todo lo
+demás va a la primaria (DATABASE_URL):
+
+- escrituras, flush del ORM y SELECT ... FOR UPDATE
+- las sentencias de texto (text()) que no se marcan con
+  execution_options(lectura=True), como las de la búsqueda en PostgreSQL
+- cualquier sentencia de peticiones POST/PUT/PATCH/DELETE
+- el código que usa db.engine directamente (cola de espera, bitácora,
+  arranque, hilos en segundo plano)
+
+Una petición usa una sola réplica para todas sus lecturas (se turnan por
+petición), así el ETag de versiones_tabla y los datos salen de la misma copia.
+
+Leer lo propio: después de una escritura exitosa la respuesta lleva la hora
+hasta la que hay que leer de la primaria (REPLICA_VENTANA segundos, 5 por
+omisión) en la cookie `leer_primaria` y en el encabezado X-Leer-Primaria. Los
+GET que traen cualquiera de los dos se leen de la primaria, así quien acaba
+de editar no ve datos viejos mientras la réplica se pone al día. El front en
+otro origen no manda la cookie (CORS sin credenciales): guarda el encabezado
+de la respuesta y lo repite en sus GET.
+
+Salud: un hilo revisa cada réplica cada REPLICA_INTERVALO segundos (SELECT 1;
+en PostgreSQL además el retraso de replicación, y con más de
+REPLICA_RETRASO_MAXIMO segundos se deja de usar). Un error de conexión la saca
+de la rotación de inmediato y vuelve cuando la revisión pasa. Sin réplicas
+sanas se lee de la primaria.
+
+Para probar en local basta una copia del archivo SQLite (ver
+benchmarks/replicas.py) o docker-compose.replicas.yml con dos PostgreSQL.
+"""
+import itertools
+import math
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import TextClause, create_engine, event, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+COOKIE = 'leer_primaria'
+ENCABEZADO = 'X-Leer-Primaria'
+METODOS_LECTURA = ('GET', 'HEAD')
+
+# En una réplica al día (todo lo recibido ya se aplicó) el retraso es 0 aunque no haya escrituras recientes
+SQL_RETRASO_POSTGRES = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+
+class Replica:
+
+    def __init__(self, url, opciones):
+        self.engine = create_engine(url, **opciones)
+        self.nombre = self.engine.url.render_as_string(hide_password=True)
+        self.sana = True
+        self.retraso = None
+        self.error = None
+        self.lecturas = 0
+        event.listen(self.engine, 'handle_error', self._error)
+
+    def _error(self, contexto):
+        if contexto.is_disconnect or isinstance(contexto.sqlalchemy_exception, OperationalError):
+            self.marcar_caida(contexto.original_exception)
+
+    def marcar_caida(self, error):
+        if self.sana:
+            print(f"Réplica {self.nombre} fuera de rotación: {error}")
+        self.sana = False
+        self.error = str(error)
+
+    def revisar(self, retraso_maximo):
+        try:
+            with self.engine.connect() as conn:
+                if conn.dialect.name == 'postgresql':
+                    retraso = conn.execute(text(SQL_RETRASO_POSTGRES)).scalar()
+                else:
+                    conn.execute(text("SELECT 1"))
+                    retraso = None
+        except DBAPIError as e:
+            self.marcar_caida(e.orig)
+            return
+        self.retraso = None if retraso is None else float(retraso)
+        if self.retraso is not None and self.retraso > retraso_maximo:
+            self.marcar_caida(f"retraso de replicación de {self.retraso:.1f}s")
+            return
+        if not self.sana:
+            print(f"Réplica {self.nombre} de vuelta en rotación")
+        self.sana = True
+        self.error = None
+
+    def resumen(self):
+        return {"url": self.nombre, "sana": self.sana, "retraso": self.retraso,
+                "error": self.error, "lecturas": self.lecturas}
+
+
+class Enrutador:
+
+    def __init__(self):
+        self.replicas = []
+        self.ventana = 5.0
+        self.intervalo = 5.0
+        self.retraso_maximo = 30.0
+        self._turno = itertools.count()
+        self._detener = None
+
+    @property
+    def activo(self):
+        return bool(self.replicas)
+
+    def elegir(self):
+        """Siguiente réplica sana (turno rotativo) o None."""
+        sanas = [r for r in self.replicas if r.sana]
+        if not sanas:
+            return None
+        replica = sanas[next(self._turno) % len(sanas)]
+        replica.lecturas += 1
+        return replica
+
+    def revisar(self):
+        for replica in self.replicas:
+            replica.revisar(self.retraso_maximo)
+
+    def iniciar(self):
+        """Hilo de revisión de salud (uno por proceso)."""
+        if self._detener is not None:
+            self._detener.set()
+        detener = self._detener = threading.Event()
+
+        def bucle():
+            while not detener.wait(self.intervalo):
+                self.revisar()
+
+        threading.Thread(target=bucle, daemon=True, name='replicas-salud').start()
+
+    def reiniciar(self):
+        """Tras un fork: conexiones e hilo propios del worker."""
+        for replica in self.replicas:
+            replica.engine.dispose(close=False)
+        if self.activo:
+            self.iniciar()
+
+    def cerrar(self):
+        if self._detener is not None:
+            self._detener.set()
+            self._detener = None
+        for replica in self.replicas:
+            replica.engine.dispose()
+        self.replicas = []
+
+    def resumen(self):
+        return [r.resumen() for r in self.replicas]
+
+
+enrutador = Enrutador()
+
+
+def leer_primaria():
+    """La petición trae la cookie o el encabezado de una escritura reciente (ventana de leer lo propio)."""
+    hasta = request.headers.get(ENCABEZADO) or request.cookies.get(COOKIE)
+    try:
+        return float(hasta or 0) > time.time()
+    except ValueError:
+        return False
+
+
+def engine_de_lectura():
+    """Engine de la réplica para las lecturas de la petición actual, o None para usar la primaria."""
+    if not enrutador.activo or not has_request_context() or request.method not in METODOS_LECTURA:
+        return None
+    if 'replica' not in g:
+        g.replica = None if leer_primaria() else enrutador.elegir()
+    return g.replica.engine if g.replica is not None else None
+
+
+def _es_lectura(clause):
+    if isinstance(clause, TextClause):
+        # De un texto no se sabe si escribe: solo se manda a la réplica si se marcó como lectura
+        return clause.get_execution_options().get('lectura', False)
+    return clause is not None and getattr(clause, 'is_select', False) \
+        and getattr(clause, '_for_update_arg', None) is None
+
+
+class SesionEnrutada(Session):
+    """Sesión de Flask-SQLAlchemy que manda las lecturas de los GET a una réplica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _es_lectura(clause):
+            engine = engine_de_lectura()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _despues_de_peticion(respuesta):
+    if request.method not in METODOS_LECTURA and respuesta.status_code < 400:
+        hasta = f"{time.time() + enrutador.ventana:.3f}"
+        respuesta.set_cookie(COOKIE, hasta, max_age=math.ceil(enrutador.ventana), httponly=True, samesite='Lax')
+        respuesta.headers[ENCABEZADO] = hasta
+    return respuesta
+
+
+def configurar(app, opciones_pool):
+    """`opciones_pool(url)`: opciones de create_engine para cada réplica (las mismas que la primaria)."""
+    enrutador.cerrar()
+    urls = [u.strip() for u in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+    if not urls:
+        return
+    enrutador.ventana = float(os.environ.get('REPLICA_VENTANA', enrutador.ventana))
+    enrutador.intervalo = float(os.environ.get('REPLICA_INTERVALO', enrutador.intervalo))
+    enrutador.retraso_maximo = float(os.environ.get('REPLICA_RETRASO_MAXIMO', enrutador.retraso_maximo))
+    enrutador.replicas = [Replica(url, opciones_pool(url)) for url in urls]
+    enrutador.revisar()
+    enrutador.iniciar()
+    app.after_request(_despues_de_peticion)
+    sanas = sum(r.sana for r in enrutador.replicas)
+    print(f"Lecturas de los GET en {sanas}/{len(urls)} réplica(s) sanas")
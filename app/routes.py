@@ -1,10 +1,13 @@
-from pickle import GET
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, abort, current_app, request, jsonify, make_response, send_file, stream_with_context, url_for
 from .models import db, Paciente, PacienteEspera
-from . import models
-from datetime import datetime
+from . import models, eventos, busqueda, importacion, cache, serializacion, afiliaciones, estadisticas, signos, condicional, exportacion, limites
+from .cola_espera import cola, TransicionInvalida
+from datetime import date, datetime, time, timedelta
 import pytz
-from sqlalchemy import or_, and_
+import queue
+from sqlalchemy import Float, case, cast, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
 api_bp = Blueprint('api', __name__)
 
@@ -14,13 +17,10 @@ def crear_paciente():
     data = request.get_json()
    
     n_afiliacion = data.get('numero_afiliacion')
-    paciente_existente = Paciente.query.filter_by(numero_afiliacion=n_afiliacion).first()
+    nombre_existente = _nombre_por_afiliacion(n_afiliacion)
 
-    if paciente_existente:
-        return jsonify({
-            "error": "Conflict",
-            "mensaje": f"El número de afiliación {n_afiliacion} ya está registrado a nombre de {paciente_existente.nombre}."
-        }), 409
+    if nombre_existente is not None:
+        return _afiliacion_duplicada(n_afiliacion, nombre_existente)
         
     try:
         fecha_nacimiento = data.get('fecha_nacimiento')
@@ -45,25 +45,115 @@ def crear_paciente():
         )
         db.session.add(nuevo_paciente)
         db.session.commit()
+        afiliaciones.indice.agregar(n_afiliacion)
         return jsonify({"mensaje": "Paciente registrado con éxito", "id": nuevo_paciente.id}), 201
+    except IntegrityError as e:
+        # Otro worker registró el mismo número entre la verificación y el INSERT
+        db.session.rollback()
+        nombre_existente = db.session.scalar(select(Paciente.nombre).where(Paciente.numero_afiliacion == n_afiliacion))
+        if nombre_existente is None:
+            return jsonify({"error": "Error al procesar la fecha o datos", "detalle": str(e)}), 400
+        afiliaciones.indice.agregar(n_afiliacion)
+        return _afiliacion_duplicada(n_afiliacion, nombre_existente)
     except Exception as e:
         return jsonify({"error": "Error al procesar la fecha o datos", "detalle": str(e)}), 400
 
+def _nombre_por_afiliacion(numero_afiliacion):
+    # El filtro descarta sin consultar la base los números que seguro no existen
+    if not afiliaciones.indice.puede_existir(numero_afiliacion):
+        return None
+    return db.session.scalar(select(Paciente.nombre).where(Paciente.numero_afiliacion == numero_afiliacion))
+
+def _afiliacion_duplicada(n_afiliacion, nombre):
+    return jsonify({
+        "error": "Conflict",
+        "mensaje": f"El número de afiliación {n_afiliacion} ya está registrado a nombre de {nombre}."
+    }), 409
+
+#alta masiva de pacientes: cuerpo JSON (arreglo), NDJSON o CSV segun el Content-Type
+@api_bp.route('/pacientes/importar', methods=['POST'])
+@limites.costosa('importar_pacientes', tasa=0.2, rafaga=2)
+def importar_pacientes():
+    formato = importacion.formato_por_tipo(request.mimetype or '')
+    try:
+        filas = list(importacion.importar(importacion.LECTORES[formato](request.stream)))
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": "No se pudo leer el archivo", "detalle": str(e)}), 400
+
+    return jsonify({
+        "resumen": importacion.resumir(filas),
+        "filas": filas
+    }), 200
+
 #ruta para obtener lista de pacientes
+LIMITE_MAXIMO_PACIENTES = 1000
+LOTE_STREAMING = 1000
+
 @api_bp.route('/lista_pacientes', methods=['GET'])
+@limites.costosa('lista_pacientes', tasa=2, rafaga=10)
 def obtener_pacientes():
-    lista_pacientes = Paciente.query.all()
-    resultado = []
-    for p in lista_pacientes:
-        resultado.append({
-            "id": p.id, "nombre": p.nombre, "numero_afiliacion": p.numero_afiliacion,
-            "fecha_nacimiento": p.fecha_nacimiento.strftime('%Y-%m-%d'),
-            "sexo": p.sexo, "tipo_sangre": p.tipo_sangre, "recibe_donaciones": p.recibe_donaciones,
-            "direccion": p.direccion, "celular": p.celular, "contacto_emergencia": p.contacto_emergencia,
-            "enfermedades": p.enfermedades, "alergias": p.alergias, 
-            "cirugias_previas": p.cirugias_previas, "medicamentos_actuales": p.medicamentos_actuales,
-        })
-    return jsonify(resultado)
+    # Parámetros opcionales:
+    #   fields=nombre,numero_afiliacion  -> solo esas columnas (el id siempre se incluye)
+    #   limit=N&after=ID                 -> paginación por cursor sobre el id
+    #   formato=ndjson                   -> respuesta en streaming, un paciente por línea
+    serializador = serializacion.PACIENTE
+    if request.args.get('fields'):
+        pedidos = [c.strip() for c in request.args['fields'].split(',') if c.strip()]
+        invalidos = [c for c in pedidos if c not in serializador.nombres]
+        if invalidos:
+            return jsonify({"error": "Campos inválidos", "campos": invalidos}), 400
+        serializador = serializador.proyeccion(['id'] + pedidos)
+
+    try:
+        limite = request.args.get('limit', type=int) if 'limit' in request.args else None
+        despues_de = int(request.args['after']) if 'after' in request.args else None
+    except ValueError:
+        return jsonify({"error": "'limit' y 'after' deben ser números enteros"}), 400
+    if 'limit' in request.args and (limite is None or limite < 1):
+        return jsonify({"error": "'limit' debe ser un entero mayor a 0"}), 400
+
+    ndjson = request.args.get('formato') == 'ndjson' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+    # Si la tabla no cambió desde la copia del cliente se responde 304 sin consultarla
+    etag = condicional.etag('pacientes', variante='ndjson' if ndjson else 'json')
+    no_modificado = condicional.no_modificado(etag)
+    if no_modificado is not None:
+        return no_modificado
+    respuesta = _lista_pacientes(serializador, limite, despues_de, ndjson)
+    if etag is not None:
+        respuesta.set_etag(etag)
+        respuesta.vary.add('Accept')
+    return respuesta
+
+def _lista_pacientes(serializador, limite, despues_de, ndjson):
+    # Solo se leen las columnas pedidas, sin construir objetos del ORM
+    consulta = db.session.query(*serializador.columnas).order_by(Paciente.id.asc())
+    if despues_de is not None:
+        consulta = consulta.filter(Paciente.id > despues_de)
+
+    if ndjson:
+        if limite is not None:
+            consulta = consulta.limit(limite)
+
+        def generar():
+            # yield_per usa un cursor del lado del servidor: la memoria no crece con la tabla
+            for fila in consulta.yield_per(LOTE_STREAMING):
+                yield current_app.json.dumps(serializador.fila(fila)) + '\n'
+
+        return Response(stream_with_context(generar()), mimetype='application/x-ndjson')
+
+    if limite is None and despues_de is None:
+        # Sin paginación se conserva la respuesta original (lista completa)
+        return jsonify(serializador.filas(consulta.all()))
+
+    limite = min(limite or LIMITE_MAXIMO_PACIENTES, LIMITE_MAXIMO_PACIENTES)
+    filas = consulta.limit(limite + 1).all()
+    hay_mas = len(filas) > limite
+    pacientes = serializador.filas(filas[:limite])
+    return jsonify({
+        "pacientes": pacientes,
+        "siguiente": pacientes[-1]['id'] if hay_mas else None
+    })
 
 #para obtener paciente por numero de afiliacion
 @api_bp.route('/paciente/<numero_afiliacion>', methods=['GET'])
@@ -72,9 +162,13 @@ def obtener_paciente_por_afiliacion(numero_afiliacion):
     Obtiene los datos de un paciente por su número de afiliación
     """
     try:
-        paciente = models.Paciente.query.filter_by(numero_afiliacion=numero_afiliacion).first()
-        
-        
+        paciente = None
+        if afiliaciones.indice.puede_existir(numero_afiliacion):
+            paciente = db.session.execute(
+                select(Paciente.id, Paciente.nombre, Paciente.numero_afiliacion)
+                .where(Paciente.numero_afiliacion == numero_afiliacion)
+            ).first()
+
         if not paciente:
             return jsonify({"error": "Paciente no encontrado"}), 404
         
@@ -87,110 +181,230 @@ def obtener_paciente_por_afiliacion(numero_afiliacion):
     except Exception as e:
         return jsonify({"error": "Error al buscar paciente", "detalle": str(e)}), 500
 
+#edicion parcial de un paciente: solo los campos enviados, con la version que leyo el cliente
+CAMPOS_PACIENTE = ('nombre', 'numero_afiliacion', 'fecha_nacimiento', 'sexo', 'tipo_sangre', 'recibe_donaciones',
+                   'direccion', 'celular', 'contacto_emergencia', 'enfermedades', 'alergias',
+                   'cirugias_previas', 'medicamentos_actuales')
+CAMPOS_BUSQUEDA = ('nombre', 'numero_afiliacion', 'enfermedades', 'alergias')
+
+@api_bp.route('/pacientes/<int:paciente_id>', methods=['PATCH'])
+def editar_paciente(paciente_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Se esperaba un objeto JSON."}), 400
+    version, error = _version_esperada(data)
+    if error:
+        return error
+
+    if not any(campo in data for campo in CAMPOS_PACIENTE):
+        return jsonify({"error": "No hay campos para actualizar."}), 400
+    # Mismas conversiones y validaciones que la importación masiva, solo de los campos enviados
+    valores, errores = importacion.validar_campos(data)
+    if errores:
+        return jsonify({"error": "Datos inválidos", "campos": errores}), 400
+
+    try:
+        fila = _actualizar_con_version(Paciente, paciente_id, version, valores, *(
+            getattr(Paciente, campo) for campo in CAMPOS_BUSQUEDA))
+        if fila is None:
+            return _conflicto_de_version(Paciente, paciente_id)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        n_afiliacion = valores.get('numero_afiliacion')
+        nombre_existente = db.session.scalar(select(Paciente.nombre).where(Paciente.numero_afiliacion == n_afiliacion))
+        if nombre_existente is None:
+            raise
+        return _afiliacion_duplicada(n_afiliacion, nombre_existente)
+
+    if 'nombre' in valores:
+        # El historial en caché lleva el nombre del paciente
+        cache.respuestas.invalidar(cache.clave_consultas(paciente_id))
+    # Los índices de este worker se actualizan ya; los de los demás se rehacen al ver
+    # el contador 'pacientes:ediciones' que sube el trigger (ver app/condicional.py)
+    if 'numero_afiliacion' in valores:
+        afiliaciones.indice.agregar(fila.numero_afiliacion)
+    if not busqueda.usar_postgres and any(campo in valores for campo in CAMPOS_BUSQUEDA):
+        busqueda.indice.actualizar(paciente_id, *(getattr(fila, campo) for campo in CAMPOS_BUSQUEDA))
+    return _con_version({"mensaje": "Paciente actualizado", "version": fila.version}, fila.version)
+
+#ediciones parciales (PATCH): un solo UPDATE de las columnas enviadas, sin leer antes la fila.
+#el cliente manda la version que leyo ("version" en el cuerpo o If-Match con el ETag de
+#GET /consultas/<id> o de la respuesta de la edicion anterior, que es "<version>"); si otro
+#ya la cambio, el UPDATE no toca ninguna fila y se responde 409 en lugar de perder su edicion
+def _version_esperada(data):
+    """(version, None), o (None, respuesta de error) si falta o no es un entero."""
+    valor = data.pop('version', None)
+    if valor is None and request.if_match:
+        valor = next(iter(request.if_match), None)
+        # El ETag puede traer el sufijo que le agrega la compresión ("3-gzip")
+        for codificacion in condicional.CODIFICACIONES:
+            if valor is not None and valor.endswith(f"-{codificacion}"):
+                valor = valor[:-len(codificacion) - 1]
+    if valor is None:
+        return None, (jsonify({"error": "Falta la versión del registro ('version' o encabezado If-Match)."}), 428)
+    try:
+        return int(valor), None
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": f"Versión inválida: {valor}"}), 400)
+
+def _con_version(cuerpo, version):
+    # El ETag es la versión del registro: sirve tal cual en If-Match para la siguiente edición
+    respuesta = jsonify(cuerpo)
+    respuesta.set_etag(str(version))
+    return respuesta
+
+def _actualizar_con_version(modelo, id, version, valores, *devolver):
+    """UPDATE ... WHERE id AND version RETURNING version, *devolver; None si no se actualizó ninguna fila."""
+    tabla = modelo.__table__
+    sentencia = tabla.update().where(tabla.c.id == id, tabla.c.version == version)\
+        .values(dict(valores, version=tabla.c.version + 1))
+    if db.engine.dialect.update_returning:
+        return db.session.execute(sentencia.returning(tabla.c.version, *devolver)).first()
+    if db.session.execute(sentencia).rowcount == 0:
+        return None
+    return db.session.execute(select(tabla.c.version, *devolver).where(tabla.c.id == id)).first()
+
+def _conflicto_de_version(modelo, id):
+    """404 si el registro no existe; si existe, otro lo editó: 409 con la versión actual."""
+    db.session.rollback()
+    actual = db.session.scalar(select(modelo.version).where(modelo.id == id))
+    if actual is None:
+        abort(404)
+    return jsonify({
+        "error": "Conflict",
+        "mensaje": "El registro cambió desde que se leyó; vuelve a cargarlo antes de editarlo.",
+        "version_actual": actual
+    }), 409
+
 #rutas para lista de espera
 @api_bp.route('/crear_paciente_en_espera', methods=['POST'])
 def crear_paciente_en_espera():
     data = request.get_json()
     n_afiliacion = data.get('numero_afiliacion')
-    
-    # Buscamos si el paciente ya tiene un registro en la tabla de espera
-    paciente_existente = PacienteEspera.query.filter_by(numero_afiliacion=n_afiliacion).first()
-
-    if paciente_existente:
-        # ACTUALIZACIÓN: El paciente ya existía, así que "reciclamos" el registro
-        paciente_existente.estado = "1"
-        paciente_existente.nombre = data.get('nombre', paciente_existente.nombre)
-        # Aquí actualizamos el área con el nuevo dato enviado
-        paciente_existente.area = data.get('area', paciente_existente.area)
-        
-        db.session.commit()
-        return jsonify({
-            "mensaje": f"Paciente re-ingresado a {paciente_existente.area}", 
-            "id": paciente_existente.id, 
-            "estado": "re-activado"
-        }), 200
-    else:
-        # CREACIÓN: Es la primera vez que este paciente entra a la tabla de espera
-        nuevo_paciente = PacienteEspera(
-            nombre=data['nombre'],
-            numero_afiliacion=n_afiliacion,
-            area=data['area'],
-            estado="1",
-        )
-        db.session.add(nuevo_paciente)
-        db.session.commit()
+
+    # Si el paciente ya tiene registro en la tabla de espera se "recicla" (estado 1 y nueva área);
+    # si es la primera vez que entra, se crea
+    try:
+        paciente, es_nuevo = cola.ingresar(n_afiliacion, nombre=data.get('nombre'), area=data.get('area'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    _avisar_cambio(paciente)
+
+    if es_nuevo:
         return jsonify({
-            "mensaje": f"Nuevo paciente registrado en {nuevo_paciente.area}", 
-            "id": nuevo_paciente.id, 
+            "mensaje": f"Nuevo paciente registrado en {paciente.area}", 
+            "id": paciente.id, 
             "estado": "nuevo"
         }), 201
+    return jsonify({
+        "mensaje": f"Paciente re-ingresado a {paciente.area}", 
+        "id": paciente.id, 
+        "estado": "re-activado"
+    }), 200
 
 #ruta para obtener lista de pacientes en espera
-@api_bp.route('/lista_pacientes_en_espera', methods=['GET'])
-def obtener_pacientes_en_espera():
-    # 1. Obtener pacientes filtrados (Estado 1 y 2)
-    lista_pacientes = PacienteEspera.query.filter(
-        PacienteEspera.estado.in_(['1', '2'])
-    ).order_by(PacienteEspera.creado.asc()).all()
-    
+def _paciente_espera_a_dict(p):
+    return {
+        "id": p.id,
+        "nombre": p.nombre,
+        "numero_afiliacion": p.numero_afiliacion,
+        "area": p.area,
+        "estado": p.estado,
+        "creado": serializacion.hora_espera(p.creado)
+    }
+
+def _lista_espera(lista_pacientes=None):
+    # 1. Pacientes en estado 1 y 2, ya ordenados por llegada
+    if lista_pacientes is None:
+        lista_pacientes = cola.activos()
+
     # 2. Contar cuántos están SOLO en espera (Estado 1) para el resumen
-    conteo_espera = PacienteEspera.query.filter_by(estado='1').count()
-    
-    tz_hermosillo = pytz.timezone('America/Hermosillo')
-    
-    pacientes_json = []
-    for p in lista_pacientes:
-        if p.creado.tzinfo is None:
-            fecha_utc = p.creado.replace(tzinfo=pytz.utc)
-        else:
-            fecha_utc = p.creado
-
-        fecha_local = fecha_utc.astimezone(tz_hermosillo)
-        fecha_formateada = fecha_local.strftime('%H:%M hrs')
-
-        pacientes_json.append({
-            "id": p.id,
-            "nombre": p.nombre,
-            "numero_afiliacion": p.numero_afiliacion,
-            "area": p.area,
-            "estado": p.estado,
-            "creado": fecha_formateada 
-        })
-        
+    conteo_espera = sum(1 for p in lista_pacientes if p.estado == '1')
+
     # Devolvemos estructura completa
-    return jsonify({
+    return {
         "resumen": {
             "total_espera": conteo_espera
         },
-        "pacientes": pacientes_json
-    })
+        "pacientes": [_paciente_espera_a_dict(p) for p in lista_pacientes]
+    }
+
+def _avisar_cambio(paciente):
+    # Avisamos a las pantallas conectadas por /lista_pacientes_en_espera/eventos
+    eventos.publicar_cambio(_paciente_espera_a_dict(paciente))
+
+@api_bp.route('/lista_pacientes_en_espera', methods=['GET'])
+def obtener_pacientes_en_espera():
+    # La huella de la cola sirve de ETag: cambia con cualquier cambio de la lista
+    if cola.en_memoria:
+        etag, lista_pacientes = cola.huella(), None
+    else:
+        # Sin memoria la lista y su huella salen de la misma lectura
+        lista_pacientes, etag = cola.foto()
+    no_modificado = condicional.no_modificado(etag)
+    if no_modificado is not None:
+        return no_modificado
+    respuesta = jsonify(_lista_espera(lista_pacientes))
+    respuesta.set_etag(etag)
+    return respuesta
+
+#canal en vivo de la lista de espera (Server-Sent Events)
+#primero manda un evento "snapshot" con la lista completa y luego un evento "cambio" por paciente
+@api_bp.route('/lista_pacientes_en_espera/eventos', methods=['GET'])
+@limites.en_vivo('eventos_espera')
+def eventos_pacientes_en_espera():
+    # Nos suscribimos antes de leer la foto para no perder cambios intermedios
+    suscripcion = eventos.broker.suscribir()
+
+    def foto():
+        return eventos.formato_sse('snapshot', _lista_espera())
+
+    def generar():
+        try:
+            yield foto()
+            while True:
+                try:
+                    evento = suscripcion.get(timeout=15)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if evento["tipo"] == "resync":
+                    yield foto()
+                else:
+                    yield eventos.formato_sse(evento["tipo"], evento["paciente"])
+        finally:
+            eventos.broker.desuscribir(suscripcion)
+
+    respuesta = Response(stream_with_context(generar()), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
 
 #ruta para quitar paciente de la lista de espera
 @api_bp.route('/quitar_paciente/<int:id>', methods=['PUT'])
 def quitar_paciente(id):
-    paciente = PacienteEspera.query.get(id)
+    # Cambiamos el estado a 3 (Inactivo/Quitado) sin importar el estado actual
+    paciente = cola.cambiar_estado('3', desde=('1', '2', '3'), id=id)
     if not paciente:
         return jsonify({"error": "Paciente no encontrado"}), 400
 
-    # Cambiamos el estado a 3 (Inactivo/Quitado)
-    paciente.estado = "3"
-    db.session.commit()
+    _avisar_cambio(paciente)
     return jsonify({"mensaje": f"Paciente {paciente.nombre} removido de la lista", "id": paciente.id}), 200
 
 
 #ruta para actualizar estado de paciente en espera
 @api_bp.route('/atender_paciente/<int:id>', methods=['PUT'])
 def atender_paciente(id):
-    paciente = PacienteEspera.query.get(id)
+    try:
+        paciente = cola.cambiar_estado('2', desde=('1',), id=id)
+    except TransicionInvalida:
+        return jsonify({"mensaje": "El paciente ya tenía un estado diferente a 1"}), 400
     if not paciente:
         return jsonify({"error": "Paciente no encontrado"}), 404
 
-    if paciente.estado == "1":
-        paciente.estado = "2"
-        db.session.commit()
-        return jsonify({"mensaje": f"Estado del paciente {paciente.nombre} actualizado a 2", "id": paciente.id, "nuevo_estado": paciente.estado}), 200
-    else:
-        return jsonify({"mensaje": "El paciente ya tenía un estado diferente a 1"}), 400
+    _avisar_cambio(paciente)
+    return jsonify({"mensaje": f"Estado del paciente {paciente.nombre} actualizado a 2", "id": paciente.id, "nuevo_estado": paciente.estado}), 200
     
 #Rutas para consultas
 
@@ -230,12 +444,7 @@ def crear_consulta():
         motivo=motivo,
         sintomas=data.get('sintomas'),
         tiempo_enfermedad=data.get('tiempo_enfermedad'),
-        presion=data.get('presion'), # Recibido desde consultaData en React
-        frecuencia_cardiaca=data.get('frecuencia_cardiaca'),
-        frecuencia_respiratoria=data.get('frecuencia_respiratoria'),
-        temperatura=data.get('temperatura'),
-        peso=data.get('peso'),
-        talla=data.get('talla'),
+        **signos.a_columnas(data), # presion, temperatura, etc. recibidos como texto desde consultaData en React
         diagnostico=data.get('diagnostico'),
         medicamentos_recetados=data.get('medicamentos_recetados'),
         observaciones=data.get('observaciones')
@@ -243,7 +452,9 @@ def crear_consulta():
 
     try:
         db.session.add(nueva_consulta)
+        estadisticas.registrar_consulta(db.session, fecha_dt, nueva_consulta.diagnostico)
         db.session.commit()
+        cache.respuestas.invalidar(cache.clave_consultas(nueva_consulta.paciente_id))
         return jsonify({
             "message": "Consulta creada exitosamente",
             "consulta_id": nueva_consulta.id
@@ -256,96 +467,175 @@ def crear_consulta():
 
 @api_bp.route('/consultas/paciente/<int:paciente_id>', methods=['GET'])
 def consultas_por_paciente(paciente_id):
-    # Zona horaria de Hermosillo
-    sonora_tz = pytz.timezone('America/Hermosillo')
-
-    resultados = db.session.query(models.Consulta, models.Paciente.nombre)\
-        .join(models.Paciente, models.Consulta.paciente_id == models.Paciente.id)\
-        .filter(models.Consulta.paciente_id == paciente_id)\
-        .order_by(models.Consulta.fecha_consulta.desc())\
-        .all()
+    # El ETag sale del contador de cambios del historial (antes de leerlo, para que el
+    # cuerpo nunca sea más viejo que su ETag); con If-None-Match vigente no se lee nada más
+    version = condicional.etag(condicional.clave_historial(paciente_id))
+    no_modificado = condicional.no_modificado(version)
+    if no_modificado is not None:
+        return no_modificado
+
+    # El historial ya serializado se guarda en caché hasta que cambie una consulta del paciente
+    clave = cache.clave_consultas(paciente_id)
+    entrada = cache.respuestas.obtener(clave)
+    if entrada is None or (version is not None and entrada[1] != version):
+        generacion = cache.respuestas.generacion(clave)
+        respuesta = _consultas_por_paciente(paciente_id)
+        if respuesta.status_code != 200:
+            return respuesta
+        entrada = cache.respuestas.guardar(clave, respuesta.get_data(), generacion, version)
+
+    cuerpo, etag = entrada
+    respuesta = Response(cuerpo, mimetype='application/json')
+    respuesta.set_etag(etag)
+    if version is None:
+        return respuesta.make_conditional(request)
+    return respuesta
+
+def _consultas_por_paciente(paciente_id):
+    s = serializacion.CONSULTA_HISTORIAL
+    resultados = db.session.execute(
+        select(*s.columnas)
+        .join(models.Paciente, models.Consulta.paciente_id == models.Paciente.id)
+        .where(models.Consulta.paciente_id == paciente_id)
+        .order_by(models.Consulta.fecha_consulta.desc())
+    ).all()
 
     if not resultados:
-        return jsonify({"message": "No se encontraron consultas para este paciente"}), 404
+        return make_response(jsonify({"message": "No se encontraron consultas para este paciente"}), 404)
+
+    # La fecha se envía con el offset de Sonora: 2024-05-20T14:30:00-07:00
+    return jsonify(s.filas(resultados))
+
+#signos vitales de un paciente en columnas (una lista por signo) para graficar: ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD
+@api_bp.route('/consultas/paciente/<int:paciente_id>/signos', methods=['GET'])
+def signos_por_paciente(paciente_id):
+    c = models.Consulta
+    # La talla puede venir en metros o en centímetros
+    talla_m = case((c.talla > 3, c.talla / 100), else_=c.talla)
+    consulta = select(
+        c.fecha_consulta, c.presion_sistolica, c.presion_diastolica, c.frecuencia_cardiaca,
+        c.frecuencia_respiratoria, cast(c.temperatura, Float), cast(c.peso, Float), cast(c.talla, Float),
+        cast(case((talla_m > 0, c.peso / (talla_m * talla_m))), Float),
+    ).where(c.paciente_id == paciente_id).order_by(c.fecha_consulta)
+    try:
+        desde, hasta = _rango_fechas()
+    except ValueError as e:
+        return jsonify({"error": "Rango de fechas inválido", "detalle": str(e)}), 400
+    if desde:
+        consulta = consulta.where(c.fecha_consulta >= datetime.combine(desde, time()))
+    if hasta:
+        consulta = consulta.where(c.fecha_consulta < datetime.combine(hasta + timedelta(days=1), time()))
+
+    filas = db.session.execute(consulta).all()
+    if not filas and db.session.scalar(select(models.Paciente.id).where(models.Paciente.id == paciente_id)) is None:
+        return jsonify({"error": "Paciente no encontrado"}), 404
 
-    lista_consultas = []
-    for consulta, nombre_paciente in resultados:
-        # 1. Obtener la fecha de la base de datos
-        fecha_db = consulta.fecha_consulta
-        
-        # 2. Si la fecha no tiene zona horaria (naive), le asignamos la de Sonora
-        # Si ya la tiene, la convertimos para asegurar que el offset sea -07:00
-        if fecha_db.tzinfo is None:
-            fecha_local = sonora_tz.localize(fecha_db)
-        else:
-            fecha_local = fecha_db.astimezone(sonora_tz)
-
-        lista_consultas.append({
-            "id": consulta.id,
-            "paciente_id": consulta.paciente_id,
-            "nombre_paciente": nombre_paciente,
-            "fecha_consulta": fecha_local.isoformat(), # Enviará: 2024-05-20T14:30:00-07:00
-            "motivo": consulta.motivo,
-            "sintomas": consulta.sintomas,
-            "tiempo_enfermedad": consulta.tiempo_enfermedad,
-            "presion": consulta.presion,
-            "frecuencia_cardiaca": consulta.frecuencia_cardiaca,
-            "frecuencia_respiratoria": consulta.frecuencia_respiratoria,
-            "temperatura": consulta.temperatura,
-            "peso": consulta.peso,
-            "talla": consulta.talla,
-            "diagnostico": consulta.diagnostico,
-            "medicamentos_recetados": consulta.medicamentos_recetados,
-            "observaciones": consulta.observaciones
-        })
-
-    return jsonify(lista_consultas)
+    series = list(zip(*filas)) or [()] * 9
+    return jsonify({
+        "paciente_id": paciente_id,
+        "fechas": [serializacion.fecha_hora_local(f) for f in series[0]],
+        "presion_sistolica": list(series[1]),
+        "presion_diastolica": list(series[2]),
+        "frecuencia_cardiaca": list(series[3]),
+        "frecuencia_respiratoria": list(series[4]),
+        "temperatura": list(series[5]),
+        "peso": list(series[6]),
+        "talla": list(series[7]),
+        "imc": [round(v, 1) if v is not None else None for v in series[8]],
+    })
 
 #obtener detalles de una consulta
 @api_bp.route('/consultas/<int:consulta_id>', methods=['GET'])
 def obtener_consulta(consulta_id):
-    consulta = models.Consulta.query.get_or_404(consulta_id)
+    s = serializacion.CONSULTA
+    consulta = db.session.execute(
+        select(*s.columnas).where(models.Consulta.id == consulta_id)
+    ).first()
+    if consulta is None:
+        abort(404)
 
-    return jsonify({
-        "id": consulta.id,
-        "paciente_id": consulta.paciente_id,
-        "fecha_consulta": consulta.fecha_consulta.isoformat(),
-        "motivo": consulta.motivo,
-        "sintomas": consulta.sintomas,
-        "tiempo_enfermedad": consulta.tiempo_enfermedad,
-        "presion": consulta.presion,
-        "frecuencia_cardiaca": consulta.frecuencia_cardiaca,
-        "frecuencia_respiratoria": consulta.frecuencia_respiratoria,
-        "temperatura": consulta.temperatura,
-        "peso": consulta.peso,
-        "talla": consulta.talla,
-        "diagnostico": consulta.diagnostico,
-        "medicamentos_recetados": consulta.medicamentos_recetados,
-        "observaciones": consulta.observaciones
-    })
+    datos = s.fila(consulta)
+    return _con_version(datos, datos['version'])
 
 #actualizar una consulta
 @api_bp.route('/consultas/<int:consulta_id>', methods=['PUT'])
 def actualizar_consulta(consulta_id):
     consulta = models.Consulta.query.get_or_404(consulta_id)
     data = request.json
+    # Opcional en PUT: si el cliente manda la versión que leyó, se rechaza la edición sobre una vieja
+    if 'version' in data and data['version'] != consulta.version:
+        return _conflicto_de_version(models.Consulta, consulta_id)
+    diagnostico_anterior = consulta.diagnostico
 
     consulta.motivo = data.get('motivo', consulta.motivo)
     consulta.sintomas = data.get('sintomas', consulta.sintomas)
     consulta.tiempo_enfermedad = data.get('tiempo_enfermedad', consulta.tiempo_enfermedad)
-    consulta.presion = data.get('presion', consulta.presion)
-    consulta.frecuencia_cardiaca = data.get('frecuencia_cardiaca', consulta.frecuencia_cardiaca)
-    consulta.frecuencia_respiratoria = data.get('frecuencia_respiratoria', consulta.frecuencia_respiratoria)
-    consulta.temperatura = data.get('temperatura', consulta.temperatura)
-    consulta.peso = data.get('peso', consulta.peso)
-    consulta.talla = data.get('talla', consulta.talla)
+    for columna, valor in signos.a_columnas(data, consulta.signos_originales).items():
+        setattr(consulta, columna, valor)
     consulta.diagnostico = data.get('diagnostico', consulta.diagnostico)
     consulta.medicamentos_recetados = data.get('medicamentos_recetados', consulta.medicamentos_recetados)
     consulta.observaciones = data.get('observaciones', consulta.observaciones)
 
+    if estadisticas.normalizar_diagnostico(consulta.diagnostico) != estadisticas.normalizar_diagnostico(diagnostico_anterior):
+        estadisticas.registrar_consulta(db.session, consulta.fecha_consulta, diagnostico_anterior, -1)
+        estadisticas.registrar_consulta(db.session, consulta.fecha_consulta, consulta.diagnostico)
+    try:
+        db.session.commit()
+    except StaleDataError:
+        return _conflicto_de_version(models.Consulta, consulta_id)
+    cache.respuestas.invalidar(cache.clave_consultas(consulta.paciente_id))
+
+    return _con_version({"message": "Consulta actualizada", "version": consulta.version}, consulta.version)
+
+#edicion parcial de una consulta; solo si cambia el diagnostico se lee antes la fila (para las estadisticas)
+CAMPOS_CONSULTA = ('motivo', 'sintomas', 'tiempo_enfermedad', 'diagnostico', 'medicamentos_recetados', 'observaciones')
+
+@api_bp.route('/consultas/<int:consulta_id>', methods=['PATCH'])
+def editar_consulta(consulta_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Se esperaba un objeto JSON."}), 400
+    version, error = _version_esperada(data)
+    if error:
+        return error
+
+    c = models.Consulta
+    valores = {campo: data[campo] for campo in CAMPOS_CONSULTA if campo in data}
+    if 'motivo' in valores and not valores['motivo']:
+        return jsonify({"error": "El campo 'motivo' es obligatorio."}), 400
+    columnas, cambios = signos.convertir_campos(data)
+    valores.update(columnas)
+    if cambios:
+        originales = signos.sql_originales(c.signos_originales, cambios, db.engine.dialect.name)
+        if originales is None:
+            # Motor sin funciones JSON: se combina en Python con el valor actual
+            actual = db.session.scalar(select(c.signos_originales).where(c.id == consulta_id))
+            originales = signos.a_columnas(data, actual)['signos_originales']
+        valores['signos_originales'] = originales
+    if not valores:
+        return jsonify({"error": "No hay campos para actualizar."}), 400
+
+    anterior = None
+    if 'diagnostico' in valores:
+        # estadistica_consultas_dia resta el diagnóstico anterior; la fila queda bloqueada hasta el commit
+        anterior = db.session.execute(
+            select(c.fecha_consulta, c.diagnostico)
+            .where(c.id == consulta_id, c.version == version).with_for_update()
+        ).first()
+        if anterior is None:
+            return _conflicto_de_version(c, consulta_id)
+    fila = _actualizar_con_version(c, consulta_id, version, valores, c.paciente_id)
+    if fila is None:
+        return _conflicto_de_version(c, consulta_id)
+
+    if anterior is not None and estadisticas.normalizar_diagnostico(anterior.diagnostico) \
+            != estadisticas.normalizar_diagnostico(valores['diagnostico']):
+        estadisticas.registrar_consulta(db.session, anterior.fecha_consulta, anterior.diagnostico, -1)
+        estadisticas.registrar_consulta(db.session, anterior.fecha_consulta, valores['diagnostico'])
     db.session.commit()
+    cache.respuestas.invalidar(cache.clave_consultas(fila.paciente_id))
 
-    return jsonify({"message": "Consulta actualizada"})
+    return _con_version({"message": "Consulta actualizada", "version": fila.version}, fila.version)
 
 # eliminar una consulta
 @api_bp.route('/consultas/<int:consulta_id>', methods=['DELETE'])
@@ -353,20 +643,107 @@ def eliminar_consulta(consulta_id):
     consulta = models.Consulta.query.get_or_404(consulta_id)
 
     db.session.delete(consulta)
-    db.session.commit()
+    estadisticas.registrar_consulta(db.session, consulta.fecha_consulta, consulta.diagnostico, -1)
+    try:
+        db.session.commit()
+    except StaleDataError:
+        return _conflicto_de_version(models.Consulta, consulta_id)
+    cache.respuestas.invalidar(cache.clave_consultas(consulta.paciente_id))
 
     return jsonify({"message": "Consulta eliminada"})
 
+#exportacion masiva de consultas (CSV, NDJSON o Parquet) en segundo plano, ver app/exportacion.py
+#cuerpo: {"formato": "csv", "desde": "AAAA-MM-DD", "hasta": "AAAA-MM-DD", "area": "..."} (filtros opcionales)
+@api_bp.route('/exportaciones', methods=['POST'])
+# La exportación corre en su propio hilo: solo se limita cuántas se piden
+@limites.costosa('exportaciones', tasa=0.1, rafaga=3, concurrencia=False)
+def crear_exportacion():
+    data = request.get_json(silent=True) or {}
+    try:
+        estado = exportacion.crear(data.get('formato', 'csv'), data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    exportacion.iniciar(current_app._get_current_object(), estado['id'])
+    respuesta = jsonify(exportacion.progreso(estado))
+    respuesta.status_code = 202
+    respuesta.headers['Location'] = url_for('api.estado_exportacion', id=estado['id'])
+    return respuesta
+
+@api_bp.route('/exportaciones/<id>', methods=['GET'])
+def estado_exportacion(id):
+    estado = exportacion.leer_estado(id)
+    if estado is None:
+        abort(404)
+    return jsonify(exportacion.progreso(estado))
+
+@api_bp.route('/exportaciones/<id>/archivo', methods=['GET'])
+def archivo_exportacion(id):
+    estado = exportacion.leer_estado(id)
+    if estado is None:
+        abort(404)
+    if estado['estado'] != 'terminada':
+        return jsonify({"error": "La exportación no ha terminado", **exportacion.progreso(estado)}), 409
+    formato = estado['formato']
+    return send_file(exportacion.ruta(id, formato), mimetype=exportacion.TIPOS[formato],
+                     as_attachment=True, download_name=f"consultas-{id}.{formato}")
+
+#reanuda desde el ultimo punto de control una exportacion interrumpida (error o reinicio del servidor)
+@api_bp.route('/exportaciones/<id>/reanudar', methods=['POST'])
+def reanudar_exportacion(id):
+    estado = exportacion.leer_estado(id)
+    if estado is None:
+        abort(404)
+    if estado['estado'] == 'terminada' or exportacion.en_curso(id):
+        return jsonify({"error": "La exportación ya terminó o sigue en curso", **exportacion.progreso(estado)}), 409
+    exportacion.iniciar(current_app._get_current_object(), id)
+    return jsonify(exportacion.progreso(estado)), 202
+
+#peticiones atendidas, limitadas (429) y rechazadas por saturacion (503) en las rutas costosas
+@api_bp.route('/limites/estadisticas', methods=['GET'])
+def estadisticas_limites():
+    return jsonify(limites.estadisticas())
+
+#contadores de la caché de historiales (aciertos, fallos, expulsiones)
+@api_bp.route('/cache/estadisticas', methods=['GET'])
+def estadisticas_cache():
+    return jsonify(cache.respuestas.estadisticas())
+
+#estadisticas de carga (desde las tablas pre-agregadas): ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD, por omision hoy
+def _rango_fechas():
+    desde = request.args.get('desde')
+    hasta = request.args.get('hasta')
+    return (date.fromisoformat(desde) if desde else None,
+            date.fromisoformat(hasta) if hasta else None)
+
+#pacientes por area y hora, tiempo promedio de espera; ?area= para filtrar
+@api_bp.route('/estadisticas/espera', methods=['GET'])
+def estadisticas_espera():
+    try:
+        desde, hasta = _rango_fechas()
+        return jsonify(estadisticas.espera(desde, hasta, area=request.args.get('area')))
+    except ValueError as e:
+        return jsonify({"error": "Rango de fechas inválido", "detalle": str(e)}), 400
+
+#consultas por dia y diagnosticos mas frecuentes; ?limite= (maximo 100)
+@api_bp.route('/estadisticas/consultas', methods=['GET'])
+def estadisticas_consultas():
+    try:
+        desde, hasta = _rango_fechas()
+        limite = max(1, min(int(request.args.get('limite', 20)), 100))
+        return jsonify(estadisticas.consultas(desde, hasta, limite=limite))
+    except ValueError as e:
+        return jsonify({"error": "Parámetros inválidos", "detalle": str(e)}), 400
+
 #rutas para pacientes
 #buscar nombre de paciente o numero de afiliacion en la tabla pacientes
 @api_bp.route('/paciente_existe/<string:numero_afiliacion>', methods=['GET'])
 def paciente_existe(numero_afiliacion):
-    paciente = Paciente.query.filter_by(numero_afiliacion=numero_afiliacion).first()
     try:
-        if paciente:
+        nombre = _nombre_por_afiliacion(numero_afiliacion)
+        if nombre is not None:
             return jsonify({
                 "existe": True,
-                "nombre": paciente.nombre
+                "nombre": nombre
             }) 
         else:
             return jsonify({"existe": False})
@@ -376,31 +753,43 @@ def paciente_existe(numero_afiliacion):
             "detalle": str(e)
         }), 500
 
+#busqueda con relevancia (sin acentos y tolerante a errores) por nombre, afiliacion
+#y opcionalmente enfermedades/alergias con ?clinico=1
+@api_bp.route('/api/pacientes/buscar', methods=['GET'])
+@limites.costosa('buscar_pacientes', tasa=5, rafaga=20)
+def buscar_pacientes():
+    query_text = request.args.get('q', '').strip()
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    por_pagina = min(max(request.args.get('por_pagina', 20, type=int), 1), 50)
+    clinico = request.args.get('clinico') in ('1', 'true')
+
+    if len(query_text) < 2:
+        return jsonify({"resultados": [], "pagina": pagina, "por_pagina": por_pagina})
+
+    resultados = busqueda.buscar_pacientes(query_text, clinico=clinico, limite=por_pagina,
+                                           desplazamiento=(pagina - 1) * por_pagina)
+    return jsonify({"resultados": resultados, "pagina": pagina, "por_pagina": por_pagina})
+
 @api_bp.route('/api/pacientes/buscar-historial', methods=['GET'])
+@limites.costosa('buscar_historial', tasa=2, rafaga=10)
 def buscar_pacientes_historial():
     query_text = request.args.get('q', '')
     
     if not query_text or len(query_text) < 2:
         return jsonify([])
 
-    # Realizamos la búsqueda con un JOIN
-    resultados = (
-        PacienteEspera.query
-        # 1. Unimos con la tabla Paciente basándonos en el número de afiliación
-        .join(Paciente, PacienteEspera.numero_afiliacion == Paciente.numero_afiliacion)
-        # 2. Aplicamos los filtros
-        .filter(
-            and_(
-                PacienteEspera.estado == '3',
-                or_(
-                    PacienteEspera.numero_afiliacion.ilike(f'%{query_text}%'),
-                    PacienteEspera.nombre.ilike(f'%{query_text}%')
-                )
-            )
-        )
-        .limit(10)
-        .all()
-    )
+    # 1. Buscamos por relevancia solo entre los que ya pasaron por la lista de espera (estado 3)
+    coincidencias = busqueda.buscar_pacientes(query_text, limite=10, atendidos=True)
+    orden = {c['numero_afiliacion']: i for i, c in enumerate(coincidencias)}
+    if not orden:
+        return jsonify([])
+
+    # 2. Sus registros de la lista de espera, en el mismo orden
+    resultados = PacienteEspera.query.filter(
+        PacienteEspera.estado == '3',
+        PacienteEspera.numero_afiliacion.in_(list(orden))
+    ).all()
+    resultados.sort(key=lambda p: orden[p.numero_afiliacion])
 
     return jsonify([{
         'id': p.id,
@@ -408,18 +797,20 @@ def buscar_pacientes_historial():
         'numero_afiliacion': p.numero_afiliacion,
         'area': p.area,
         'estado': p.estado
-    } for p in resultados])
+    } for p in resultados[:10]])
 
 #ruta para quitar paciente de la lista de espera por numero de afiliacion
 @api_bp.route('/quitar_paciente_por_afiliacion/<string:numero_afiliacion>', methods=['PUT'])
 def quitar_paciente_por_afiliacion(numero_afiliacion):
-    paciente = PacienteEspera.query.filter_by(numero_afiliacion=numero_afiliacion, estado='2').first()
+    # Cambiamos el estado a 3 (Inactivo/Quitado), solo si estaba en atención
+    try:
+        paciente = cola.cambiar_estado('3', desde=('2',), numero_afiliacion=numero_afiliacion)
+    except TransicionInvalida:
+        paciente = None
     if not paciente:
         return jsonify({"error": "Paciente no encontrado o no está en estado '2'"}), 404
 
-    # Cambiamos el estado a 3 (Inactivo/Quitado)
-    paciente.estado = "3"
-    db.session.commit()
+    _avisar_cambio(paciente)
     return jsonify({"mensaje": f"Paciente {paciente.nombre} removido de la lista", "id": paciente.id,
     "numero_afiliacion": paciente.numero_afiliacion,
     "estado": paciente.estado
@@ -429,10 +820,11 @@ def quitar_paciente_por_afiliacion(numero_afiliacion):
 #ruta para actualizar estado de paciente en espera por numero de afiliacion
 @api_bp.route('/marcar_paciente/<string:numero_afiliacion>', methods=['PUT'])
 def marcar_paciente(numero_afiliacion):
-    paciente = PacienteEspera.query.filter_by(
-        numero_afiliacion=numero_afiliacion,
-        estado='1'  # En espera
-    ).first()
+    # De "En espera" (1) a "En atención" (2)
+    try:
+        paciente = cola.cambiar_estado('2', desde=('1',), numero_afiliacion=numero_afiliacion)
+    except TransicionInvalida:
+        paciente = None
 
     if not paciente:
         return jsonify({
@@ -440,8 +832,7 @@ def marcar_paciente(numero_afiliacion):
             "mensaje": "Paciente no estaba en espera"
         }), 200
 
-    paciente.estado = '2'  # En atención
-    db.session.commit()
+    _avisar_cambio(paciente)
 
     return jsonify({
         "marcado": True,
@@ -0,0 +1,162 @@
+"""
+Serialización compartida de las respuestas de la API.
+
+Cada Serializador sabe qué columnas seleccionar y cómo convertir la fila
+(tupla) resultante en un diccionario, sin construir objetos del ORM. Los
+formatos de fecha/zona horaria se memorizan porque se repiten mucho (mismas
+consultas, mismas horas de llegada). Si orjson está instalado se usa como
+backend JSON de Flask.
+"""
+import os
+from functools import lru_cache
+
+import pytz
+from flask.json.provider import DefaultJSONProvider
+
+from .models import Paciente, Consulta, PacienteEspera
+from . import signos
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TZ_HERMOSILLO = pytz.timezone('America/Hermosillo')
+
+
+# --- formatos de fecha memorizados ---
+
+@lru_cache(maxsize=65536)
+def fecha(valor):
+    return valor.strftime('%Y-%m-%d')
+
+
+@lru_cache(maxsize=65536)
+def fecha_hora(valor):
+    return valor.isoformat()
+
+
+@lru_cache(maxsize=65536)
+def fecha_hora_local(valor):
+    """Fecha de consulta con el offset de Sonora: 2024-05-20T14:30:00-07:00."""
+    if valor.tzinfo is None:
+        return TZ_HERMOSILLO.localize(valor).isoformat()
+    return valor.astimezone(TZ_HERMOSILLO).isoformat()
+
+
+@lru_cache(maxsize=4096)
+def hora_espera(valor):
+    """Hora de llegada a la lista de espera ('14:30 hrs'); lo guardado sin zona se toma como UTC."""
+    if valor.tzinfo is None:
+        valor = valor.replace(tzinfo=pytz.utc)
+    return valor.astimezone(TZ_HERMOSILLO).strftime('%H:%M hrs')
+
+
+# --- serializadores por modelo ---
+
+class Serializador:
+
+    def __init__(self, campos, posproceso=None):
+        """
+        campos: [(nombre, columna, formato o None)] en el orden del SELECT.
+        posproceso: f(dict) -> dict para campos que salen de varias columnas.
+        """
+        self.campos = list(campos)
+        self.posproceso = posproceso
+        self.nombres = tuple(nombre for nombre, _, _ in self.campos)
+        self.columnas = [columna for _, columna, _ in self.campos]
+        self._formatos = tuple((i, formato) for i, (_, _, formato) in enumerate(self.campos) if formato)
+        self._proyecciones = {}
+
+    def fila(self, fila):
+        if self._formatos:
+            fila = list(fila)
+            for i, formato in self._formatos:
+                if fila[i] is not None:
+                    fila[i] = formato(fila[i])
+        if self.posproceso is not None:
+            return self.posproceso(dict(zip(self.nombres, fila)))
+        return dict(zip(self.nombres, fila))
+
+    def filas(self, filas):
+        return [self.fila(f) for f in filas]
+
+    def proyeccion(self, nombres):
+        """Serializador con solo los campos pedidos (en el orden original)."""
+        nombres = frozenset(nombres)
+        if nombres not in self._proyecciones:
+            self._proyecciones[nombres] = Serializador(
+                (c for c in self.campos if c[0] in nombres), self.posproceso)
+        return self._proyecciones[nombres]
+
+
+def _campos(modelo, nombres, formatos=None):
+    formatos = formatos or {}
+    return [(n, getattr(modelo, n), formatos.get(n)) for n in nombres]
+
+
+# Los signos vitales se seleccionan como columnas numéricas y signos.a_texto los
+# regresa al texto de la API
+CAMPOS_CLINICOS_CONSULTA = (
+    'motivo', 'sintomas', 'tiempo_enfermedad', *signos.COLUMNAS, 'diagnostico',
+    'medicamentos_recetados', 'observaciones', 'version',
+)
+
+PACIENTE = Serializador(_campos(Paciente, (
+    'id', 'nombre', 'numero_afiliacion', 'fecha_nacimiento', 'sexo', 'tipo_sangre',
+    'recibe_donaciones', 'direccion', 'celular', 'contacto_emergencia',
+    'enfermedades', 'alergias', 'cirugias_previas', 'medicamentos_actuales', 'version',
+), {'fecha_nacimiento': fecha}))
+
+CONSULTA = Serializador(
+    _campos(Consulta, ('id', 'paciente_id', 'fecha_consulta') + CAMPOS_CLINICOS_CONSULTA,
+            {'fecha_consulta': fecha_hora}),
+    posproceso=signos.a_texto,
+)
+
+# Historial de un paciente: incluye su nombre y la fecha en hora de Sonora
+CONSULTA_HISTORIAL = Serializador(
+    _campos(Consulta, ('id', 'paciente_id')) +
+    [('nombre_paciente', Paciente.nombre, None)] +
+    _campos(Consulta, ('fecha_consulta',) + CAMPOS_CLINICOS_CONSULTA,
+            {'fecha_consulta': fecha_hora_local}),
+    posproceso=signos.a_texto,
+)
+
+# Exportación masiva (app/exportacion.py): la consulta con los datos del paciente y su área en la lista de espera
+CONSULTA_EXPORTACION = Serializador(
+    _campos(Consulta, ('id', 'paciente_id')) +
+    [('numero_afiliacion', Paciente.numero_afiliacion, None), ('nombre_paciente', Paciente.nombre, None),
+     ('fecha_nacimiento', Paciente.fecha_nacimiento, fecha), ('sexo', Paciente.sexo, None),
+     ('tipo_sangre', Paciente.tipo_sangre, None), ('area', PacienteEspera.area, None)] +
+    _campos(Consulta, ('fecha_consulta',) + CAMPOS_CLINICOS_CONSULTA,
+            {'fecha_consulta': fecha_hora_local}),
+    posproceso=signos.a_texto,
+)
+
+
+# --- backend JSON ---
+
+class ProveedorJSONRapido(DefaultJSONProvider):
+    """Usa orjson cuando está disponible (JSON_BACKEND=orjson|stdlib, por omisión el más rápido)."""
+
+    usar_orjson = orjson is not None and os.environ.get('JSON_BACKEND', 'orjson') == 'orjson'
+
+    def dumps(self, obj, **kwargs):
+        if self.usar_orjson and not kwargs:
+            return self._orjson(obj).decode()
+        return super().dumps(obj, **kwargs)
+
+    def dumps_bytes(self, obj):
+        if self.usar_orjson:
+            return self._orjson(obj)
+        return DefaultJSONProvider.dumps(self, obj).encode()
+
+    def _orjson(self, obj):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+    def response(self, *args, **kwargs):
+        if not self.usar_orjson:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
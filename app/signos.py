@@ -0,0 +1,162 @@
+"""
+Signos vitales de las consultas: texto de la API <-> columnas numéricas.
+
+La API recibe y regresa los signos como texto ("120/80", "36.5", "1.70"). En
+la tabla se guardan como números (la presión en sistólica y diastólica) para
+poder filtrarlos, graficarlos y ocupar menos espacio. Cuando el texto recibido
+no se puede reconstruir exactamente desde el número ("37.0", "120 / 80",
+"normal", un valor fuera de rango) se guarda además el texto original en
+signos_originales (JSON {campo: texto}), así que la conversión nunca pierde
+información y la API regresa lo mismo que se le envió.
+"""
+import json
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from sqlalchemy import Text, cast, func
+
+CAMPOS = ('presion', 'frecuencia_cardiaca', 'frecuencia_respiratoria', 'temperatura', 'peso', 'talla')
+
+# Columnas de la tabla consultas, en el orden del SELECT de los serializadores
+COLUMNAS = ('presion_sistolica', 'presion_diastolica', 'frecuencia_cardiaca', 'frecuencia_respiratoria',
+            'temperatura', 'peso', 'talla', 'signos_originales')
+
+# Rangos aceptados; fuera de ellos el valor se guarda solo como texto
+ENTEROS = {
+    'presion_sistolica': (20, 350),
+    'presion_diastolica': (10, 250),
+    'frecuencia_cardiaca': (10, 350),
+    'frecuencia_respiratoria': (1, 150),
+}
+DECIMALES = {
+    # campo: (mínimo, máximo, decimales); la talla admite metros o centímetros
+    'temperatura': (Decimal('20'), Decimal('46'), 1),
+    'peso': (Decimal('0'), Decimal('700'), 2),
+    'talla': (Decimal('0'), Decimal('300'), 2),
+}
+
+_PRESION = re.compile(r'(\d+)\s*/\s*(\d+)')
+_NUMERO = re.compile(r'-?\d+(?:[.,]\d+)?')
+
+
+def _entero(texto, campo):
+    minimo, maximo = ENTEROS[campo]
+    try:
+        valor = int(texto)
+    except ValueError:
+        return None
+    return valor if minimo <= valor <= maximo else None
+
+
+def _decimal(texto, campo):
+    minimo, maximo, decimales = DECIMALES[campo]
+    try:
+        valor = Decimal(texto.replace(',', '.')).quantize(Decimal(1).scaleb(-decimales), ROUND_HALF_UP)
+    except InvalidOperation:
+        return None
+    return valor if minimo <= valor <= maximo else None
+
+
+def _texto_decimal(valor):
+    # 36.50 -> "36.5", 70.00 -> "70"
+    return format(Decimal(valor).normalize(), 'f')
+
+
+def convertir(campo, texto):
+    """Columnas numéricas de un signo a partir de su texto: {columna: valor o None}."""
+    if campo == 'presion':
+        coincidencia = _PRESION.search(texto)
+        sistolica = _entero(coincidencia.group(1), 'presion_sistolica') if coincidencia else None
+        diastolica = _entero(coincidencia.group(2), 'presion_diastolica') if coincidencia else None
+        if sistolica is None or diastolica is None:
+            sistolica = diastolica = None
+        return {'presion_sistolica': sistolica, 'presion_diastolica': diastolica}
+    coincidencia = _NUMERO.search(texto)
+    if coincidencia is None:
+        return {campo: None}
+    if campo in ENTEROS:
+        numero = coincidencia.group()
+        return {campo: _entero(numero, campo) if numero.isdigit() else None}
+    return {campo: _decimal(coincidencia.group(), campo)}
+
+
+def texto(campo, columnas):
+    """Texto canónico de un signo a partir de sus columnas (o None si no hay valor)."""
+    if campo == 'presion':
+        sistolica, diastolica = columnas.get('presion_sistolica'), columnas.get('presion_diastolica')
+        return f"{sistolica}/{diastolica}" if sistolica is not None and diastolica is not None else None
+    valor = columnas.get(campo)
+    if valor is None:
+        return None
+    return str(valor) if campo in ENTEROS else _texto_decimal(valor)
+
+
+def convertir_campos(data):
+    """
+    Columnas numéricas de los signos presentes en `data` (el JSON de la petición) y
+    los cambios a signos_originales: {campo: texto a guardar, o None para quitarlo}.
+    """
+    columnas, cambios = {}, {}
+    for campo in CAMPOS:
+        if campo not in data:
+            continue
+        valor = data[campo]
+        if valor is None:
+            columnas.update(convertir(campo, ''))
+            cambios[campo] = None
+            continue
+        valor = valor if isinstance(valor, str) else str(valor)
+        convertidas = convertir(campo, valor)
+        columnas.update(convertidas)
+        cambios[campo] = valor if texto(campo, convertidas) != valor else None
+    return columnas, cambios
+
+
+def a_columnas(data, originales=None):
+    """
+    Columnas a guardar para los signos presentes en `data` (el JSON de la petición).
+    `originales` es el signos_originales actual de la consulta (al editar). Los campos
+    que no vienen en `data` no se tocan; si no viene ninguno regresa {}.
+    """
+    columnas, cambios = convertir_campos(data)
+    if not cambios:
+        return {}
+    originales = json.loads(originales) if originales else {}
+    for campo, valor in cambios.items():
+        originales.pop(campo, None)
+        if valor is not None:
+            originales[campo] = valor
+    columnas['signos_originales'] = json.dumps(originales, ensure_ascii=False, sort_keys=True) \
+        if originales else None
+    return columnas
+
+
+def sql_originales(columna, cambios, dialecto):
+    """
+    Expresión SQL que aplica `cambios` a signos_originales sin leer la fila (para
+    UPDATE parciales). None si el motor no tiene funciones JSON conocidas.
+    """
+    poner = json.dumps({c: v for c, v in cambios.items() if v is not None}, ensure_ascii=False)
+    if dialecto == 'sqlite':
+        # json_patch (RFC 7396): las llaves con null se borran
+        return func.nullif(func.json_patch(func.coalesce(columna, '{}'),
+                                           json.dumps(cambios, ensure_ascii=False)), '{}')
+    if dialecto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+
+        actual = cast(func.coalesce(columna, '{}'), JSONB)
+        resultado = actual.op('-')(cast(list(cambios), ARRAY(Text))).op('||')(cast(poner, JSONB))
+        return func.nullif(cast(resultado, Text), '{}')
+    return None
+
+
+def a_texto(fila):
+    """Posproceso de los serializadores: cambia las columnas numéricas por los campos de texto de la API."""
+    if 'signos_originales' not in fila:
+        return fila
+    originales = fila.pop('signos_originales')
+    originales = json.loads(originales) if originales else {}
+    for campo in CAMPOS:
+        fila[campo] = originales[campo] if campo in originales else texto(campo, fila)
+    del fila['presion_sistolica'], fila['presion_diastolica']
+    return fila
@@ -0,0 +1 @@
+"""Scripts de medición de rendimiento de la API (se ejecutan con python -m benchmarks.<nombre>)."""
@@ -0,0 +1,81 @@
+"""
+Mide el filtro de números de afiliación (app/afiliaciones.py): búsquedas por
+segundo, tasa real de falsos positivos y memoria por millón de números,
+comparado con un set de Python y un arreglo ordenado con bisect.
+
+    python -m benchmarks.afiliaciones --elementos 1000000
+
+No usa la base de datos: los números se generan con el formato de 8 dígitos.
+"""
+import argparse
+import bisect
+import random
+import sys
+import time
+
+from app.afiliaciones import IndiceAfiliaciones
+
+
+def medir(funcion, valores):
+    inicio = time.perf_counter()
+    for v in valores:
+        funcion(v)
+    return len(valores) / (time.perf_counter() - inicio)
+
+
+def tamano_set(conjunto):
+    return sys.getsizeof(conjunto) + sum(sys.getsizeof(v) for v in conjunto)
+
+
+def tamano_lista(lista):
+    return sys.getsizeof(lista) + sum(sys.getsizeof(v) for v in lista)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--elementos', type=int, default=1000000)
+    parser.add_argument('--busquedas', type=int, default=200000)
+    args = parser.parse_args()
+
+    aleatorio = random.Random(12)
+    registrados = [f'{n:08d}' for n in aleatorio.sample(range(0, 50000000), args.elementos)]
+    conjunto = set(registrados)
+    nuevos = [f'{aleatorio.randrange(50000000, 100000000):08d}' for _ in range(args.busquedas)]
+    existentes = aleatorio.sample(registrados, min(args.busquedas, args.elementos))
+
+    indice = IndiceAfiliaciones()
+    inicio = time.perf_counter()
+    indice.reiniciar(2 * args.elementos)  # como cargar(), que dimensiona con el conteo de pacientes
+    for numero in registrados:
+        indice.agregar(numero)
+    carga = time.perf_counter() - inicio
+    indice.cargado = True
+
+    ordenados = sorted(registrados)
+
+    def en_ordenados(v):
+        i = bisect.bisect_left(ordenados, v)
+        return i < len(ordenados) and ordenados[i] == v
+
+    def filtro(v):
+        return indice.puede_existir(v, sincronizar=False)
+
+    falsos = sum(filtro(v) for v in nuevos)
+    estadisticas = indice.estadisticas()
+    por_millon = 1000000 / args.elementos
+
+    print(f"{args.elementos} números registrados; carga del filtro en {carga:.2f}s "
+          f"({args.elementos / carga:,.0f} altas/s)")
+    print(f"falsos positivos: {falsos / len(nuevos):.2%} ({estadisticas['filtros']} filtros)")
+    print(f"{'estructura':<18} {'ausentes/s':>12} {'presentes/s':>12} {'MB por millón':>14}")
+    for nombre, funcion, tamano in (
+        ('filtro de Bloom', filtro, estadisticas['bytes']),
+        ('arreglo ordenado', en_ordenados, tamano_lista(ordenados)),
+        ('set', conjunto.__contains__, tamano_set(conjunto)),
+    ):
+        print(f"{nombre:<18} {medir(funcion, nuevos):>12,.0f} {medir(funcion, existentes):>12,.0f} "
+              f"{tamano * por_millon / 2 ** 20:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
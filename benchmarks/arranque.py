@@ -0,0 +1,76 @@
+"""
+Tiempo de arranque en frío con la base ya disponible y migrada: cada medición
+es un intérprete nuevo que importa run.py (create_app completo) y consulta
+/readyz. Falla (código 1) si la mediana pasa de --objetivo segundos.
+
+    python -m benchmarks.arranque --pacientes 20000 --veces 5
+    DATABASE_URL=postgresql://... python -m benchmarks.arranque --veces 10
+
+Sin DATABASE_URL usa una base SQLite temporal sembrada con benchmarks.datos.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from .carga_wsgi import RAIZ
+
+MEDIR = """
+import json, time
+inicio = time.perf_counter()
+from run import app
+creada = time.perf_counter()
+listo = app.test_client().get('/readyz')
+print(json.dumps({"proceso": creada - inicio, "estado": listo.status_code, "readyz": listo.get_json()}))
+"""
+
+
+def sembrar(pacientes):
+    from app import create_app
+    from app.models import db
+    from .datos import sembrar as sembrar_datos
+
+    app = create_app()
+    with app.app_context():
+        sembrar_datos(db, pacientes)
+
+
+def medir_una_vez():
+    inicio = time.perf_counter()
+    salida = subprocess.run([sys.executable, '-c', MEDIR], cwd=RAIZ, capture_output=True, text=True,
+                            env=os.environ, check=True)
+    resultado = json.loads(salida.stdout.strip().splitlines()[-1])
+    resultado['total'] = time.perf_counter() - inicio
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pacientes', type=int, default=20000)
+    parser.add_argument('--veces', type=int, default=5)
+    parser.add_argument('--objetivo', type=float, default=1.0, help='Segundos máximos (mediana).')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'arranque.db')
+    # La primera vez migra y siembra; no cuenta como arranque en frío
+    sembrar(args.pacientes)
+
+    resultados = [medir_una_vez() for _ in range(args.veces)]
+    print(f"{'#':>3} {'proceso s':>10} {'import+app s':>13}  pasos (s)")
+    for i, r in enumerate(resultados, 1):
+        pasos = ' '.join(f"{k}={v:.3f}" for k, v in r['readyz']['pasos'].items())
+        print(f"{i:>3} {r['total']:>10.3f} {r['proceso']:>13.3f}  {pasos}  /readyz {r['estado']}")
+    # Desde que arranca el intérprete hasta que /readyz responde
+    tiempos = sorted(r['total'] for r in resultados)
+    mediana = tiempos[len(tiempos) // 2]
+    print(f"mediana {mediana:.3f}s, máximo {tiempos[-1]:.3f}s (objetivo {args.objetivo:.1f}s)")
+    if mediana > args.objetivo or any(r['estado'] != 200 for r in resultados):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compara el throughput del modo síncrono (gunicorn + Flask) contra el modo
+asíncrono (uvicorn + app.asgi) con muchas peticiones concurrentes.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.async_vs_sync --workers 2 --concurrencia 64,256 \\
+        --ruta /consultas/paciente/1
+
+Ambos modos se levantan con el mismo número de workers; en el síncrono cada
+worker tiene --threads hilos. La ruta debe ser una de las que app.asgi atiende
+de forma asíncrona (las demás pasan por Flask en los dos modos).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from .carga_wsgi import RAIZ, esperar_servidor, golpear
+
+
+def comando(modo, args):
+    if modo == 'sync':
+        return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app']
+    return [sys.executable, '-m', 'uvicorn', 'app.asgi:aplicacion', '--host', '127.0.0.1',
+            '--port', str(args.puerto), '--workers', str(args.workers), '--no-access-log']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ruta', default='/paciente_existe/00000001')
+    parser.add_argument('--segundos', type=int, default=10)
+    parser.add_argument('--concurrencia', default='16,64,256')
+    parser.add_argument('--puerto', type=int, default=5056)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.puerto}{args.ruta}"
+    entorno = dict(os.environ, WEB_CONCURRENCY=str(args.workers), GUNICORN_THREADS=str(args.threads),
+                   GUNICORN_BIND=f"127.0.0.1:{args.puerto}", GUNICORN_ACCESSLOG='')
+    print(f"{'modo':>6} {'clientes':>9} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errores':>8}")
+    for modo in ('sync', 'async'):
+        servidor = subprocess.Popen(comando(modo, args), cwd=RAIZ, env=entorno,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            esperar_servidor(url)
+            for concurrencia in [int(c) for c in args.concurrencia.split(',')]:
+                latencias, errores = golpear(url, args.segundos, concurrencia)
+                if not latencias:
+                    print(f"{modo:>6} {concurrencia:>9} {'-':>10} {'-':>8} {'-':>8} {errores:>8}")
+                    continue
+                cuantiles = statistics.quantiles(latencias, n=100)
+                print(f"{modo:>6} {concurrencia:>9} {len(latencias) / args.segundos:>10.1f} "
+                      f"{cuantiles[49] * 1000:>8.1f} {cuantiles[98] * 1000:>8.1f} {errores:>8}")
+        finally:
+            servidor.terminate()
+            servidor.wait()
+
+
+if __name__ == '__main__':
+    main()
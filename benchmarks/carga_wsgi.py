@@ -0,0 +1,91 @@
+"""
+Mide cómo escala el throughput de gunicorn con el número de workers.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.carga_wsgi --workers 1,2,4,8 --ruta /lista_pacientes_en_espera
+
+Por cada número de workers levanta gunicorn con gunicorn.conf.py, lanza
+--concurrencia clientes durante --segundos y reporta peticiones/s y latencias.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def esperar_servidor(url, limite=30):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError(f"El servidor no respondió en {limite}s")
+
+
+def golpear(url, segundos, concurrencia):
+    latencias = []
+    errores = [0]
+    lock = threading.Lock()
+    fin = time.monotonic() + segundos
+
+    def cliente():
+        propias = []
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            try:
+                urllib.request.urlopen(url, timeout=10).read()
+                propias.append(time.perf_counter() - inicio)
+            except Exception:
+                with lock:
+                    errores[0] += 1
+        with lock:
+            latencias.extend(propias)
+
+    hilos = [threading.Thread(target=cliente) for _ in range(concurrencia)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return latencias, errores[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default=','.join(str(2 ** i) for i in range(4) if 2 ** i <= os.cpu_count()))
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ruta', default='/lista_pacientes_en_espera')
+    parser.add_argument('--segundos', type=int, default=10)
+    parser.add_argument('--concurrencia', type=int, default=32)
+    parser.add_argument('--puerto', type=int, default=5055)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.puerto}{args.ruta}"
+    print(f"{'workers':>8} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errores':>8}")
+    for workers in [int(w) for w in args.workers.split(',')]:
+        entorno = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(args.threads),
+                       GUNICORN_BIND=f"127.0.0.1:{args.puerto}", GUNICORN_ACCESSLOG='')
+        servidor = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+                                    cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            esperar_servidor(url)
+            latencias, errores = golpear(url, args.segundos, args.concurrencia)
+        finally:
+            servidor.terminate()
+            servidor.wait()
+        if not latencias:
+            print(f"{workers:>8} {'-':>10} {'-':>8} {'-':>8} {errores:>8}")
+            continue
+        cuantiles = statistics.quantiles(latencias, n=100)
+        print(f"{workers:>8} {len(latencias) / args.segundos:>10.1f} {cuantiles[49] * 1000:>8.1f} "
+              f"{cuantiles[98] * 1000:>8.1f} {errores:>8}")
+
+
+if __name__ == '__main__':
+    main()
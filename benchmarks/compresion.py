@@ -0,0 +1,65 @@
+"""
+Bytes enviados y tiempo de servidor de /lista_pacientes y del historial más
+largo: sin compresión, gzip y brotli, y la respuesta 304 con If-None-Match.
+
+    python -m benchmarks.compresion --pacientes 20000 --repeticiones 20
+
+Corre dentro del proceso (cliente de pruebas de Flask) sobre una base SQLite
+temporal sembrada con benchmarks.datos, o sobre DATABASE_URL si se indica
+--url-base.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+
+def medir(cliente, ruta, encabezados, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        respuesta = cliente.get(ruta, headers=encabezados)
+        datos = respuesta.get_data()
+        tiempos.append(time.perf_counter() - inicio)
+    return respuesta, len(datos), sorted(tiempos)[len(tiempos) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pacientes', type=int, default=20000)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--url-base', default=None, help='Base ya sembrada (por omisión, SQLite temporal).')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.url_base or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    from sqlalchemy import func, select
+
+    from app import compresion, create_app
+    from app.models import db, Consulta
+    from .datos import sembrar
+
+    app = create_app()
+    with app.app_context():
+        sembrar(db, args.pacientes)
+        paciente = db.session.execute(
+            select(Consulta.paciente_id).group_by(Consulta.paciente_id)
+            .order_by(func.count().desc()).limit(1)).scalar()
+
+    cliente = app.test_client()
+    print(f"brotli: {'sí' if compresion.brotli else 'no instalado'}; umbral {compresion.umbral} bytes")
+    print(f"{'ruta':<34} {'codificación':<14} {'bytes':>10} {'mediana ms':>11}")
+    for ruta in ('/lista_pacientes', f'/consultas/paciente/{paciente}'):
+        for nombre, encabezados in (('identity', {}), ('gzip', {'Accept-Encoding': 'gzip'}),
+                                    ('br', {'Accept-Encoding': 'br'})):
+            if nombre == 'br' and not compresion.brotli:
+                continue
+            respuesta, tamano, mediana = medir(cliente, ruta, encabezados, args.repeticiones)
+            print(f"{ruta:<34} {nombre:<14} {tamano:>10} {mediana * 1000:>11.2f}")
+        condicional = dict(encabezados, **{'If-None-Match': respuesta.headers['ETag']})
+        respuesta, tamano, mediana = medir(cliente, ruta, condicional, args.repeticiones)
+        print(f"{ruta:<34} {'304 (' + nombre + ')':<14} {tamano:>10} {mediana * 1000:>11.2f}"
+              f"{'' if respuesta.status_code == 304 else '  (no regresó 304)'}")
+
+
+if __name__ == '__main__':
+    main()
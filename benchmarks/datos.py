@@ -0,0 +1,174 @@
+"""
+Generador de datos sintéticos de la clínica (pacientes, consultas y lista de espera).
+
+    DATABASE_URL=postgresql://... python -m benchmarks.datos --pacientes 1000000 --consultas 5
+
+Pensado para escalas de 10 mil a 5 millones de filas. Los números de
+afiliación son una función del número de paciente (ver `afiliacion`) para que
+los scripts de tráfico puedan elegir pacientes existentes sin leer la base. Al
+terminar recalcula las estadísticas de consultas y ejecuta ANALYZE.
+"""
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, insert, select, text
+
+from app import signos
+
+LOTE = 5000
+AREAS = ('General', 'Dental', 'Urgencias', 'Pediatría', 'Ginecología', 'Nutrición')
+NOMBRES = ('María', 'José', 'Juan', 'Guadalupe', 'Francisco', 'Ana', 'Luis', 'Rosa', 'Jesús', 'Sofía',
+           'Carlos', 'Lucía', 'Miguel', 'Fernanda', 'Héctor', 'Ramón', 'Valeria', 'Andrés', 'Martín', 'Itzel')
+APELLIDOS = ('Hernández', 'García', 'Martínez', 'López', 'González', 'Pérez', 'Rodríguez', 'Sánchez',
+             'Ramírez', 'Cruz', 'Flores', 'Gómez', 'Morales', 'Vázquez', 'Reyes', 'Jiménez', 'Torres',
+             'Díaz', 'Gutiérrez', 'Ruiz', 'Valenzuela', 'Encinas', 'Moreno', 'Quiroz', 'Ibarra')
+TIPOS_SANGRE = (('O+', 55), ('A+', 25), ('B+', 9), ('O-', 4), ('AB+', 3), ('A-', 2), ('B-', 1), ('AB-', 1))
+ENFERMEDADES = ('Diabetes tipo 2', 'Hipertensión', 'Asma', 'Hipotiroidismo', 'Migraña', 'Artritis')
+ALERGIAS = ('Penicilina', 'Sulfas', 'Polen', 'Mariscos', 'Ácaros', 'Aspirina')
+MOTIVOS = ('Control', 'Dolor de cabeza', 'Fiebre', 'Tos', 'Dolor abdominal', 'Revisión de resultados',
+           'Chequeo general', 'Dolor de garganta', 'Curación', 'Control prenatal')
+DIAGNOSTICOS = ('Infección respiratoria aguda', 'Faringitis', 'Gastroenteritis', 'Hipertensión controlada',
+                'Diabetes controlada', 'Cefalea tensional', 'Lumbalgia', 'Infección urinaria', 'Sano',
+                'Dermatitis', 'Conjuntivitis', 'Otitis media')
+MEDICAMENTOS = ('Paracetamol 500 mg', 'Ibuprofeno 400 mg', 'Amoxicilina 500 mg', 'Metformina 850 mg',
+                'Losartán 50 mg', 'Omeprazol 20 mg', None)
+
+
+def afiliacion(numero):
+    """Número de afiliación de 8 dígitos del paciente `numero` (biyectiva para numero < 10^8)."""
+    return f'{numero * 7919 % 100000000:08d}'
+
+
+def _paciente(aleatorio, numero):
+    nombre = f"{aleatorio.choice(NOMBRES)} {aleatorio.choice(APELLIDOS)} {aleatorio.choice(APELLIDOS)}"
+    return {
+        'nombre': nombre[:60], 'numero_afiliacion': afiliacion(numero),
+        'fecha_nacimiento': date(1940, 1, 1) + timedelta(days=aleatorio.randrange(30000)),
+        'sexo': aleatorio.choice(('Femenino', 'Masculino')),
+        'tipo_sangre': aleatorio.choices([t for t, _ in TIPOS_SANGRE], [p for _, p in TIPOS_SANGRE])[0],
+        'recibe_donaciones': aleatorio.random() < 0.3,
+        'direccion': f"Calle {aleatorio.randrange(1, 200)} #{aleatorio.randrange(1, 3000)}, Hermosillo",
+        'celular': f"662{aleatorio.randrange(10 ** 7):07d}",
+        'contacto_emergencia': f"662{aleatorio.randrange(10 ** 7):07d}",
+        'enfermedades': aleatorio.choice(ENFERMEDADES) if aleatorio.random() < 0.25 else None,
+        'alergias': aleatorio.choice(ALERGIAS) if aleatorio.random() < 0.15 else None,
+        'cirugias_previas': None, 'medicamentos_actuales': None,
+    }
+
+
+def _consulta(aleatorio, paciente_id, fecha):
+    # Los signos se generan como los manda la aplicación (texto) y se guardan como los guarda la API
+    vitales = signos.a_columnas({
+        'presion': f"{aleatorio.randrange(95, 160)}/{aleatorio.randrange(60, 100)}",
+        'frecuencia_cardiaca': str(aleatorio.randrange(55, 110)),
+        'frecuencia_respiratoria': str(aleatorio.randrange(12, 24)),
+        'temperatura': f"{aleatorio.uniform(35.8, 39.5):.1f}",
+        'peso': f"{aleatorio.uniform(8, 120):.1f}", 'talla': f"{aleatorio.uniform(0.7, 1.95):.2f}",
+    })
+    return {
+        'paciente_id': paciente_id, 'fecha_consulta': fecha, 'motivo': aleatorio.choice(MOTIVOS),
+        'sintomas': None, 'tiempo_enfermedad': f"{aleatorio.randrange(1, 15)} días", **vitales,
+        'diagnostico': aleatorio.choice(DIAGNOSTICOS),
+        'medicamentos_recetados': aleatorio.choice(MEDICAMENTOS), 'observaciones': None,
+    }
+
+
+def sembrar(db, pacientes, consultas=5, espera=0.2, activos=60, semilla=7):
+    """
+    Inserta `pacientes` pacientes con ~`consultas` consultas cada uno, y un registro en
+    lista_espera para la fracción `espera` de ellos (`activos` siguen en la cola).
+    No hace nada si ya hay pacientes. Regresa el número de filas insertadas.
+    """
+    from app import estadisticas
+    from app.models import Paciente, Consulta, PacienteEspera, EventoEspera
+
+    if db.session.scalar(select(func.count()).select_from(Paciente)):
+        return 0
+    aleatorio = random.Random(semilla)
+    ahora = datetime.now().replace(microsecond=0)
+    con_espera = max(int(pacientes * espera), min(activos, pacientes))
+    filas = 0
+    inicio = time.perf_counter()
+
+    for desde in range(1, pacientes + 1, LOTE):
+        numeros = range(desde, min(desde + LOTE, pacientes + 1))
+        lote_pacientes = [_paciente(aleatorio, n) for n in numeros]
+        ids = db.session.scalars(
+            insert(Paciente).returning(Paciente.id, sort_by_parameter_order=True), lote_pacientes).all()
+
+        lote_consultas = []
+        for paciente_id in ids:
+            # Pocos pacientes con muchas consultas, muchos con pocas
+            for _ in range(min(int(aleatorio.expovariate(1 / consultas)), int(consultas * 10))):
+                fecha = ahora - timedelta(days=aleatorio.randrange(730), minutes=aleatorio.randrange(600))
+                lote_consultas.append(_consulta(aleatorio, paciente_id, fecha))
+        if lote_consultas:
+            db.session.execute(insert(Consulta), lote_consultas)
+
+        lote_espera, lote_eventos = [], []
+        for n, paciente in zip(numeros, lote_pacientes):
+            if n > con_espera:
+                break
+            activo = n <= activos
+            creado = ahora - timedelta(minutes=aleatorio.randrange(1, 240)) if activo \
+                else ahora - timedelta(days=aleatorio.randrange(1, 730), minutes=aleatorio.randrange(600))
+            lote_espera.append({
+                'nombre': paciente['nombre'], 'numero_afiliacion': paciente['numero_afiliacion'], 'creado': creado,
+                'ingreso': creado, 'area': aleatorio.choice(AREAS),
+                'estado': aleatorio.choice('112') if activo else '3',
+            })
+        if lote_espera:
+            espera_ids = db.session.scalars(
+                insert(PacienteEspera).returning(PacienteEspera.id, sort_by_parameter_order=True),
+                lote_espera).all()
+            # La bitácora arranca con los pacientes que siguen en la cola (igual que la migración 5)
+            for espera_id, fila in zip(espera_ids, lote_espera):
+                if fila['estado'] == '3':
+                    continue
+                evento = {'espera_id': espera_id, 'numero_afiliacion': fila['numero_afiliacion'],
+                          'area': fila['area']}
+                lote_eventos.append(dict(evento, tipo='llegada', momento=fila['ingreso']))
+                if fila['estado'] == '2':
+                    lote_eventos.append(dict(evento, tipo='llamado', momento=ahora))
+            if lote_eventos:
+                db.session.execute(insert(EventoEspera), lote_eventos)
+
+        db.session.commit()
+        filas += len(ids) + len(lote_consultas) + len(lote_espera) + len(lote_eventos)
+        if (desde // LOTE) % 20 == 0:
+            print(f"  {numeros[-1]}/{pacientes} pacientes ({filas} filas, {time.perf_counter() - inicio:.0f}s)")
+
+    with db.engine.begin() as conn:
+        estadisticas.reconstruir_consultas(conn)
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+    return filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pacientes', type=int, default=10000)
+    parser.add_argument('--consultas', type=float, default=5, help='Promedio de consultas por paciente.')
+    parser.add_argument('--espera', type=float, default=0.2,
+                        help='Fracción de pacientes con registro en lista_espera.')
+    parser.add_argument('--activos', type=int, default=60, help='Pacientes que siguen en la cola.')
+    parser.add_argument('--semilla', type=int, default=7)
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.models import db
+
+    app = create_app()
+    with app.app_context():
+        inicio = time.perf_counter()
+        filas = sembrar(db, args.pacientes, args.consultas, args.espera, args.activos, args.semilla)
+        if not filas:
+            print("La base ya tiene pacientes; no se insertó nada.")
+        else:
+            print(f"{filas} filas insertadas en {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
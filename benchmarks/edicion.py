@@ -0,0 +1,93 @@
+"""
+Sentencias SQL (viajes a la base) y tiempo por edición de una consulta:
+PUT (carga la fila con el ORM y la escribe) contra PATCH (un UPDATE con la
+versión esperada). Tres tipos de edición: motivo, signos vitales y
+diagnóstico (el único PATCH que lee antes la fila, para las estadísticas).
+
+    python -m benchmarks.edicion --pacientes 5000 --ediciones 300
+
+Corre dentro del proceso (cliente de pruebas de Flask) sobre una base SQLite
+temporal sembrada con benchmarks.datos, o sobre DATABASE_URL si se indica
+--url-base.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+EDICIONES = {
+    'motivo': lambda i: {'motivo': f"Control {i}"},
+    'signos': lambda i: {'presion': f"{110 + i % 30}/{70 + i % 15}", 'temperatura': f"{36 + i % 3}.{i % 10}"},
+    'diagnostico': lambda i: {'diagnostico': f"Diagnóstico {i}"},
+}
+
+
+class Contador:
+    """Cuenta las sentencias que llegan al cursor y los commits del engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.sentencias = self.commits = 0
+        event.listen(engine, 'before_cursor_execute', self._sentencia)
+        event.listen(engine, 'commit', self._commit)
+
+    def _sentencia(self, *args):
+        self.sentencias += 1
+
+    def _commit(self, *args):
+        self.commits += 1
+
+    def reiniciar(self):
+        self.sentencias = self.commits = 0
+
+
+def editar(cliente, metodo, consulta_id, version, cambios):
+    cuerpo = dict(cambios, version=version) if metodo == 'PATCH' else cambios
+    respuesta = cliente.open(f'/consultas/{consulta_id}', method=metodo, json=cuerpo)
+    if respuesta.status_code != 200:
+        raise SystemExit(f"{metodo} /consultas/{consulta_id}: {respuesta.status_code} {respuesta.get_data(as_text=True)}")
+    return respuesta.get_json()['version']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pacientes', type=int, default=5000)
+    parser.add_argument('--ediciones', type=int, default=300)
+    parser.add_argument('--url-base', default=None, help='Base ya sembrada (por omisión, SQLite temporal).')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.url_base or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    from sqlalchemy import select
+
+    from app import create_app
+    from app.models import db, Consulta
+    from .datos import sembrar
+
+    app = create_app()
+    with app.app_context():
+        sembrar(db, args.pacientes)
+        consultas = dict(db.session.execute(
+            select(Consulta.id, Consulta.version).order_by(Consulta.id).limit(args.ediciones)).all())
+        contador = Contador(db.engine)
+
+    cliente = app.test_client()
+    print(f"{'edición':<12} {'método':<6} {'sentencias/ed':>14} {'commits/ed':>11} {'mediana ms':>11}")
+    ronda = 0
+    for nombre, cambios in EDICIONES.items():
+        for metodo in ('PUT', 'PATCH'):
+            contador.reiniciar()
+            tiempos = []
+            # Valores distintos en cada ronda: cada edición cambia de verdad la fila (y las estadísticas)
+            ronda += len(consultas)
+            for i, (consulta_id, version) in enumerate(consultas.items(), ronda):
+                inicio = time.perf_counter()
+                consultas[consulta_id] = editar(cliente, metodo, consulta_id, version, cambios(i))
+                tiempos.append(time.perf_counter() - inicio)
+            n = len(tiempos)
+            print(f"{nombre:<12} {metodo:<6} {contador.sentencias / n:>14.2f} {contador.commits / n:>11.2f} "
+                  f"{sorted(tiempos)[n // 2] * 1000:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Exportación de todas las consultas: antes (un GET /consultas/paciente/<id>
+por paciente) contra app.exportacion por bloques, con el tiempo y el pico de
+memoria de Python (tracemalloc) de cada formato.
+
+Comprueba además la reanudación: corta una exportación después de unos
+bloques, la reanuda y verifica que el archivo sea idéntico byte por byte al
+de una exportación sin cortes. Falla (código 1) si no lo es.
+
+    python -m benchmarks.exportacion --pacientes 20000 --lote 5000
+
+Corre sobre una base SQLite temporal sembrada con benchmarks.datos, o sobre
+DATABASE_URL si se indica --url-base.
+"""
+import argparse
+import filecmp
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+class Corte(Exception):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pacientes', type=int, default=20000)
+    parser.add_argument('--lote', type=int, default=5000)
+    parser.add_argument('--url-base', default=None, help='Base ya sembrada (por omisión, SQLite temporal).')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.url_base or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['EXPORTACION_DIR'] = tempfile.mkdtemp()
+    from sqlalchemy import select
+
+    from app import create_app, exportacion
+    from app.models import db, Paciente
+    from .datos import sembrar
+
+    app = create_app()
+    with app.app_context():
+        sembrar(db, args.pacientes)
+        pacientes = db.session.scalars(select(Paciente.id)).all()
+
+    cliente = app.test_client()
+    inicio = time.perf_counter()
+    filas = 0
+    for id in pacientes:
+        respuesta = cliente.get(f'/consultas/paciente/{id}')
+        if respuesta.status_code == 200:  # 404 si el paciente no tiene consultas
+            filas += len(respuesta.get_json())
+    antes = time.perf_counter() - inicio
+    print(f"{'método':<28} {'filas':>9} {'segundos':>9} {'filas/s':>9} {'pico MB':>8} {'archivo MB':>10}")
+    print(f"{'GET por paciente':<28} {filas:>9} {antes:>9.2f} {filas / antes:>9.0f} {'':>8} {'':>10}")
+
+    with app.app_context():
+        for formato in exportacion.FORMATOS:
+            if formato == 'parquet' and exportacion.pyarrow is None:
+                print(f"{'exportacion ' + formato:<28} (pyarrow no instalado)")
+                continue
+            id = exportacion.crear(formato, {})['id']
+            tracemalloc.start()
+            inicio = time.perf_counter()
+            estado = exportacion.ejecutar(id, args.lote)
+            segundos = time.perf_counter() - inicio
+            pico = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+            print(f"{'exportacion ' + formato:<28} {estado['filas']:>9} {segundos:>9.2f} "
+                  f"{estado['filas'] / segundos:>9.0f} {pico:>8.1f} {estado['bytes'] / 2 ** 20:>10.1f}")
+
+        # Reanudación: se corta después del segundo bloque, como si el proceso muriera
+        completa = exportacion.crear('csv', {})['id']
+        exportacion.ejecutar(completa, args.lote)
+        cortada = exportacion.crear('csv', {})['id']
+
+        def cortar(estado):
+            if estado['filas'] >= 2 * args.lote:
+                # Bytes escritos después del punto de control que la reanudación debe descartar
+                with open(exportacion.ruta(cortada, 'csv'), 'ab') as archivo:
+                    archivo.write(b'fila a medias,')
+                raise Corte()
+
+        try:
+            exportacion.ejecutar(cortada, args.lote, cortar)
+        except Corte:
+            pass
+        filas_antes = exportacion.leer_estado(cortada)['filas']
+        estado = exportacion.ejecutar(cortada, args.lote)
+        iguales = filecmp.cmp(exportacion.ruta(completa, 'csv'), exportacion.ruta(cortada, 'csv'), shallow=False)
+        print(f"reanudación: cortada en {filas_antes} filas, terminada con {estado['filas']}; "
+              f"archivo {'idéntico' if iguales else 'DISTINTO'} al de la exportación sin cortes")
+    if not iguales:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Costo por petición de app.limites y su efecto con un cliente abusivo.
+
+1. Microbenchmark de la cubeta (memoria, y Redis si hay REDIS_URL) y del tope
+   de concurrencia.
+2. Una ruta trivial con y sin el decorador, por el cliente de pruebas de
+   Flask: la diferencia de medianas es el costo por petición.
+3. Un cliente en bucle contra /lista_pacientes: cuántas atiende y cuántas
+   recibe 429.
+4. --hilos peticiones simultáneas a una ruta costosa lenta con el tope de
+   concurrencia: cuántas reciben 503 y cuánto tarda una ruta barata mientras.
+
+    python -m benchmarks.limites --repeticiones 20000
+
+Corre dentro del proceso sobre una base SQLite temporal sembrada con
+benchmarks.datos.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+
+def por_operacion(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+def mediana(cliente, ruta, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        cliente.get(ruta)
+        tiempos.append(time.perf_counter() - inicio)
+    return sorted(tiempos)[len(tiempos) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pacientes', type=int, default=2000)
+    parser.add_argument('--repeticiones', type=int, default=20000)
+    parser.add_argument('--hilos', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ.setdefault('LIMITES_CONCURRENCIA', '4')
+    from app import create_app, limites
+    from app.models import db
+    from .datos import sembrar
+
+    app = create_app()
+    with app.app_context():
+        sembrar(db, args.pacientes)
+
+    # Rutas solo para la medición
+    def trivial():
+        return 'ok'
+
+    def lenta():
+        time.sleep(0.2)
+        return 'ok'
+
+    app.add_url_rule('/bench/sin_limite', 'bench_sin_limite', trivial)
+    app.add_url_rule('/bench/con_limite', 'bench_con_limite',
+                     limites.costosa('bench', tasa=1e9, rafaga=1e9)(trivial))
+    app.add_url_rule('/bench/lenta', 'bench_lenta', limites.costosa('bench_lenta', tasa=1e9, rafaga=1e9)(lenta))
+
+    print("1. por operación")
+    memoria = limites.CubetasMemoria()
+    claves = [f"ruta:10.0.{i // 256}.{i % 256}" for i in range(1000)]
+    turno = iter(range(10 ** 12))
+    print(f"   cubeta en memoria      {por_operacion(lambda: memoria.tomar(claves[next(turno) % 1000], 1e9, 1e9), args.repeticiones) * 1e6:8.2f} µs")
+    if os.environ.get('REDIS_URL'):
+        redis = limites.CubetasRedis(os.environ['REDIS_URL'])
+        print(f"   cubeta en Redis        {por_operacion(lambda: redis.tomar('bench', 1e9, 1e9), args.repeticiones // 10) * 1e6:8.2f} µs")
+    admision = limites.Admision(4, 0)
+    print(f"   tope de concurrencia   {por_operacion(lambda: admision.entrar() and admision.salir(), args.repeticiones) * 1e6:8.2f} µs")
+
+    cliente = app.test_client()
+    n = max(1000, args.repeticiones // 10)
+    sin, con = mediana(cliente, '/bench/sin_limite', n), mediana(cliente, '/bench/con_limite', n)
+    print(f"2. petición completa: sin límite {sin * 1e6:.1f} µs, con límite {con * 1e6:.1f} µs "
+          f"(costo {(con - sin) * 1e6:+.1f} µs por petición)")
+
+    estados = Counter(cliente.get('/lista_pacientes?limite=20').status_code for _ in range(100))
+    ultima = cliente.get('/lista_pacientes?limite=20')
+    print(f"3. 100 peticiones seguidas a /lista_pacientes: {dict(estados)}; "
+          f"Retry-After {ultima.headers.get('Retry-After')}")
+
+    estados = Counter()
+    lock = threading.Lock()
+
+    def pedir():
+        codigo = app.test_client().get('/bench/lenta').status_code
+        with lock:
+            estados[codigo] += 1
+
+    hilos = [threading.Thread(target=pedir) for _ in range(args.hilos)]
+    for hilo in hilos:
+        hilo.start()
+    time.sleep(0.05)
+    inicio = time.perf_counter()
+    barata = app.test_client().get('/healthz').status_code
+    barata_ms = (time.perf_counter() - inicio) * 1000
+    for hilo in hilos:
+        hilo.join()
+    print(f"4. {args.hilos} peticiones simultáneas a una ruta lenta (tope {limites.admision.maximo}): {dict(estados)}; "
+          f"/healthz mientras tanto {barata} en {barata_ms:.1f} ms")
+    print(f"   /limites/estadisticas: {cliente.get('/limites/estadisticas').get_json()}")
+
+
+if __name__ == '__main__':
+    main()
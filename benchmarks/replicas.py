@@ -0,0 +1,121 @@
+"""
+Comprobación local del enrutamiento a réplicas con archivos SQLite: la
+primaria se siembra con benchmarks.datos y se copia a dos réplicas; una
+tercera réplica apunta a un directorio que no existe (caída).
+
+Muestra cuántas sentencias atiende cada base, y comprueba que:
+- los GET se reparten entre las réplicas sanas y las escrituras van a la primaria
+- quien acaba de escribir lee de la primaria (con la cookie de leer lo propio
+  o, sin cookies, repitiendo el encabezado X-Leer-Primaria) y los demás
+  siguen leyendo la copia
+- la réplica caída no recibe lecturas y entra a la rotación al recuperarse
+
+    python -m benchmarks.replicas --pacientes 2000 --lecturas 300
+
+Falla (código 1) si alguna comprobación no se cumple.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pacientes', type=int, default=2000)
+    parser.add_argument('--lecturas', type=int, default=300)
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    primaria = os.path.join(directorio, 'primaria.db')
+    copias = [os.path.join(directorio, f'replica{i}.db') for i in (1, 2)]
+    caida = os.path.join(directorio, 'todavia-no', 'replica3.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + primaria
+    os.environ.pop('DATABASE_REPLICA_URLS', None)
+
+    from sqlalchemy import event, select
+
+    from app import create_app, replicas
+    from app.models import db, Consulta
+    from .datos import sembrar
+
+    app = create_app()
+    with app.app_context():
+        sembrar(db, args.pacientes)
+        ids = db.session.scalars(select(Consulta.id).order_by(Consulta.id).limit(args.lecturas)).all()
+        db.engine.dispose()
+    for copia in copias:
+        shutil.copyfile(primaria, copia)
+
+    os.environ['DATABASE_REPLICA_URLS'] = ','.join('sqlite:///' + r for r in (*copias, caida))
+    os.environ['REPLICA_INTERVALO'] = '3600'  # las revisiones se disparan a mano
+    app = create_app()
+    sentencias = Counter()
+    with app.app_context():
+        engines = {'primaria': db.engine, **{os.path.basename(r.nombre): r.engine for r in replicas.enrutador.replicas}}
+    for nombre, engine in engines.items():
+        event.listen(engine, 'before_cursor_execute', lambda *a, nombre=nombre: sentencias.update([nombre]))
+
+    fallas = []
+
+    def comprobar(condicion, mensaje):
+        print(f"  {'ok   ' if condicion else 'FALLA'} {mensaje}")
+        if not condicion:
+            fallas.append(mensaje)
+
+    def tabla(titulo):
+        print(f"{titulo}: " + ', '.join(f"{n}={sentencias[n]}" for n in engines))
+
+    lector, editor = app.test_client(), app.test_client()
+    for consulta_id in ids:
+        lector.get(f'/consultas/{consulta_id}')
+    tabla(f"{len(ids)} GET")
+    comprobar(sentencias['primaria'] == 0, "ningún GET leyó de la primaria")
+    comprobar(abs(sentencias['replica1.db'] - sentencias['replica2.db']) <= 1, "turnos parejos entre réplicas sanas")
+    comprobar(sentencias['replica3.db'] == 0, "la réplica caída no recibe lecturas")
+
+    sentencias.clear()
+    consulta_id = ids[0]
+    version = lector.get(f'/consultas/{consulta_id}').get_json()['version']
+    respuesta = editor.patch(f'/consultas/{consulta_id}', json={'motivo': 'Editado en la primaria', 'version': version})
+    comprobar(respuesta.status_code == 200 and replicas.COOKIE in respuesta.headers.get('Set-Cookie', ''),
+              "la escritura responde con la cookie de leer lo propio")
+    propio = editor.get(f'/consultas/{consulta_id}').get_json()['motivo']
+    ajeno = lector.get(f'/consultas/{consulta_id}').get_json()['motivo']
+    tabla("PATCH y dos GET")
+    comprobar(propio == 'Editado en la primaria', "quien editó lee su cambio (primaria)")
+    comprobar(ajeno != 'Editado en la primaria', "los demás leen la copia sin el cambio (réplica)")
+
+    # Un front en otro origen no manda cookies: repite el encabezado de la respuesta
+    sin_cookies = app.test_client(use_cookies=False)
+    consulta_id = ids[1]
+    version = sin_cookies.get(f'/consultas/{consulta_id}').get_json()['version']
+    respuesta = sin_cookies.patch(f'/consultas/{consulta_id}', json={'motivo': 'Editado sin cookie', 'version': version},
+                                  headers={'Origin': 'http://front.local'})
+    hasta = respuesta.headers.get(replicas.ENCABEZADO)
+    comprobar(hasta is not None and replicas.ENCABEZADO in respuesta.headers.get('Access-Control-Expose-Headers', ''),
+              "la escritura expone el encabezado de leer lo propio por CORS")
+    propio = sin_cookies.get(f'/consultas/{consulta_id}', headers={replicas.ENCABEZADO: hasta or ''}).get_json()['motivo']
+    ajeno = sin_cookies.get(f'/consultas/{consulta_id}').get_json()['motivo']
+    comprobar(propio == 'Editado sin cookie', "con el encabezado repetido lee su cambio sin cookie (primaria)")
+    comprobar(ajeno != 'Editado sin cookie', "sin el encabezado sigue leyendo la réplica")
+
+    os.makedirs(os.path.dirname(caida))
+    shutil.copyfile(copias[0], caida)
+    replicas.enrutador.revisar()
+    sentencias.clear()
+    for consulta_id in ids[:30]:
+        lector.get(f'/consultas/{consulta_id}')
+    tabla("réplica 3 recuperada, 30 GET")
+    comprobar(sentencias['replica3.db'] == 10, "la réplica recuperada vuelve a la rotación")
+
+    replicas.enrutador.cerrar()
+    shutil.rmtree(directorio, ignore_errors=True)
+    if fallas:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
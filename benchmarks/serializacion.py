@@ -0,0 +1,111 @@
+"""
+Compara la serialización anterior (objetos del ORM + dicts armados a mano +
+pytz + json estándar) contra app.serializacion (tuplas + serializadores +
+backend rápido) con un historial de 10k consultas.
+
+    python -m benchmarks.serializacion --filas 10000 --repeticiones 5
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+
+def preparar(filas):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    from app import create_app
+    from app import signos
+    from app.models import db, Paciente, Consulta
+
+    app = create_app()
+    with app.app_context():
+        db.session.add(Paciente(nombre='Paciente Prueba', numero_afiliacion='B0000001',
+                                fecha_nacimiento=datetime(1980, 1, 1).date(), sexo='F', tipo_sangre='O+',
+                                recibe_donaciones=True, direccion='Conocido', celular='6620000000'))
+        db.session.commit()
+        inicio = datetime(2024, 1, 1, 8, 0)
+        db.session.execute(Consulta.__table__.insert(), [{
+            'paciente_id': 1, 'fecha_consulta': inicio + timedelta(minutes=37 * i), 'motivo': 'Control',
+            'sintomas': 'Dolor de cabeza', **signos.a_columnas({
+                'presion': '120/80', 'frecuencia_cardiaca': '72', 'frecuencia_respiratoria': '16',
+                'temperatura': '36.5', 'peso': '70', 'talla': '1.70'}),
+            'diagnostico': 'Cefalea tensional', 'medicamentos_recetados': 'Paracetamol',
+            'observaciones': 'Sin observaciones',
+        } for i in range(filas)])
+        db.session.commit()
+    return app
+
+
+def ruta_anterior(db, models):
+    from app import signos
+
+    sonora_tz = pytz.timezone('America/Hermosillo')
+    resultados = db.session.query(models.Consulta, models.Paciente.nombre)\
+        .join(models.Paciente, models.Consulta.paciente_id == models.Paciente.id)\
+        .filter(models.Consulta.paciente_id == 1)\
+        .order_by(models.Consulta.fecha_consulta.desc()).all()
+    lista = []
+    for consulta, nombre in resultados:
+        vitales = signos.a_texto({c: getattr(consulta, c) for c in signos.COLUMNAS})
+        fecha_db = consulta.fecha_consulta
+        fecha_local = sonora_tz.localize(fecha_db) if fecha_db.tzinfo is None else fecha_db.astimezone(sonora_tz)
+        lista.append({
+            "id": consulta.id, "paciente_id": consulta.paciente_id, "nombre_paciente": nombre,
+            "fecha_consulta": fecha_local.isoformat(), "motivo": consulta.motivo,
+            "sintomas": consulta.sintomas, "tiempo_enfermedad": consulta.tiempo_enfermedad,
+            **vitales,
+            "diagnostico": consulta.diagnostico, "medicamentos_recetados": consulta.medicamentos_recetados,
+            "observaciones": consulta.observaciones, "version": consulta.version,
+        })
+    db.session.expunge_all()
+    return json.dumps(lista, sort_keys=True, separators=(',', ':')).encode()
+
+
+def ruta_nueva(app, db, models, serializacion):
+    from sqlalchemy import select
+
+    s = serializacion.CONSULTA_HISTORIAL
+    filas = db.session.execute(
+        select(*s.columnas).join(models.Paciente, models.Consulta.paciente_id == models.Paciente.id)
+        .where(models.Consulta.paciente_id == 1).order_by(models.Consulta.fecha_consulta.desc())).all()
+    return app.json.dumps_bytes(s.filas(filas))
+
+
+def medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        tamano = len(funcion())
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos), sorted(tiempos)[len(tiempos) // 2], tamano
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=10000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    app = preparar(args.filas)
+    from app import models, serializacion
+    from app.models import db
+
+    print(f"{'ruta':<32} {'mín ms':>8} {'mediana ms':>11} {'bytes':>10}")
+    with app.app_context():
+        for nombre, funcion in (
+            ('anterior (ORM + pytz)', lambda: ruta_anterior(db, models)),
+            ('serializacion (1a vez)', lambda: ruta_nueva(app, db, models, serializacion)),
+        ):
+            minimo, mediana, tamano = medir(funcion, 1 if '1a' in nombre else args.repeticiones)
+            print(f"{nombre:<32} {minimo * 1000:>8.1f} {mediana * 1000:>11.1f} {tamano:>10}")
+        minimo, mediana, tamano = medir(lambda: ruta_nueva(app, db, models, serializacion), args.repeticiones)
+        print(f"{'serializacion (fechas en caché)':<32} {minimo * 1000:>8.1f} {mediana * 1000:>11.1f} {tamano:>10}")
+        print(f"backend JSON: {'orjson' if app.json.usar_orjson else 'json estándar'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+Reproduce una mezcla de tráfico de la clínica contra la API y reporta
+throughput y latencias p50/p95/p99 por operación.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.datos --pacientes 100000
+    DATABASE_URL=postgresql://... python -m benchmarks.trafico --pacientes 100000 --segundos 60 \\
+        --linea-base benchmarks/linea_base.json
+
+Mezcla (pesos configurables con --mezcla): altas de pacientes, verificación de
+afiliación, movimiento de la lista de espera (ingreso, llamado y salida),
+apertura de expedientes (consultas_por_paciente, con pacientes "frecuentes"
+que se abren más) y búsquedas por nombre con errores de escritura.
+
+Sin --url levanta gunicorn con gunicorn.conf.py. Con --linea-base compara
+contra el archivo y termina con código 1 si alguna operación empeoró más que
+--tolerancia; con --guardar-linea-base escribe los resultados como nueva
+línea base.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from urllib.parse import quote, urlsplit
+
+from .carga_wsgi import RAIZ, esperar_servidor
+from .datos import AREAS, APELLIDOS, NOMBRES, afiliacion
+
+MEZCLA = {'registro': 3, 'existe': 15, 'espera': 20, 'expediente': 42, 'busqueda': 20}
+# Fracción de los expedientes que se abren sobre el 5% de pacientes "frecuentes"
+FRECUENTES = 0.6
+
+
+class Cliente:
+    """Conexión HTTP persistente de un hilo; registra latencia y estado de cada petición."""
+
+    def __init__(self, host, puerto, medir):
+        self.host = host
+        self.puerto = puerto
+        self.resultados = defaultdict(list)
+        self.medir = medir
+        self._conexion = None
+
+    def pedir(self, operacion, metodo, ruta, cuerpo=None):
+        encabezados = {'Content-Type': 'application/json'} if cuerpo is not None else {}
+        datos = json.dumps(cuerpo).encode() if cuerpo is not None else None
+        inicio = time.perf_counter()
+        try:
+            if self._conexion is None:
+                self._conexion = http.client.HTTPConnection(self.host, self.puerto, timeout=30)
+            self._conexion.request(metodo, ruta, body=datos, headers=encabezados)
+            respuesta = self._conexion.getresponse()
+            respuesta.read()
+            estado = respuesta.status
+        except (OSError, http.client.HTTPException):
+            self._conexion = None
+            estado = None
+        if self.medir.is_set():
+            self.resultados[operacion].append((time.perf_counter() - inicio, estado))
+        return estado
+
+
+def sin_acentos(texto):
+    return ''.join(c for c in unicodedata.normalize('NFD', texto) if unicodedata.category(c) != 'Mn')
+
+
+def con_error(aleatorio, texto):
+    """Quita una letra al azar (error de escritura típico)."""
+    i = aleatorio.randrange(len(texto))
+    return texto[:i] + texto[i + 1:]
+
+
+class Usuario:
+    """Un hilo de tráfico: elige operaciones según la mezcla y lleva su propia parte de la cola."""
+
+    def __init__(self, numero, cliente, pacientes, mezcla, semilla):
+        self.numero = numero
+        self.cliente = cliente
+        self.pacientes = pacientes
+        self.aleatorio = random.Random(semilla * 1000 + numero)
+        self.operaciones = list(mezcla)
+        self.pesos = [mezcla[o] for o in self.operaciones]
+        self.en_cola = []  # (afiliacion, estado) de los pacientes que este hilo metió a la cola
+        # Las altas no deben repetirse entre corridas (serían 409), así que no usan la semilla
+        self.altas = random.Random()
+
+    def paciente(self):
+        a = self.aleatorio
+        if a.random() < FRECUENTES:
+            return a.randrange(1, max(2, self.pacientes // 20))
+        return a.randrange(1, self.pacientes + 1)
+
+    def ejecutar(self):
+        operacion = self.aleatorio.choices(self.operaciones, self.pesos)[0]
+        getattr(self, operacion)()
+
+    def registro(self):
+        # Números fuera del rango sembrado y del de las verificaciones de afiliados nuevos
+        numero = self.altas.randrange(self.pacientes + 10 ** 6, 10 ** 8)
+        self.cliente.pedir('registro', 'POST', '/crear_paciente', {
+            'nombre': f"{self.aleatorio.choice(NOMBRES)} {self.aleatorio.choice(APELLIDOS)}",
+            'numero_afiliacion': afiliacion(numero), 'fecha_nacimiento': '1990-05-17',
+            'sexo': 'Femenino', 'tipo_sangre': 'O+', 'recibe_donaciones': False,
+            'direccion': 'Conocido', 'celular': '6620000000', 'contacto_emergencia': '6620000001',
+        })
+
+    def existe(self):
+        # La mitad de las verificaciones son de afiliados nuevos (no registrados)
+        numero = self.paciente() if self.aleatorio.random() < 0.5 else self.pacientes + self.aleatorio.randrange(1, 10 ** 6)
+        self.cliente.pedir('existe', 'GET', f'/paciente_existe/{afiliacion(numero)}')
+
+    def espera(self):
+        a = self.aleatorio
+        en_espera = [i for i, (_, estado) in enumerate(self.en_cola) if estado == '1']
+        atendiendo = [i for i, (_, estado) in enumerate(self.en_cola) if estado == '2']
+        if len(self.en_cola) < 3 or a.random() < 0.35:
+            numero = afiliacion(self.paciente())
+            if any(n == numero for n, _ in self.en_cola):
+                return
+            estado = self.cliente.pedir('espera_ingreso', 'POST', '/crear_paciente_en_espera', {
+                'numero_afiliacion': numero, 'nombre': 'Paciente de prueba', 'area': a.choice(AREAS)})
+            if estado in (200, 201):
+                self.en_cola.append((numero, '1'))
+        elif en_espera and (not atendiendo or a.random() < 0.5):
+            i = en_espera[0]
+            numero = self.en_cola[i][0]
+            if self.cliente.pedir('espera_llamado', 'PUT', f'/marcar_paciente/{numero}') == 200:
+                self.en_cola[i] = (numero, '2')
+            else:
+                del self.en_cola[i]
+        elif atendiendo:
+            numero = self.en_cola.pop(atendiendo[0])[0]
+            self.cliente.pedir('espera_salida', 'PUT', f'/quitar_paciente_por_afiliacion/{numero}')
+        self.cliente.pedir('espera_lista', 'GET', '/lista_pacientes_en_espera')
+
+    def expediente(self):
+        self.cliente.pedir('expediente', 'GET', f'/consultas/paciente/{self.paciente()}')
+
+    def busqueda(self):
+        a = self.aleatorio
+        texto = f"{a.choice(NOMBRES)} {a.choice(APELLIDOS)}"
+        forma = a.random()
+        if forma < 0.3:
+            texto = sin_acentos(texto)
+        elif forma < 0.5:
+            texto = con_error(a, texto)
+        elif forma < 0.7:
+            texto = a.choice(APELLIDOS)[:5]
+        self.cliente.pedir('busqueda', 'GET', f'/api/pacientes/buscar?q={quote(texto)}')
+
+
+def resumir(resultados, segundos):
+    filas = {}
+    for operacion, muestras in sorted(resultados.items()):
+        latencias = [t for t, estado in muestras if estado is not None and estado < 500]
+        errores = sum(1 for _, estado in muestras if estado is None or estado >= 500)
+        if len(latencias) >= 2:
+            cuantiles = statistics.quantiles(latencias, n=100)
+            p50, p95, p99 = cuantiles[49], cuantiles[94], cuantiles[98]
+        else:
+            p50 = p95 = p99 = latencias[0] if latencias else 0.0
+        filas[operacion] = {
+            'peticiones': len(muestras), 'req_s': round(len(muestras) / segundos, 1),
+            'p50_ms': round(p50 * 1000, 2), 'p95_ms': round(p95 * 1000, 2), 'p99_ms': round(p99 * 1000, 2),
+            'errores': errores,
+            'cliente_4xx': sum(1 for _, estado in muestras if estado is not None and 400 <= estado < 500),
+        }
+    total = sum(f['peticiones'] for f in filas.values())
+    return {'operaciones': filas, 'total': {
+        'peticiones': total, 'req_s': round(total / segundos, 1),
+        'errores': sum(f['errores'] for f in filas.values()),
+    }}
+
+
+def imprimir(resumen):
+    print(f"{'operación':<16} {'peticiones':>10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'4xx':>6} {'errores':>8}")
+    for operacion, f in resumen['operaciones'].items():
+        print(f"{operacion:<16} {f['peticiones']:>10} {f['req_s']:>8} {f['p50_ms']:>8} {f['p95_ms']:>8} "
+              f"{f['p99_ms']:>8} {f['cliente_4xx']:>6} {f['errores']:>8}")
+    t = resumen['total']
+    print(f"{'total':<16} {t['peticiones']:>10} {t['req_s']:>8} {'':>8} {'':>8} {'':>8} {'':>6} {t['errores']:>8}")
+
+
+def comparar(resumen, linea_base, tolerancia):
+    """Lista de regresiones contra la línea base (vacía si todo está dentro de la tolerancia)."""
+    regresiones = []
+    for operacion, base in linea_base['operaciones'].items():
+        actual = resumen['operaciones'].get(operacion)
+        if actual is None:
+            continue
+        # p99 se reporta pero no se compara: con corridas cortas es demasiado ruidoso
+        if actual['p95_ms'] > base['p95_ms'] * (1 + tolerancia):
+            regresiones.append(f"{operacion}: p95 {actual['p95_ms']} ms > {base['p95_ms']} ms (+{tolerancia:.0%})")
+    base_total, total = linea_base['total'], resumen['total']
+    if total['req_s'] < base_total['req_s'] * (1 - tolerancia):
+        regresiones.append(f"throughput total {total['req_s']} req/s < {base_total['req_s']} (-{tolerancia:.0%})")
+    if total['errores'] > max(base_total['errores'], total['peticiones'] * 0.001):
+        regresiones.append(f"{total['errores']} errores (línea base: {base_total['errores']})")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='API ya levantada (si no, se levanta gunicorn)')
+    parser.add_argument('--pacientes', type=int, default=10000, help='Escala con la que se sembró la base.')
+    parser.add_argument('--usuarios', type=int, default=16, help='Hilos concurrentes.')
+    parser.add_argument('--segundos', type=int, default=30)
+    parser.add_argument('--calentamiento', type=int, default=5, help='Segundos iniciales que no se miden.')
+    parser.add_argument('--mezcla', type=json.loads, default=MEZCLA, help='Pesos en JSON, p. ej. \'{"expediente": 1}\'')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--puerto', type=int, default=5057)
+    parser.add_argument('--semilla', type=int, default=11)
+    parser.add_argument('--linea-base')
+    parser.add_argument('--guardar-linea-base')
+    parser.add_argument('--tolerancia', type=float, default=0.25)
+    args = parser.parse_args()
+
+    servidor = None
+    if args.url:
+        partes = urlsplit(args.url)
+        host, puerto = partes.hostname, partes.port or 80
+    else:
+        host, puerto = '127.0.0.1', args.puerto
+        # Todos los usuarios simulados salen de 127.0.0.1: con los límites por IP la repetición
+        # se llenaría de 429 y dejaría de compararse con linea_base.json
+        entorno = dict(os.environ, WEB_CONCURRENCY=str(args.workers), GUNICORN_THREADS=str(args.threads),
+                       GUNICORN_BIND=f"{host}:{puerto}", GUNICORN_ACCESSLOG='', LIMITES='0')
+        servidor = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+                                    cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    medir = threading.Event()
+    detener = threading.Event()
+    clientes = [Cliente(host, puerto, medir) for _ in range(args.usuarios)]
+
+    def hilo(numero):
+        usuario = Usuario(numero, clientes[numero], args.pacientes, args.mezcla, args.semilla)
+        while not detener.is_set():
+            usuario.ejecutar()
+
+    try:
+        esperar_servidor(f"http://{host}:{puerto}/lista_pacientes_en_espera", limite=120)
+        hilos = [threading.Thread(target=hilo, args=(i,)) for i in range(args.usuarios)]
+        for h in hilos:
+            h.start()
+        time.sleep(args.calentamiento)
+        medir.set()
+        time.sleep(args.segundos)
+        medir.clear()
+        detener.set()
+        for h in hilos:
+            h.join()
+    finally:
+        if servidor is not None:
+            servidor.terminate()
+            servidor.wait()
+
+    resultados = defaultdict(list)
+    for cliente in clientes:
+        for operacion, muestras in cliente.resultados.items():
+            resultados[operacion].extend(muestras)
+    resumen = resumir(resultados, args.segundos)
+    resumen['configuracion'] = {'base': urlsplit(os.environ.get('DATABASE_URL', '')).scheme or None,
+                                'pacientes': args.pacientes, 'usuarios': args.usuarios, 'segundos': args.segundos,
+                                'workers': args.workers, 'threads': args.threads, 'mezcla': args.mezcla}
+    imprimir(resumen)
+
+    if args.guardar_linea_base:
+        with open(args.guardar_linea_base, 'w') as archivo:
+            json.dump(resumen, archivo, indent=2, ensure_ascii=False, sort_keys=True)
+            archivo.write('\n')
+        print(f"Línea base guardada en {args.guardar_linea_base}")
+
+    if args.linea_base:
+        with open(args.linea_base) as archivo:
+            regresiones = comparar(resumen, json.load(archivo), args.tolerancia)
+        for regresion in regresiones:
+            print(f"REGRESIÓN  {regresion}")
+        if regresiones:
+            sys.exit(1)
+        print("Sin regresiones contra la línea base")
+
+
+if __name__ == '__main__':
+    main()
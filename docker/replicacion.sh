@@ -0,0 +1,7 @@
+#!/bin/sh
+# Primaria de docker-compose.replicas.yml: usuario para que la réplica haga pg_basebackup y reciba el WAL.
+# Solo corre al inicializar un volumen vacío (docker-entrypoint-initdb.d).
+set -e
+psql -v ON_ERROR_STOP=1 -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+    -c "CREATE ROLE replicador WITH REPLICATION LOGIN PASSWORD 'replicador'"
+echo "host replication replicador all scram-sha-256" >> "$PGDATA/pg_hba.conf"
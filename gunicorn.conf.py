@@ -0,0 +1,49 @@
+# Configuración de gunicorn para producción:  gunicorn -c gunicorn.conf.py run:app
+# Recargar sin cortar peticiones:  kill -HUP <pid del master>  (con GUNICORN_PRELOAD=1 usar USR2)
+# Con más de un worker se necesita ESPERA_BROKER=postgres (ya viene en el Dockerfile y en
+# docker-compose.yml): sin él los avisos SSE de la lista de espera no pasan de un worker a otro
+# y la lista se lee de la tabla en cada petición en vez de la cola en memoria.
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# gthread: las pantallas conectadas por SSE ocupan un hilo, no un proceso completo
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Los topes de app/limites.py se calculan con este valor: a lo más la mitad de los hilos para
+# pantallas SSE (LIMITES_SSE; la siguiente recibe 503 con Retry-After), y para las rutas
+# costosas los que quedan menos uno, que siempre queda libre para las rutas baratas.
+# Con los 8 de omisión: 4 pantallas y 3 costosas por worker.
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-') or None
+
+# Cada worker guarda sus métricas aquí y /metrics responde la suma de todos (ver app/metricas.py).
+# Un directorio nuevo por arranque del master; se conserva en las recargas (HUP) y reciclajes
+if 'METRICAS_DIR' not in os.environ:
+    os.environ['METRICAS_DIR'] = tempfile.mkdtemp(prefix='cddia-metricas-')
+
+if workers > 1 and os.environ.get('ESPERA_BROKER', 'local') != 'postgres':
+    print(f"Aviso: {workers} workers sin ESPERA_BROKER=postgres; las pantallas SSE solo verán "
+          f"los cambios hechos en su propio worker")
+
+
+def post_fork(server, worker):
+    # Con preload_app el engine y los hilos se crearon en el master: cada worker los rehace
+    if preload_app:
+        from app import reiniciar_tras_fork
+        from run import app
+        reiniciar_tras_fork(app)
+
+
+def post_worker_init(worker):
+    # Exportaciones que corrían en un worker que ya terminó (recarga, max_requests); no se
+    # hace al crear la app para que no las tome el master con preload_app ni los comandos flask
+    from app import exportacion
+    exportacion.reanudar_huerfanas(worker.wsgi)
@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app():
+    """
+    Aplicación sobre una base SQLite temporal con las migraciones aplicadas, o sobre
+    PRUEBAS_DATABASE_URL (p. ej. un PostgreSQL desechable en CI; las pruebas borran sus tablas).
+    """
+    os.environ['DATABASE_URL'] = os.environ.get('PRUEBAS_DATABASE_URL') or \
+        'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'pruebas.db')
+    os.environ['EXPORTACION_DIR'] = tempfile.mkdtemp()
+    os.environ.pop('DATABASE_REPLICA_URLS', None)
+    os.environ.pop('REDIS_URL', None)
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        yield app
@@ -0,0 +1,66 @@
+"""Filtro de afiliaciones (app/afiliaciones.py) con altas de otros workers."""
+from datetime import date
+
+import pytest
+from sqlalchemy import delete, insert
+
+from app import condicional
+from app.afiliaciones import IndiceAfiliaciones
+from app.models import db, Paciente, PacienteEspera
+
+
+def paciente(id, numero_afiliacion):
+    return {'id': id, 'nombre': 'Paciente', 'numero_afiliacion': numero_afiliacion,
+            'fecha_nacimiento': date(1990, 1, 1), 'sexo': 'Femenino', 'tipo_sangre': 'O+',
+            'recibe_donaciones': False, 'direccion': 'Calle 1', 'celular': '6620000000',
+            'contacto_emergencia': '6620000001'}
+
+
+@pytest.fixture
+def indice(app):
+    with db.engine.begin() as conn:
+        conn.execute(delete(PacienteEspera.__table__))
+        conn.execute(delete(Paciente.__table__))
+    indice = IndiceAfiliaciones(intervalo=3600)
+    indice.cargar()
+    return indice
+
+
+def test_id_menor_confirmado_despues(indice):
+    with db.engine.begin() as conn:
+        conn.execute(insert(Paciente), [paciente(10, '00000010')])
+    indice.sincronizar()
+    # Otro worker confirma el id 5 después de que el filtro ya leyó el 10
+    with db.engine.begin() as conn:
+        conn.execute(insert(Paciente), [paciente(5, '00000005')])
+    indice.sincronizar()
+    assert indice.puede_existir('00000005')
+
+
+def test_alta_local_no_mueve_la_marca(indice):
+    # El alta de este worker (id 20) no debe saltarse la del id 15 que otro worker confirma después
+    with db.engine.begin() as conn:
+        conn.execute(insert(Paciente), [paciente(20, '00000020')])
+    indice.agregar('00000020')
+    with db.engine.begin() as conn:
+        conn.execute(insert(Paciente), [paciente(15, '00000015')])
+    indice.sincronizar()
+    assert indice.puede_existir('00000015')
+
+
+def test_sin_contadores_se_confirma_en_la_base_si_va_atrasado(indice, monkeypatch):
+    # Motor sin los triggers de versiones_tabla: solo queda el intervalo de sincronización
+    monkeypatch.setattr(condicional, 'leer', lambda conn, *claves: None)
+    assert not indice.puede_existir('99999999')
+    indice.intervalo = 0
+    monkeypatch.setattr(indice, 'sincronizar', lambda: False)  # otro hilo ya sincroniza
+    assert indice.puede_existir('99999999')
+
+
+def test_alta_de_otro_worker_antes_de_sincronizar(indice):
+    # El intervalo aún no vence, pero el contador de pacientes ya se movió
+    assert not indice.puede_existir('00000030')
+    with db.engine.begin() as conn:
+        conn.execute(insert(Paciente), [paciente(30, '00000030')])
+    assert indice.puede_existir('00000030')
+    assert not indice.puede_existir('00000031')
@@ -0,0 +1,26 @@
+"""Reproducción de la bitácora de la lista de espera (app/bitacora.py)."""
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert
+
+from app import bitacora
+from app.models import db
+
+
+def test_reproduce_en_orden_de_ocurrencia(app):
+    # Dos workers escriben sus lotes en desorden: el llamado (id menor) ocurrió después de la llegada
+    inicio = datetime(2026, 1, 5, 9, 0)
+    with db.engine.begin() as conn:
+        conn.execute(delete(bitacora.tabla))
+        conn.execute(insert(bitacora.tabla), [
+            {"id": 1, "espera_id": 7, "numero_afiliacion": "00000007", "tipo": "llamado",
+             "area": "General", "momento": inicio + timedelta(minutes=12)},
+            {"id": 2, "espera_id": 7, "numero_afiliacion": "00000007", "tipo": "llegada",
+             "area": "General", "momento": inicio},
+        ])
+    with db.engine.connect() as conn:
+        estado = bitacora.reconstruir_estado(bitacora.leer_eventos(conn))
+    with db.engine.connect() as conn:
+        tiempos = bitacora.tiempos_de_espera(bitacora.leer_eventos(conn))
+    assert estado == {7: ('2', 'General', '00000007', inicio)}
+    assert list(tiempos['General']) == [12.0]
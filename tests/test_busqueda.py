@@ -0,0 +1,64 @@
+"""Índice de búsqueda en memoria (el que se usa fuera de PostgreSQL) y /api/pacientes/buscar-historial."""
+from datetime import date
+
+import pytest
+from sqlalchemy import delete, insert
+
+from app import busqueda
+from app.models import db, Paciente, PacienteEspera
+
+
+def paciente(numero_afiliacion, nombre, **campos):
+    return dict({
+        'nombre': nombre, 'numero_afiliacion': numero_afiliacion, 'fecha_nacimiento': date(1990, 1, 1),
+        'sexo': 'Femenino', 'tipo_sangre': 'O+', 'recibe_donaciones': False, 'direccion': 'Calle 1',
+        'celular': '6620000000', 'contacto_emergencia': '6620000001',
+    }, **campos)
+
+
+@pytest.fixture
+def pacientes(app):
+    with db.engine.begin() as conn:
+        conn.execute(delete(PacienteEspera.__table__))
+        conn.execute(delete(Paciente.__table__))
+    busqueda.indice = busqueda.IndiceTrigramas()
+    yield
+    busqueda.indice = busqueda.IndiceTrigramas()
+
+
+def test_afiliacion_por_subcadena(pacientes):
+    with db.engine.begin() as conn:
+        conn.execute(insert(Paciente), [paciente('12345678', 'Ana López'), paciente('99123400', 'Luis Pérez')])
+    assert {r['numero_afiliacion'] for r in busqueda.buscar_pacientes('1234')} == {'12345678', '99123400'}
+    assert [r['numero_afiliacion'] for r in busqueda.buscar_pacientes('5678')] == ['12345678']
+    assert [r['numero_afiliacion'] for r in busqueda.buscar_pacientes('91')] == ['99123400']
+
+
+def test_id_menor_confirmado_despues(pacientes):
+    # Otro worker confirma el id 5 después de que el índice ya leyó el 10
+    with db.engine.begin() as conn:
+        conn.execute(insert(Paciente), [paciente('00000010', 'Primero', id=10)])
+    assert busqueda.buscar_pacientes('00000010')
+    with db.engine.begin() as conn:
+        conn.execute(insert(Paciente), [paciente('00000005', 'Tardío', id=5)])
+    assert [r['id'] for r in busqueda.buscar_pacientes('Tardío')] == [5]
+
+
+def test_reindexar_quita_palabras_clinicas(pacientes):
+    with db.engine.begin() as conn:
+        conn.execute(insert(Paciente), [paciente('00000001', 'Ana', id=1, alergias='Penicilina')])
+    assert busqueda.buscar_pacientes('penicilina', clinico=True)
+    busqueda.indice.actualizar(1, 'Ana', '00000001', None, 'Polen')
+    assert not busqueda.buscar_pacientes('penicilina', clinico=True)
+    assert busqueda.buscar_pacientes('polen', clinico=True)
+
+
+def test_historial_filtra_antes_de_limitar(app, pacientes):
+    # 60 pacientes con el mismo nombre; solo el último ya fue atendido (estado 3)
+    with db.engine.begin() as conn:
+        conn.execute(insert(Paciente), [paciente(f'{i:08d}', 'María García', id=i) for i in range(1, 61)])
+        conn.execute(insert(PacienteEspera), [
+            {'nombre': 'María García', 'numero_afiliacion': f'{i:08d}', 'area': 'General',
+             'estado': '3' if i == 60 else '1'} for i in range(1, 61)])
+    respuesta = app.test_client().get('/api/pacientes/buscar-historial?q=maria')
+    assert [p['numero_afiliacion'] for p in respuesta.get_json()] == ['00000060']
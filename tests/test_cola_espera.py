@@ -0,0 +1,105 @@
+"""
+Transiciones simultáneas de la lista de espera: al terminar, lo que cada
+ColaEspera muestra debe coincidir con la tabla lista_espera.
+"""
+import random
+import threading
+
+import pytest
+from sqlalchemy import delete, select
+
+from app.cola_espera import ColaEspera, TransicionInvalida, tabla
+from app.models import db
+
+HILOS = 8
+OPERACIONES = 40
+
+
+@pytest.fixture
+def limpia(app):
+    with db.engine.begin() as conn:
+        conn.execute(delete(tabla))
+
+
+def en_base():
+    with db.engine.connect() as conn:
+        filas = conn.execute(select(tabla.c.id, tabla.c.estado)
+                             .where(tabla.c.estado.in_(('1', '2')))
+                             .order_by(tabla.c.creado, tabla.c.id)).all()
+    return [(f.id, f.estado) for f in filas]
+
+
+def trafico(app, colas, semilla):
+    """Ingresa, llama y quita pacientes al azar desde varios hilos, cada uno con una de `colas`."""
+    errores = []
+
+    def hilo(numero):
+        aleatorio = random.Random(semilla + numero)
+        with app.app_context():
+            try:
+                for _ in range(OPERACIONES):
+                    cola = aleatorio.choice(colas)
+                    afiliacion = f"{aleatorio.randrange(30):08d}"
+                    operacion = aleatorio.random()
+                    try:
+                        if operacion < 0.4:
+                            cola.ingresar(afiliacion, nombre=f"Paciente {afiliacion}", area='General')
+                        elif operacion < 0.7:
+                            cola.cambiar_estado('2', desde=('1',), numero_afiliacion=afiliacion)
+                        else:
+                            cola.cambiar_estado('3', desde=('1', '2', '3'), numero_afiliacion=afiliacion)
+                    except TransicionInvalida:
+                        pass
+            except Exception as e:
+                errores.append(e)
+
+    hilos = [threading.Thread(target=hilo, args=(n,)) for n in range(HILOS)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert errores == []
+
+
+def test_en_memoria_coincide_con_la_base(app, limpia):
+    cola = ColaEspera()
+    cola.cargar(en_memoria=True)
+    trafico(app, [cola], semilla=1)
+
+    assert cola.diferencias() == []
+    assert [(e.id, e.estado) for e in cola.activos()] == en_base()
+
+    # Recargar desde la tabla da la misma huella que la memoria construida cambio por cambio
+    huella = cola.huella()
+    cola.cargar()
+    assert cola.huella() == huella
+
+
+def test_varios_workers_sin_broker_leen_la_base(app, limpia):
+    # Dos colas en el mismo proceso hacen de dos workers sin canal entre ellos
+    colas = [ColaEspera(), ColaEspera()]
+    for cola in colas:
+        cola.cargar(en_memoria=False)
+    trafico(app, colas, semilla=2)
+
+    esperado = en_base()
+    for cola in colas:
+        assert cola.diferencias() == []
+        assert [(e.id, e.estado) for e in cola.activos()] == esperado
+        assert cola.total_en_espera() == sum(1 for _, estado in esperado if estado == '1')
+    assert colas[0].huella() == colas[1].huella()
+
+    # Un paciente que ingresó por un worker se puede llamar desde el otro
+    entrada, _ = colas[0].ingresar('99999999', nombre='Paciente nuevo', area='Dental')
+    assert colas[1].cambiar_estado('2', desde=('1',), id=entrada.id).estado == '2'
+    assert (entrada.id, '2') in [(e.id, e.estado) for e in colas[0].activos()]
+
+
+def test_sin_broker_la_memoria_se_separaria(app, limpia):
+    # Lo que evita en_memoria=False: dos copias en memoria sin canal dejan de coincidir con la tabla
+    colas = [ColaEspera(), ColaEspera()]
+    for cola in colas:
+        cola.cargar(en_memoria=True)
+    colas[0].ingresar('12345678', nombre='Paciente', area='General')
+    assert colas[0].diferencias() == []
+    assert colas[1].diferencias() != []
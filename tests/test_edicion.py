@@ -0,0 +1,61 @@
+"""PATCH /pacientes/<id>: validación de campos y versión por If-Match."""
+from datetime import date
+
+import pytest
+from sqlalchemy import delete, insert, select
+
+from app import busqueda
+from app.afiliaciones import IndiceAfiliaciones
+from app.models import db, Paciente, PacienteEspera
+
+
+@pytest.fixture
+def paciente_id(app):
+    with db.engine.begin() as conn:
+        conn.execute(delete(PacienteEspera.__table__))
+        conn.execute(delete(Paciente.__table__))
+        conn.execute(insert(Paciente), [{
+            'id': 1, 'nombre': 'Ana López', 'numero_afiliacion': '00000001', 'fecha_nacimiento': date(1990, 1, 1),
+            'sexo': 'Femenino', 'tipo_sangre': 'O+', 'recibe_donaciones': False, 'direccion': 'Calle 1',
+            'celular': '6620000000', 'contacto_emergencia': '6620000001'}])
+    return 1
+
+
+def test_campos_invalidos_responden_400(app, paciente_id):
+    respuesta = app.test_client().patch(f'/pacientes/{paciente_id}', json={
+        'version': 1, 'recibe_donaciones': 'abc', 'nombre': 'x' * 100, 'sexo': None,
+        'fecha_nacimiento': '01/02/1990'})
+    assert respuesta.status_code == 400
+    assert set(respuesta.get_json()['campos']) == {'recibe_donaciones', 'nombre', 'sexo', 'fecha_nacimiento'}
+    assert db.session.scalar(select(Paciente.version).where(Paciente.id == paciente_id)) == 1
+
+
+def test_if_match_con_el_etag_de_la_respuesta(app, paciente_id):
+    cliente = app.test_client()
+    primera = cliente.patch(f'/pacientes/{paciente_id}', json={'recibe_donaciones': 'sí'},
+                            headers={'If-Match': '"1"'})
+    assert primera.status_code == 200 and primera.headers['ETag'] == '"2"'
+    # Tal como lo guarda un cliente que recibió la respuesta comprimida
+    segunda = cliente.patch(f'/pacientes/{paciente_id}', json={'celular': '6629999999'},
+                            headers={'If-Match': '"2-gzip"'})
+    assert segunda.status_code == 200 and segunda.get_json()['version'] == 3
+    vieja = cliente.patch(f'/pacientes/{paciente_id}', json={'celular': '6621111111'},
+                          headers={'If-Match': primera.headers['ETag']})
+    assert vieja.status_code == 409
+
+
+def test_cambio_de_afiliacion_llega_a_otros_workers(app, paciente_id):
+    # Índices de otro worker, cargados antes de la edición
+    otro_filtro = IndiceAfiliaciones(intervalo=3600)
+    otro_filtro.cargar()
+    otra_busqueda = busqueda.IndiceTrigramas()
+    assert otra_busqueda.buscar('00000001')
+
+    respuesta = app.test_client().patch(f'/pacientes/{paciente_id}', json={
+        'version': 1, 'numero_afiliacion': '00000099', 'nombre': 'Ana Ruiz'})
+    assert respuesta.status_code == 200
+
+    assert otro_filtro.puede_existir('00000099')
+    assert [r[3] for r in otra_busqueda.buscar('00000099')] == ['00000099']
+    assert not otra_busqueda.buscar('00000001')
+    assert [r[2] for r in otra_busqueda.buscar('Ruiz')] == ['Ana Ruiz']
@@ -0,0 +1,32 @@
+"""Exportaciones que quedaron en_curso cuando su worker terminó (app/exportacion.py)."""
+import fcntl
+
+import pytest
+
+from app import exportacion
+
+
+@pytest.fixture
+def interrumpida(app):
+    # Como la deja un worker reciclado a la mitad: en_curso y sin nadie con el candado
+    estado = exportacion.crear('csv', {})
+    estado['estado'] = 'en_curso'
+    exportacion._guardar_estado(estado)
+    return estado['id']
+
+
+def test_se_reanuda_al_arrancar(app, interrumpida, monkeypatch):
+    hilos = []
+    iniciar = exportacion.iniciar
+    monkeypatch.setattr(exportacion, 'iniciar', lambda app, id: hilos.append(iniciar(app, id)))
+    assert interrumpida in exportacion.reanudar_huerfanas(app)
+    for hilo in hilos:
+        hilo.join(10)
+    assert exportacion.leer_estado(interrumpida)['estado'] == 'terminada'
+
+
+def test_no_se_toma_la_que_corre_en_otro_proceso(app, interrumpida):
+    with open(exportacion.ruta(interrumpida, 'lock'), 'a') as candado:
+        fcntl.flock(candado, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert interrumpida not in exportacion.reanudar_huerfanas(app)
+    assert exportacion.leer_estado(interrumpida)['estado'] == 'en_curso'
@@ -0,0 +1,61 @@
+"""Lectores de app/importacion.py: una fila ilegible se reporta como error de esa fila."""
+import io
+import json
+
+from app import importacion
+
+
+def fila(numero):
+    return {'nombre': f'Paciente {numero}', 'numero_afiliacion': f'{numero:08d}', 'fecha_nacimiento': '1990-01-01',
+            'sexo': 'Femenino', 'tipo_sangre': 'O+', 'recibe_donaciones': False, 'direccion': 'Calle 1',
+            'celular': '6620000000'}
+
+
+def leidas(lector, contenido, **opciones):
+    return [f if not isinstance(f, importacion.FilaIlegible) else 'ilegible'
+            for f in lector(io.BytesIO(contenido), **opciones)]
+
+
+def test_ndjson_sigue_despues_de_una_linea_mala():
+    contenido = b'\n'.join([json.dumps(fila(1)).encode(), b'{"nombre": ', b'\xff\xfe{}', json.dumps(fila(2)).encode()])
+    assert leidas(importacion.leer_ndjson, contenido) == [fila(1), 'ilegible', 'ilegible', fila(2)]
+
+
+def test_json_sigue_despues_de_un_elemento_malo():
+    contenido = ('[' + json.dumps(fila(1)) + ', {"nombre": "a" "b", "x": [1, {"y": "}, ]"}]}, '
+                 + json.dumps(fila(2)) + ']').encode()
+    # Bloques pequeños para que los elementos crucen el límite de lectura
+    assert leidas(importacion.leer_json, contenido, tamano_bloque=16) == [fila(1), 'ilegible', fila(2)]
+
+
+def test_json_incompleto_es_error_de_fila():
+    assert leidas(importacion.leer_json, ('[' + json.dumps(fila(1)) + ', {"nombre": ').encode()) == \
+        [fila(1), 'ilegible']
+
+
+def test_ruta_reporta_la_fila_y_sigue(app):
+    cuerpo = '\n'.join([json.dumps(fila(101)), 'no es json', json.dumps(fila(102))])
+    respuesta = app.test_client().post('/pacientes/importar', data=cuerpo, content_type='application/x-ndjson')
+    assert respuesta.status_code == 200
+    datos = respuesta.get_json()
+    assert datos['resumen'] == {'creados': 2, 'duplicados': 0, 'errores': 1}
+    assert datos['filas'][1]['fila'] == 2 and datos['filas'][1]['resultado'] == 'error'
+
+
+def test_json_byte_no_utf8_es_error_de_fila():
+    contenido = b'[' + json.dumps(fila(1)).encode() + b', {"nombre": "\xff"}, ' + json.dumps(fila(2)).encode() + b']'
+    assert leidas(importacion.leer_json, contenido, tamano_bloque=16) == [fila(1), 'ilegible', fila(2)]
+
+
+def test_csv_byte_no_utf8_despues_del_primer_lote(app):
+    # La fila mala llega cuando el primer lote de 1000 ya se guardó: el reporte debe incluir todo
+    columnas = list(fila(0))
+    lineas = [','.join(columnas).encode()]
+    for numero in range(70000001, 70001501):
+        lineas.append(','.join(str(v) for v in fila(numero).values()).encode())
+    lineas[1201] = lineas[1201].replace(b'Calle 1', b'Calle \xe91')
+    respuesta = app.test_client().post('/pacientes/importar', data=b'\n'.join(lineas), content_type='text/csv')
+    assert respuesta.status_code == 200
+    datos = respuesta.get_json()
+    assert datos['resumen'] == {'creados': 1499, 'duplicados': 0, 'errores': 1}
+    assert datos['filas'][1200]['resultado'] == 'error'
@@ -0,0 +1,43 @@
+"""Tope de pantallas en vivo (SSE) por proceso en app/limites.py."""
+import pytest
+
+from app import limites
+
+
+@pytest.fixture
+def una_pantalla(app, monkeypatch):
+    monkeypatch.setenv('LIMITES', '1')
+    monkeypatch.setenv('LIMITES_SSE', '1')
+    limites.configurar()
+    yield
+    monkeypatch.undo()
+    limites.configurar()
+
+
+def test_sse_sobre_el_tope_responde_503(app, una_pantalla):
+    cliente = app.test_client()
+    primera = cliente.get('/lista_pacientes_en_espera/eventos', buffered=False)
+    assert primera.status_code == 200
+    segunda = cliente.get('/lista_pacientes_en_espera/eventos', buffered=False)
+    assert segunda.status_code == 503 and segunda.headers['Retry-After'] == str(limites.ESPERA_EN_VIVO)
+    # Al cerrarse la primera pantalla su hilo queda libre
+    primera.close()
+    tercera = cliente.get('/lista_pacientes_en_espera/eventos', buffered=False)
+    assert tercera.status_code == 200
+    tercera.close()
+    assert limites.estadisticas()['rutas']['eventos_espera'] == {'atendidas': 2, 'limitadas': 0, 'rechazadas': 1}
+
+
+def test_ajuste_por_ruta_se_valida_al_arrancar(app, monkeypatch):
+    monkeypatch.setenv('LIMITE_LISTA_PACIENTES', 'uno/5')
+    with pytest.raises(ValueError, match='LIMITE_LISTA_PACIENTES'):
+        limites.configurar()
+    monkeypatch.setenv('LIMITE_LISTA_PACIENTES', '1/5')
+    limites.configurar()
+    assert limites.limite('lista_pacientes', 2, 10) == (1.0, 5.0)
+    monkeypatch.setenv('LIMITE_LISTA_PACIENTES', '0')
+    limites.configurar()
+    assert limites.limite('lista_pacientes', 2, 10) is None
+    monkeypatch.undo()
+    limites.configurar()
+    assert limites.limite('lista_pacientes', 2, 10) == (2.0, 10.0)
@@ -0,0 +1,41 @@
+"""/metrics con varios procesos: suma de las copias en METRICAS_DIR (app/metricas.py)."""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app import metricas
+
+
+def copia(peticiones):
+    registro = metricas.Registro()
+    for _ in range(peticiones):
+        registro.registrar('/lista_pacientes', 'GET', 200, 0.01, 1, 0.001, 0.001, 100)
+    return {'registro': registro.volcar(), 'proceso': [('api_filtro_afiliaciones_descartes', {}, peticiones)]}
+
+
+def total(texto):
+    return next(linea for linea in texto if linea.startswith('api_peticiones_total{ruta="/lista_pacientes"'))
+
+
+@pytest.fixture
+def compartido(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(metricas, 'registro', metricas.Registro())
+    return metricas.Compartido(str(tmp_path), intervalo=3600)
+
+
+def test_suma_procesos_vivos_y_terminados(compartido, tmp_path):
+    metricas.registro.registrar('/lista_pacientes', 'GET', 200, 0.01, 1, 0.001, 0.001, 100)
+    terminado = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                               capture_output=True, text=True).stdout.strip()
+    (tmp_path / f'{os.getppid()}.json').write_text(json.dumps(copia(2)))
+    (tmp_path / f'{terminado}.json').write_text(json.dumps(copia(4)))
+
+    texto = compartido.texto()
+    assert total(texto).endswith(' 7')
+    assert f'api_filtro_afiliaciones_descartes{{proceso="{os.getppid()}"}} 2' in texto
+    # El worker terminado queda sumado en muertos.json y su archivo se borra
+    assert not (tmp_path / f'{terminado}.json').exists()
+    assert total(compartido.texto()).endswith(' 7')
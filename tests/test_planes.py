@@ -0,0 +1,27 @@
+"""
+Los planes de las consultas más frecuentes usan índices (las mismas revisiones
+que `python -m benchmarks.planes`, sobre una base de prueba sembrada).
+"""
+import pytest
+from sqlalchemy import delete
+
+from app.models import db, Consulta, EventoEspera, Paciente, PacienteEspera
+from benchmarks.datos import sembrar
+from benchmarks.planes import revisar_planes
+
+PACIENTES = 5000
+
+
+@pytest.fixture(scope='module')
+def sembrada(app):
+    with db.engine.begin() as conn:
+        for modelo in (Consulta, EventoEspera, PacienteEspera, Paciente):
+            conn.execute(delete(modelo.__table__))
+    sembrar(db, PACIENTES)
+    with db.engine.connect() as conn:
+        yield conn
+
+
+def test_consultas_calientes_usan_indices(sembrada):
+    planes = revisar_planes(db, sembrada, (Paciente, Consulta, PacienteEspera), PACIENTES)
+    assert {nombre: problemas for nombre, problemas in planes.items() if problemas} == {}
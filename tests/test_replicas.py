@@ -0,0 +1,53 @@
+"""Enrutamiento a réplicas (app/replicas.py) de las sentencias de texto de la búsqueda."""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import busqueda, replicas
+from app.models import db
+
+
+@pytest.fixture
+def replica(app, monkeypatch):
+    replica = replicas.Replica('sqlite://', {})
+    monkeypatch.setattr(replicas.enrutador, 'replicas', [replica])
+    yield replica
+    replica.engine.dispose()
+
+
+@contextmanager
+def sentencias_por_base(engines):
+    """Anota a qué base va cada sentencia y ejecuta en su lugar una consulta vacía (SQLite no tiene pg_trgm)."""
+    sentencias = []
+    oyentes = []
+    for nombre, engine in engines.items():
+        def ejecutar(cursor, sentencia, parametros, contexto, nombre=nombre):
+            sentencias.append((nombre, sentencia.split()[0]))
+            cursor.execute("SELECT 1 WHERE 0")
+            return True
+        event.listen(engine, 'do_execute', ejecutar)
+        oyentes.append((engine, ejecutar))
+    try:
+        yield sentencias
+    finally:
+        for engine, ejecutar in oyentes:
+            event.remove(engine, 'do_execute', ejecutar)
+
+
+def test_busqueda_postgres_en_la_replica(app, replica, monkeypatch):
+    monkeypatch.setattr(busqueda, 'usar_postgres', True)
+    engines = {'primaria': db.engine, 'replica': replica.engine}
+    with sentencias_por_base(engines) as sentencias:
+        # Contexto propio por petición: g.replica no debe pasar de una a otra
+        with app.app_context(), app.test_request_context('/api/pacientes/buscar?q=ana'):
+            assert busqueda.buscar_pacientes('ana') == []
+            db.session.remove()
+        assert sentencias == [('replica', 'SET'), ('replica', 'SELECT')]
+
+        # En una escritura el mismo texto va a la primaria
+        sentencias.clear()
+        with app.app_context(), app.test_request_context('/pacientes/1', method='PATCH'):
+            busqueda.buscar_pacientes('ana')
+            db.session.remove()
+        assert sentencias == [('primaria', 'SET'), ('primaria', 'SELECT')]